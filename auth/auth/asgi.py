@@ -3,6 +3,12 @@ ASGI config for auth project.
 
 It exposes the ASGI callable as a module-level variable named ``application``.
 
+Serving through ASGI turns on the async login/registration views (see
+``ASYNC_AUTH_VIEWS``), which hash passwords on a bounded thread pool sized by
+``AUTH_HASHING_WORKERS`` and ``AUTH_HASHING_QUEUE``, e.g.:
+
+    gunicorn auth.asgi:application -k uvicorn.workers.UvicornWorker
+
 For more information on this file, see
 https://docs.djangoproject.com/en/4.1/howto/deployment/asgi/
 """
@@ -12,5 +18,6 @@ import os
 from django.core.asgi import get_asgi_application
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'auth.settings')
+os.environ.setdefault('ASYNC_AUTH_VIEWS', '1')
 
 application = get_asgi_application()
@@ -49,6 +49,7 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'authentication.metrics.MetricsMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -80,8 +81,12 @@ WSGI_APPLICATION = 'auth.wsgi.application'
 
 
 REST_FRAMEWORK = {
+    # Число доверенных прокси перед приложением: IP клиента для ограничения входов берётся из X-Forwarded-For
+    # только за ними; 0 — заголовок игнорируется и используется REMOTE_ADDR
+    'NUM_PROXIES': int(os.environ.get('NUM_PROXIES', 0)),
     'DEFAULT_AUTHENTICATION_CLASSES': [
-        'rest_framework.authentication.TokenAuthentication',
+        'authentication.authentication.CachedTokenAuthentication',
+        'authentication.tokens.SignedTokenAuthentication',
     ],
     'DEFAULT_FILTER_BACKENDS': [
         'rest_framework.filters.OrderingFilter',
@@ -89,16 +94,155 @@ REST_FRAMEWORK = {
     ],
 }
 
+# Число процессов-воркеров (gunicorn.conf.py читает ту же переменную). Больше одного — только с
+# общим кэшем: иначе сброс токенов, прав и ответов виден лишь своему воркеру (проверка authentication.E001)
+WORKER_PROCESSES = int(os.environ.get('WEB_CONCURRENCY', 1))
+
+# Кэш, общий для всех воркеров: Redis по REDIS_URL; без него — LocMemCache, видимый только своему процессу
+if os.environ.get('REDIS_URL'):
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+            'LOCATION': os.environ['REDIS_URL'],
+        }
+    }
+else:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        }
+    }
+
+# Кэш токенов: локальный LRU (в процессе) перед общим кэшем Django
+AUTH_TOKEN_CACHE = {
+    'CACHE_ALIAS': 'default',
+    'TIMEOUT': 300,
+    'LOCAL_MAXSIZE': 10000,
+    'LOCAL_TIMEOUT': 5,
+}
+
+# Keyset-пагинация списка профилей
+PROFILES_PAGINATION = {
+    'PAGE_SIZE': 50,
+    'MAX_PAGE_SIZE': 500,
+}
+
+# POST /api/profiles/batch/: сколько id и email можно запросить за раз
+PROFILES_BATCH = {
+    'MAX_SIZE': 100,
+}
+
+# Быстрое чтение профилей (list/retrieve) из .values() без ModelSerializer на каждую строку
+PROFILES_FAST_READ = True
+
+# Кэш готовых ответов list/retrieve профилей, сбрасываемый сигналами при изменениях
+PROFILES_RESPONSE_CACHE = {
+    'ENABLED': True,
+    'CACHE_ALIAS': 'default',
+    'TIMEOUT': 300,
+}
+
+# Фото профиля: проверка загрузки и фоновая генерация WebP-вариантов
+PHOTO_PROCESSING = {
+    'ASYNC': True,
+    'WORKERS': 2,
+    'MAX_UPLOAD_SIZE': 5 * 1024 * 1024,
+    'VARIANTS': {'thumbnail': 128, 'small': 320, 'medium': 800},
+}
+
+# Отдача media: 'django' (с поддержкой Range), 'x-sendfile' или 'x-accel-redirect'
+MEDIA_SERVING = {
+    'MODE': os.environ.get('MEDIA_SERVING_MODE', 'django'),
+    'ACCEL_PREFIX': '/protected-media/',
+}
+
+# Загрузки пишутся на диск по частям во временный файл, а не держатся в памяти
+FILE_UPLOAD_HANDLERS = ['django.core.files.uploadhandler.TemporaryFileUploadHandler']
+
+# Срок жизни токенов DRF: абсолютный и по простою (секунды); просроченные удаляет manage.py sweep_tokens.
+# По умолчанию выключены: включение сразу отзывает все токены старше срока (например, 30 и 7 дней)
+AUTH_TOKEN_EXPIRY = {
+    'ABSOLUTE_TTL': int(os.environ['AUTH_TOKEN_ABSOLUTE_TTL']) if os.environ.get('AUTH_TOKEN_ABSOLUTE_TTL') else None,
+    'IDLE_TTL': int(os.environ['AUTH_TOKEN_IDLE_TTL']) if os.environ.get('AUTH_TOKEN_IDLE_TTL') else None,
+    'ACTIVITY_RESOLUTION': 5 * 60,
+    'SWEEP_BATCH_SIZE': 500,
+}
+
+# last_login и last_seen: 'buffered' — копятся в памяти воркера и пишутся одним UPDATE раз в
+# FLUSH_INTERVAL секунд (и при остановке), 'sync' — last_login пишется при каждом входе, как в Django
+USER_ACTIVITY = {
+    'MODE': os.environ.get('USER_ACTIVITY_MODE', 'buffered'),
+    'FLUSH_INTERVAL': 10,
+}
+
+# Подписанные (HMAC) access/refresh токены, проверяемые без обращения к БД
+AUTH_SIGNED_TOKENS = {
+    'ENABLED': os.environ.get('AUTH_SIGNED_TOKENS', '0') == '1',
+    'ACCESS_TTL': 15 * 60,
+    'REFRESH_TTL': 7 * 24 * 60 * 60,
+}
+
+# POST /api/token/introspect/ (для шлюза, только is_staff): сколько токенов можно проверить за запрос
+TOKEN_INTROSPECTION = {
+    'MAX_TOKENS': 100,
+}
+
+# Ограничение попыток входа (/api/login/, /api/token/) по IP и email до проверки пароля. EMAIL_RATE считает
+# все попытки, и успешные тоже, с любых адресов: зная email, можно не пускать его владельца, пока идут
+# запросы (и ещё до 6 секунд после последнего при 10/min). Это плата за защиту от подбора с многих IP
+LOGIN_THROTTLE = {
+    'ENABLED': True,
+    'IP_RATE': '30/min',
+    'EMAIL_RATE': '10/min',
+    'STORE': os.environ.get('LOGIN_THROTTLE_STORE', 'cache'),
+}
+
+# Асинхронный режим (auth.asgi): хеширование паролей логина и регистрации в ограниченном пуле потоков
+ASYNC_AUTH_VIEWS = os.environ.get('ASYNC_AUTH_VIEWS', '0') == '1'
+
+AUTH_HASHING_POOL = {
+    'MAX_WORKERS': int(os.environ.get('AUTH_HASHING_WORKERS', 4)),
+    'MAX_QUEUE': int(os.environ.get('AUTH_HASHING_QUEUE', 64)),
+}
+
+# Swagger UI и /swagger.json|yaml; без них воркеры не загружают генератор схемы drf_yasg
+SWAGGER_ENABLED = os.environ.get('SWAGGER_ENABLED', '1') == '1'
+
 SWAGGER_SETTINGS = {
     'SECURITY_DEFINITIONS': {
         'Token': {
             'type': 'apiKey',
             'name': 'Authorization',
             'in': 'header'
+        },
+        'Bearer': {
+            'type': 'apiKey',
+            'name': 'Authorization',
+            'in': 'header'
         }
     },
+    # Swagger UI загружает схему с /swagger.json (готовый документ), а не генерирует её сам
+    'SPEC_URL': ('schema-json', {'format': '.json'}),
 }
 
+# OpenAPI-схема: 'lazy' — генерируется один раз на процесс, 'prebuilt' — читается из файлов
+# (manage.py build_openapi_schema), 'dynamic' — генерируется на каждый запрос
+OPENAPI_SCHEMA = {
+    'MODE': os.environ.get('OPENAPI_SCHEMA_MODE', 'lazy'),
+    'PATH': BASE_DIR / 'openapi',
+}
+
+# Метрики запросов (задержка, запросы к БД, хеширование, кэш токенов) на /metrics в формате Prometheus,
+# доступные только с loopback (METRICS_ALLOWED_IPS — свой список адресов и сетей через запятую);
+# при SLOW_REQUEST_SECONDS медленные запросы пишутся в журнал вместе с их SQL. С несколькими воркерами
+# METRICS_MULTIPROCESS_DIR — каталог, через который /metrics суммирует метрики всех воркеров
+METRICS = {
+    'ENABLED': True,
+    'SLOW_REQUEST_SECONDS': float(os.environ['SLOW_REQUEST_SECONDS']) if os.environ.get('SLOW_REQUEST_SECONDS') else None,
+    'MULTIPROCESS_DIR': os.environ.get('METRICS_MULTIPROCESS_DIR'),
+}
+if os.environ.get('METRICS_ALLOWED_IPS'):
+    METRICS['ALLOWED_IPS'] = os.environ['METRICS_ALLOWED_IPS'].split(',')
 
 
 # Database
@@ -108,9 +252,35 @@ DATABASES = {
     'default': {
         'ENGINE': 'django.db.backends.sqlite3',
         'NAME': BASE_DIR / 'db.sqlite3',
+        'CONN_MAX_AGE': int(os.environ.get('DATABASE_CONN_MAX_AGE', 60)),  # Соединение живёт между запросами
+        'CONN_HEALTH_CHECKS': True,
+        'OPTIONS': {
+            'timeout': 20,  # Ожидание блокировки записи (busy timeout), секунды
+        },
     }
 }
 
+# Реплика для чтения профилей; без DATABASE_REPLICA_NAME указывает на тот же файл и не используется
+DATABASES['replica'] = {
+    **DATABASES['default'],
+    'NAME': os.environ.get('DATABASE_REPLICA_NAME', DATABASES['default']['NAME']),
+    'TEST': {'MIRROR': 'default'},
+}
+
+DATABASE_ROUTERS = ['authentication.db.ReplicaRouter']
+
+DATABASE_READ_REPLICA = {
+    'ENABLED': bool(os.environ.get('DATABASE_REPLICA_NAME')),
+    'ALIAS': 'replica',
+    'STICKY_SECONDS': 5,
+}
+
+# Применяются к каждому новому соединению SQLite: WAL позволяет читать во время записи
+SQLITE_PRAGMAS = {
+    'journal_mode': 'WAL',
+    'synchronous': 'NORMAL',
+}
+
 
 # Password validation
 # https://docs.djangoproject.com/en/4.1/ref/settings/#auth-password-validators
@@ -130,8 +300,26 @@ AUTH_PASSWORD_VALIDATORS = [
     },
 ]
 
+# Тот же PBKDF2 (pbkdf2_sha256), но с замером времени хеширования для метрик; обычный
+# PBKDF2PasswordHasher не указан: хешеры с одинаковым алгоритмом заменяют друг друга
+PASSWORD_HASHERS = [
+    'authentication.hashers.InstrumentedPBKDF2PasswordHasher',
+    'django.contrib.auth.hashers.PBKDF2SHA1PasswordHasher',
+    'django.contrib.auth.hashers.Argon2PasswordHasher',
+    'django.contrib.auth.hashers.BCryptSHA256PasswordHasher',
+    'django.contrib.auth.hashers.ScryptPasswordHasher',
+]
+
 AUTH_USER_MODEL = 'authentication.CustomUser'
 
+# Проверки прав по битовым наборам из кэша (PERMISSION_CACHE) вместо JOIN по группам на каждый запрос
+AUTHENTICATION_BACKENDS = ['authentication.backends.CachedPermissionBackend']
+
+PERMISSION_CACHE = {
+    'CACHE_ALIAS': 'default',
+    'TIMEOUT': 5 * 60,
+}
+
 # Internationalization
 # https://docs.djangoproject.com/en/4.1/topics/i18n/
 
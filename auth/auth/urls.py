@@ -13,33 +13,24 @@ Including another URLconf
     1. Import the include() function: from django.urls import include, path
     2. Add a URL to urlpatterns:  path('blog/', include('blog.urls'))
 """
+import re
+
 from django.contrib import admin
 from django.urls import path, include, re_path
 from django.conf import settings
-from django.conf.urls.static import static
 
 from rest_framework.routers import DefaultRouter
-from rest_framework.authtoken.views import obtain_auth_token
-from rest_framework.authentication import TokenAuthentication
-from authentication.views import UserProfileViewSet, UserRegistrationView, UserLoginView, UserLogoutView
-from rest_framework import permissions
-from drf_yasg.views import get_schema_view
-from drf_yasg import openapi
+from authentication.views import UserProfileViewSet, UserRegistrationView, UserLoginView, UserLogoutView, \
+    TokenRefreshView, ThrottledObtainAuthToken, TokenIntrospectionView
+from authentication.async_views import async_login_view, async_registration_view
+from authentication.media import serve_media
+from authentication.metrics import metrics_view
 
 
-schema_view = get_schema_view(
-   openapi.Info(
-      title="Users API",
-      default_version='v1',
-      description="API for managing users",
-      terms_of_service="https://www.google.com/policies/terms/",
-      contact=openapi.Contact(email="dev@trophystays.com"),
-      license=openapi.License(name="BSD License"),
-   ),
-   public=True,
-   permission_classes=(permissions.AllowAny,),
-   authentication_classes=(TokenAuthentication,),
-)
+if settings.ASYNC_AUTH_VIEWS:
+    registration_view, login_view = async_registration_view, async_login_view
+else:
+    registration_view, login_view = UserRegistrationView.as_view(), UserLoginView.as_view()
 
 router = DefaultRouter()
 router.register(r'profiles', UserProfileViewSet)
@@ -53,17 +44,29 @@ urlpatterns = [
     path('api/', include(router.urls)),
 
     # Token auth endpoint
-    path('api/token/', obtain_auth_token, name='api_token_auth'),
+    path('api/token/', ThrottledObtainAuthToken.as_view(), name='api_token_auth'),
+    path('api/token/refresh/', TokenRefreshView.as_view(), name='token_refresh'),
+    path('api/token/introspect/', TokenIntrospectionView.as_view(), name='token_introspect'),
 
     # Registration, login, and logout endpoints
-    path('api/register/', UserRegistrationView.as_view(), name='register'),
-    path('api/login/', UserLoginView.as_view(), name='login'),
+    path('api/register/', registration_view, name='register'),
+    path('api/login/', login_view, name='login'),
     path('api/logout/', UserLogoutView.as_view(), name='logout'),
 
-    # Swagger schema
-    path('swagger/', schema_view.with_ui('swagger', cache_timeout=0), name='schema-swagger-ui'),
-    re_path(r'^swagger(?P<format>\.json|\.yaml)$', schema_view.without_ui(cache_timeout=0), name='schema-json'),
+    # Prometheus
+    path('metrics', metrics_view, name='metrics'),
 ]
 
-# Static and media settings
-urlpatterns += static(settings.MEDIA_URL, document_root=settings.MEDIA_ROOT)
+# Swagger schema: drf_yasg и генератор схемы загружаются, только если документация включена
+if settings.SWAGGER_ENABLED:
+    from authentication.schema import openapi_view, schema_view
+
+    urlpatterns += [
+        path('swagger/', schema_view.with_ui('swagger', cache_timeout=0), name='schema-swagger-ui'),
+        re_path(r'^swagger(?P<format>\.json|\.yaml)$', openapi_view, name='schema-json'),
+    ]
+
+# Media: фото профилей (в продакшене тело ответа отдаёт веб-сервер через X-Sendfile/X-Accel-Redirect)
+urlpatterns += [
+    re_path(r'^%s(?P<path>.*)$' % re.escape(settings.MEDIA_URL.lstrip('/')), serve_media, name='media'),
+]
@@ -0,0 +1,154 @@
+import atexit
+import logging
+import os
+import threading
+from itertools import islice
+
+from django.contrib.auth.models import update_last_login
+from django.db import close_old_connections
+from django.db.models import Case, DateTimeField, F, Value, When
+from django.utils import timezone
+
+from .conf import get_settings
+from .models import CustomUser
+
+logger = logging.getLogger(__name__)
+
+USER_ACTIVITY_DEFAULTS = {
+    'MODE': 'buffered',  # 'sync' — last_login пишется сразу при входе (как в Django), last_seen не ведётся
+    'FLUSH_INTERVAL': 10,  # Секунды: предел устаревания last_login/last_seen в БД
+    'MAX_PENDING': 10000,  # Столько пользователей в буфере вызывают досрочную запись
+    'BATCH_SIZE': 500,  # Пользователей на один UPDATE
+}
+
+FIELDS = ('last_login', 'last_seen')
+
+
+def get_activity_settings():
+    return get_settings('USER_ACTIVITY', USER_ACTIVITY_DEFAULTS)
+
+
+def is_buffered():
+    return get_activity_settings()['MODE'] == 'buffered'
+
+
+class ActivityBuffer:
+    """
+    Write-behind buffer of ``last_login``/``last_seen`` per user id.
+
+    Only the newest value per user is kept. Every ``FLUSH_INTERVAL`` a background
+    thread (started in each worker by ``gunicorn.conf.py`` through ``start_flusher()``) writes
+    the buffer with one ``UPDATE ... SET last_login = CASE id WHEN ...`` per
+    ``BATCH_SIZE`` users instead of an UPDATE per login. A buffer reaching
+    ``MAX_PENDING`` users wakes the thread to write it early (the request that filled it
+    does not wait for the UPDATE; without a thread it writes the buffer itself), and what
+    is left is written at exit.
+    """
+
+    def __init__(self):
+        self._pending = {}
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._wake = threading.Event()
+        self._flusher_wanted = False
+        self._flusher_pid = None
+        os.register_at_fork(after_in_child=self._after_fork)
+
+    def _after_fork(self):
+        # Поток записи мастера мог держать блокировку в момент fork; буфер мастера пишет мастер
+        self._pending = {}
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._wake = threading.Event()
+
+    def record(self, user_id, field, value):
+        conf = get_activity_settings()
+        with self._lock:
+            self._pending.setdefault(user_id, {})[field] = value
+            overflow = len(self._pending) >= conf['MAX_PENDING']
+        if self._flusher_wanted and self._flusher_pid != os.getpid():
+            self._start_flusher()  # Поток не переживает fork: воркер запускает свой
+        if overflow:
+            if self._flusher_pid == os.getpid():
+                self._wake.set()
+            else:
+                self.flush()
+
+    def pending(self):
+        with self._lock:
+            return len(self._pending)
+
+    def clear(self):
+        with self._lock:
+            self._pending.clear()
+
+    def flush(self):
+        """Write everything buffered; return the number of users updated."""
+        with self._flush_lock:
+            with self._lock:
+                pending, self._pending = self._pending, {}
+            if not pending:
+                return 0
+            try:
+                self._write(pending)
+            except Exception:
+                logger.exception('Could not write last_login/last_seen of %d users', len(pending))
+                with self._lock:
+                    # Записанные за это время значения новее возвращаемых
+                    for user_id, values in pending.items():
+                        self._pending[user_id] = {**values, **self._pending.get(user_id, {})}
+                return 0
+            return len(pending)
+
+    def _write(self, pending):
+        user_ids = iter(pending)
+        batch_size = get_activity_settings()['BATCH_SIZE']
+        while batch := list(islice(user_ids, batch_size)):
+            values = {}
+            for field in FIELDS:
+                whens = [When(pk=user_id, then=Value(pending[user_id][field])) for user_id in batch if field in pending[user_id]]
+                if whens:
+                    values[field] = Case(*whens, default=F(field), output_field=DateTimeField())
+            # update() без post_save: вход не сбрасывает кэши профиля и токенов
+            CustomUser.objects.filter(pk__in=batch).update(**values)
+
+    def start_flusher(self):
+        """Flush every ``FLUSH_INTERVAL`` from a daemon thread in this process (and in forked workers)."""
+        if not self._flusher_wanted:
+            self._flusher_wanted = True
+            atexit.register(self.flush)  # Остаток буфера при остановке воркера
+        self._start_flusher()
+
+    def _start_flusher(self):
+        with self._lock:
+            if self._flusher_pid == os.getpid():
+                return
+            self._flusher_pid = os.getpid()
+        threading.Thread(target=self._run_flusher, name='activity-flusher', daemon=True).start()
+
+    def _run_flusher(self):
+        while True:
+            if self._wake.wait(get_activity_settings()['FLUSH_INTERVAL']):
+                self._wake.clear()  # До записи: переполнение во время неё разбудит поток снова
+            close_old_connections()
+            try:
+                self.flush()
+            finally:
+                close_old_connections()
+
+
+user_activity = ActivityBuffer()
+
+
+def record_login(sender, request, user, **kwargs):
+    """``user_logged_in`` receiver replacing Django's ``update_last_login``."""
+    if not is_buffered():
+        update_last_login(sender, user, **kwargs)
+        return
+    user.last_login = timezone.now()
+    user_activity.record(user.pk, 'last_login', user.last_login)
+
+
+def record_seen(user_id):
+    if is_buffered():
+        user_activity.record(user_id, 'last_seen', timezone.now())
@@ -1,4 +1,5 @@
 from django.apps import AppConfig
+from django.db.models.signals import post_migrate
 
 
 class AuthenticationConfig(AppConfig):
@@ -6,4 +7,20 @@ class AuthenticationConfig(AppConfig):
     name = 'authentication'
 
     def ready(self):
+        import authentication.checks
+        import authentication.db
         import authentication.signals
+        from django.contrib.auth.signals import user_logged_in
+        from .activity import record_login
+
+        post_migrate.connect(create_search_index, sender=self)
+        # last_login пишет record_login: сразу (MODE 'sync') или через буфер (USER_ACTIVITY)
+        user_logged_in.disconnect(dispatch_uid='update_last_login')
+        user_logged_in.connect(record_login, dispatch_uid='record_login')
+
+
+def create_search_index(using, **kwargs):
+    from django.db import connections
+    from .search import ensure_search_index
+
+    ensure_search_index(connections[using])
@@ -0,0 +1,37 @@
+from functools import wraps
+
+from django.http import JsonResponse
+
+from .hashing import PoolSaturated, hashing_pool
+from .views import UserLoginView, UserRegistrationView
+
+
+def _call_view(view, request, *args, **kwargs):
+    response = view(request, *args, **kwargs)
+    if hasattr(response, 'render'):
+        response.render()
+    return response
+
+
+def offload_to_hashing_pool(view):
+    """
+    Turn a sync view that hashes passwords into an async view that runs it on the
+    bounded hashing pool, so the event loop and the thread that serves the other sync
+    views stay free while a burst of logins is being hashed.
+    """
+
+    @wraps(view)
+    async def async_view(request, *args, **kwargs):
+        try:
+            return await hashing_pool.run(_call_view, view, request, *args, **kwargs)
+        except PoolSaturated:
+            return JsonResponse(
+                {'message': 'Server is busy, please retry later'}, status=503, headers={'Retry-After': '1'}
+            )
+
+    # wraps() переносит cls/initkwargs (для drf_yasg) и csrf_exempt исходного APIView
+    return async_view
+
+
+async_login_view = offload_to_hashing_pool(UserLoginView.as_view())
+async_registration_view = offload_to_hashing_pool(UserRegistrationView.as_view())
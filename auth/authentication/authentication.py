@@ -0,0 +1,153 @@
+from django.core.cache import caches
+from django.utils import timezone
+from django.utils.translation import gettext_lazy as _
+from rest_framework import exceptions
+from rest_framework.authentication import TokenAuthentication
+
+from .activity import record_seen
+from .cache import LRUCache
+from .conf import get_settings
+from .expiry import token_activity
+from .metrics import record_token_cache
+
+TOKEN_CACHE_DEFAULTS = {
+    'CACHE_ALIAS': 'default',
+    'KEY_PREFIX': 'authtoken',
+    'TIMEOUT': 300,
+    'LOCAL_MAXSIZE': 10000,
+    # Entries in other processes' local caches are not invalidated, so this bounds how long
+    # a deleted token or changed user can still be served by another worker.
+    'LOCAL_TIMEOUT': 5,
+}
+
+
+class TokenCache:
+    """
+    Two-level cache of ``Token`` objects (with their user) keyed by the token key:
+    an in-process LRU in front of the Django cache backend, which all workers must share
+    (``checks.check_shared_caches``) for deletions to reach them.
+    """
+
+    def __init__(self):
+        self._local = None
+
+    @property
+    def conf(self):
+        return get_settings('AUTH_TOKEN_CACHE', TOKEN_CACHE_DEFAULTS)
+
+    @property
+    def local(self):
+        if self._local is None:
+            conf = self.conf
+            self._local = LRUCache(maxsize=conf['LOCAL_MAXSIZE'], timeout=conf['LOCAL_TIMEOUT'])
+        return self._local
+
+    @property
+    def shared(self):
+        return caches[self.conf['CACHE_ALIAS']]
+
+    def _key(self, key):
+        return f"{self.conf['KEY_PREFIX']}:{key}"
+
+    def _user_key(self, user_id):
+        return f"{self.conf['KEY_PREFIX']}:user:{user_id}"
+
+    def get(self, key):
+        token = self.local.get(key)
+        if token is not None:
+            record_token_cache('local')
+            return token
+        token = self.shared.get(self._key(key))
+        if token is not None:
+            self.local.set(key, token)
+        record_token_cache('miss' if token is None else 'shared')
+        return token
+
+    def get_many(self, keys):
+        """``{key: token}`` for the cached ``keys``: local hits first, then one shared ``get_many``."""
+        found, missing = {}, []
+        for key in keys:
+            token = self.local.get(key)
+            if token is None:
+                missing.append(key)
+            else:
+                found[key] = token
+                record_token_cache('local')
+        if missing:
+            shared = self.shared.get_many([self._key(key) for key in missing])
+            for key in missing:
+                token = shared.get(self._key(key))
+                if token is not None:
+                    self.local.set(key, token)
+                    found[key] = token
+                record_token_cache('miss' if token is None else 'shared')
+        return found
+
+    def set(self, token):
+        self.set_many([token])
+
+    def set_many(self, tokens):
+        values = {}
+        for token in tokens:
+            self.local.set(token.key, token)
+            values[self._key(token.key)] = token
+            values[self._user_key(token.user_id)] = token.key
+        if values:
+            self.shared.set_many(values, timeout=self.conf['TIMEOUT'])
+
+    def invalidate(self, key):
+        self.local.delete(key)
+        self.shared.delete(self._key(key))
+
+    def invalidate_user(self, user_id):
+        key = self.shared.get(self._user_key(user_id))
+        if key is not None:
+            self.invalidate(key)
+            self.shared.delete(self._user_key(user_id))
+
+    def clear(self):
+        self.local.clear()
+
+
+token_cache = TokenCache()
+
+
+def get_tokens(keys):
+    """``{key: token}`` (with the user) for the existing ``keys``; at most one query for cache misses."""
+    tokens = token_cache.get_many(keys)
+    missing = [key for key in keys if key not in tokens]
+    if missing:
+        loaded = list(TokenAuthentication().get_model().objects.select_related('user', 'activity').filter(key__in=missing))
+        token_cache.set_many(loaded)
+        tokens.update((token.key, token) for token in loaded)
+    return tokens
+
+
+class CachedTokenAuthentication(TokenAuthentication):
+    """
+    ``TokenAuthentication`` that resolves the token and its user through ``token_cache``
+    instead of querying the database on every request.
+    """
+
+    def authenticate_credentials(self, key):
+        token = token_cache.get(key)
+        if token is None:
+            model = self.get_model()
+            try:
+                token = model.objects.select_related('user', 'activity').get(key=key)
+            except model.DoesNotExist:
+                raise exceptions.AuthenticationFailed(_('Invalid token.'))
+            token_cache.set(token)
+
+        if not token.user.is_active:
+            raise exceptions.AuthenticationFailed(_('User inactive or deleted.'))
+
+        now = timezone.now()
+        if token_activity.is_expired(token, now):
+            # Удаление сбрасывает и кэш токена: повтор стоит один поиск ключа, а не перепроверку простоя
+            token.delete()
+            raise exceptions.AuthenticationFailed(_('Token has expired.'))
+        token_activity.touch(token, now)
+        record_seen(token.user_id)
+
+        return (token.user, token)
@@ -0,0 +1,34 @@
+from django.contrib.auth.backends import ModelBackend
+
+from .permissions import permission_cache
+
+
+class CachedPermissionBackend(ModelBackend):
+    """
+    ``ModelBackend`` whose permission checks read the user's bitsets from
+    ``permission_cache`` instead of joining the permission tables on every new user object.
+    """
+
+    def _get_permissions(self, user_obj, obj, from_name):
+        if not user_obj.is_active or user_obj.is_anonymous or obj is not None:
+            return set()
+        if user_obj.is_superuser:
+            return set(permission_cache.index())
+        user_bits, group_bits, _ = permission_cache.entry(user_obj)
+        return permission_cache.names(user_bits if from_name == 'user' else group_bits)
+
+    def get_all_permissions(self, user_obj, obj=None):
+        if not user_obj.is_active or user_obj.is_anonymous or obj is not None:
+            return set()
+        return self.get_user_permissions(user_obj) | self.get_group_permissions(user_obj)
+
+    def has_perm(self, user_obj, perm, obj=None):
+        if not user_obj.is_active or user_obj.is_anonymous or obj is not None:
+            return False
+        pk = permission_cache.index().get(perm)
+        if pk is None:
+            return False
+        if user_obj.is_superuser:
+            return True
+        user_bits, group_bits, _ = permission_cache.entry(user_obj)
+        return bool((user_bits | group_bits) >> pk & 1)
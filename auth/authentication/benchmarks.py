@@ -0,0 +1,96 @@
+import math
+import time
+from contextlib import contextmanager
+
+from django.db import connection
+
+
+@contextmanager
+def benchmark_database(verbosity=0):
+    """Run the block against a throwaway test database, the way the test runner does."""
+    old_name = connection.settings_dict['NAME']
+    connection.creation.create_test_db(verbosity=verbosity, autoclobber=True, serialize=False)
+    try:
+        yield
+    finally:
+        connection.creation.destroy_test_db(old_name, verbosity=verbosity)
+
+
+def measure(func, iterations):
+    """Call ``func`` ``iterations`` times and return the per-call durations in seconds."""
+    samples = []
+    for _ in range(iterations):
+        start = time.perf_counter()
+        func()
+        samples.append(time.perf_counter() - start)
+    return samples
+
+
+def percentile(samples, pct):
+    ordered = sorted(samples)
+    if not ordered:
+        return 0.0
+    index = max(0, math.ceil(pct / 100 * len(ordered)) - 1)
+    return ordered[index]
+
+
+def summarize(samples):
+    total = sum(samples)
+    return {
+        'count': len(samples),
+        'p50': percentile(samples, 50),
+        'p95': percentile(samples, 95),
+        'p99': percentile(samples, 99),
+        'throughput': len(samples) / total if total else 0.0,
+    }
+
+
+def seed_users(count, batch_size=5000, password='Bench-pass1'):
+    """
+    Insert ``count`` users with profiles using ``bulk_create`` and one shared password
+    hash. Returns the emails in insertion order; user ``i`` has ``user{i}@bench.example.com``
+    and phone ``+1415555{i:04d}``-style numbers where the range allows.
+    """
+    from django.contrib.auth.hashers import make_password
+
+    from .models import CustomUser, UserProfile
+    from .search import search_document
+
+    password_hash = make_password(password)
+    start = CustomUser.objects.count()
+    emails = []
+    for offset in range(start, start + count, batch_size):
+        users = CustomUser.objects.bulk_create([
+            CustomUser(email=f'user{i}@bench.example.com', password=password_hash)
+            for i in range(offset, min(offset + batch_size, start + count))
+        ])
+        profiles = []
+        for user in users:
+            i = int(user.email[4:user.email.index('@')])
+            phone = f'+1212{2000000 + i:07d}' if i < 8000000 else None
+            profiles.append(UserProfile(user=user, phone_number=phone, search_document=search_document(user.email, phone)))
+        UserProfile.objects.bulk_create(profiles)
+        emails.extend(user.email for user in users)
+    return emails
+
+
+def compare_to_baseline(results, baseline, latency_tolerance=2.0):
+    """
+    Regressions of ``results`` against ``baseline`` (both ``{mode: {endpoint: stats}}``):
+    any increase in the query count, or a p95 latency above ``latency_tolerance`` times
+    the baseline. Endpoints missing on either side are skipped.
+    """
+    failures = []
+    for mode, endpoints in baseline.items():
+        for name, expected in endpoints.items():
+            actual = results.get(mode, {}).get(name)
+            if actual is None:
+                continue
+            if expected.get('queries') is not None and (actual.get('queries') or 0) > expected['queries']:
+                failures.append(f"{mode} {name}: {actual['queries']} queries per request, baseline {expected['queries']}")
+            if actual['p95'] > expected['p95'] * latency_tolerance:
+                failures.append(
+                    f"{mode} {name}: p95 {actual['p95'] * 1000:.1f} ms, baseline {expected['p95'] * 1000:.1f} ms "
+                    f"(tolerance x{latency_tolerance})"
+                )
+    return failures
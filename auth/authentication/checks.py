@@ -0,0 +1,80 @@
+from django.conf import settings
+from django.core.checks import Error, Tags, Warning, register
+
+from .conf import get_settings
+
+# Бэкенды, данные которых видит только свой процесс
+PROCESS_LOCAL_CACHE_BACKENDS = (
+    'django.core.cache.backends.locmem.LocMemCache',
+    'django.core.cache.backends.dummy.DummyCache',
+)
+
+
+def shared_cache_features():
+    """``(feature, cache alias)`` of the enabled features whose state must be seen by every worker."""
+    from .authentication import TOKEN_CACHE_DEFAULTS
+    from .db import READ_REPLICA_DEFAULTS
+    from .permissions import PERMISSION_CACHE_DEFAULTS
+    from .response_cache import RESPONSE_CACHE_DEFAULTS
+    from .throttling import LOGIN_THROTTLE_DEFAULTS
+    from .tokens import SIGNED_TOKEN_DEFAULTS
+
+    features = [
+        ('AUTH_TOKEN_CACHE', get_settings('AUTH_TOKEN_CACHE', TOKEN_CACHE_DEFAULTS)['CACHE_ALIAS']),
+        ('PERMISSION_CACHE', get_settings('PERMISSION_CACHE', PERMISSION_CACHE_DEFAULTS)['CACHE_ALIAS']),
+        ('PROFILES conditional GET', 'default'),
+    ]
+    conf = get_settings('AUTH_SIGNED_TOKENS', SIGNED_TOKEN_DEFAULTS)
+    if conf['ENABLED']:
+        features.append(('AUTH_SIGNED_TOKENS', conf['CACHE_ALIAS']))
+    conf = get_settings('PROFILES_RESPONSE_CACHE', RESPONSE_CACHE_DEFAULTS)
+    if conf['ENABLED']:
+        features.append(('PROFILES_RESPONSE_CACHE', conf['CACHE_ALIAS']))
+    if get_settings('DATABASE_READ_REPLICA', READ_REPLICA_DEFAULTS)['ENABLED']:
+        features.append(('DATABASE_READ_REPLICA', 'default'))
+    conf = get_settings('LOGIN_THROTTLE', LOGIN_THROTTLE_DEFAULTS)
+    if conf['ENABLED'] and conf['STORE'] == 'cache':
+        features.append(('LOGIN_THROTTLE', conf['CACHE_ALIAS']))
+    return features
+
+
+def shared_cache_errors(workers):
+    """Errors for the enabled features that would keep their state in a process-local cache with ``workers``."""
+    if workers <= 1:
+        return []
+    errors = []
+    for feature, alias in shared_cache_features():
+        backend = settings.CACHES.get(alias, {}).get('BACKEND')
+        if backend in PROCESS_LOCAL_CACHE_BACKENDS:
+            errors.append(Error(
+                f'{feature} uses the process-local cache {alias!r} ({backend}) with {workers} worker processes.',
+                hint='Point the cache to Redis (REDIS_URL) or run a single worker process.',
+                id='authentication.E001',
+            ))
+    return errors
+
+
+@register(Tags.caches)
+def check_shared_caches(app_configs, **kwargs):
+    """
+    With more than one worker process (``WORKER_PROCESSES``) invalidations, revocations and
+    throttle counts written by one worker must reach the others, so a process-local cache
+    would keep serving deleted tokens and removed permissions until the entries expire.
+    """
+    return shared_cache_errors(getattr(settings, 'WORKER_PROCESSES', 1))
+
+
+@register()
+def check_multiprocess_metrics(app_configs, **kwargs):
+    """Without ``METRICS['MULTIPROCESS_DIR']`` each scrape sees one random worker's counters."""
+    from .metrics import get_metrics_settings
+
+    conf = get_metrics_settings()
+    if getattr(settings, 'WORKER_PROCESSES', 1) <= 1 or not conf['ENABLED'] or conf['MULTIPROCESS_DIR']:
+        return []
+    return [Warning(
+        f'/metrics reports one worker of WORKER_PROCESSES={settings.WORKER_PROCESSES}: counters jump between '
+        'scrapes and rate() is wrong.',
+        hint='Set METRICS_MULTIPROCESS_DIR to a directory writable by all workers.',
+        id='authentication.W002',
+    )]
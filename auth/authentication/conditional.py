@@ -0,0 +1,53 @@
+import hashlib
+
+from django.core.cache import cache
+from django.utils import timezone
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date, quote_etag
+
+PROFILES_CHANGED_KEY = 'profiles:changed-at'
+
+
+def mark_profiles_changed():
+    # Момент последнего изменения любого профиля: валидаторы списка строятся по нему, без агрегата по таблице
+    cache.set(PROFILES_CHANGED_KEY, timezone.now(), timeout=None)
+
+
+def profiles_changed_at():
+    changed_at = cache.get(PROFILES_CHANGED_KEY)
+    if changed_at is None:
+        # Метку вытеснили: список считается изменённым сейчас, иначе старая копия клиента получила бы 304
+        cache.add(PROFILES_CHANGED_KEY, timezone.now(), timeout=None)
+        changed_at = cache.get(PROFILES_CHANGED_KEY)
+    return changed_at
+
+
+class Validators:
+    """
+    ``ETag`` and ``Last-Modified`` of a profile representation, derived from
+    ``modified_at`` (and anything else that changes the response) without serializing.
+    """
+
+    def __init__(self, request, last_modified, *parts):
+        self.last_modified = last_modified
+        key = '|'.join([
+            request.get_full_path(),
+            request.get_host(),  # В ответе абсолютные URL фотографий
+            request.META.get('HTTP_ACCEPT', ''),
+            last_modified.isoformat() if last_modified else '',
+            *map(str, parts),
+        ])
+        self.etag = quote_etag(hashlib.md5(key.encode()).hexdigest())
+
+    def not_modified(self, request):
+        """Return a 304 response if the client's copy is current, else ``None``."""
+        timestamp = int(self.last_modified.timestamp()) if self.last_modified else None
+        response = get_conditional_response(request, etag=self.etag, last_modified=timestamp)
+        if response is not None:
+            self.set_headers(response)
+        return response
+
+    def set_headers(self, response):
+        response.headers['ETag'] = self.etag
+        if self.last_modified:
+            response.headers['Last-Modified'] = http_date(self.last_modified.timestamp())
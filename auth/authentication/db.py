@@ -0,0 +1,95 @@
+import contextvars
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db.backends.signals import connection_created
+from django.dispatch import receiver
+
+from .conf import get_settings
+
+READ_REPLICA_DEFAULTS = {
+    'ENABLED': False,
+    'ALIAS': 'replica',
+    'STICKY_SECONDS': 5,  # Сколько после записи читать с primary, пока реплика догоняет
+}
+
+SQLITE_PRAGMAS_DEFAULTS = {
+    'journal_mode': 'WAL',
+    'synchronous': 'NORMAL',
+}
+
+_read_alias = contextvars.ContextVar('read_alias', default=None)
+
+
+def get_replica_settings():
+    return get_settings('DATABASE_READ_REPLICA', READ_REPLICA_DEFAULTS)
+
+
+@receiver(connection_created)
+def configure_sqlite(sender, connection, **kwargs):
+    """
+    WAL lets readers run alongside the single writer, and ``synchronous=NORMAL`` syncs
+    only at checkpoints (still durable against application crashes in WAL mode).
+    """
+    if connection.vendor != 'sqlite':
+        return
+    pragmas = getattr(settings, 'SQLITE_PRAGMAS', SQLITE_PRAGMAS_DEFAULTS)
+    with connection.cursor() as cursor:
+        for name, value in pragmas.items():
+            cursor.execute(f'PRAGMA {name} = {value}')
+
+
+def _sticky_key(user_id):
+    return f'db-sticky:{user_id}'
+
+
+def mark_recent_write(user_id):
+    """Send the user's reads to the primary for ``STICKY_SECONDS`` (read-after-write)."""
+    conf = get_replica_settings()
+    if conf['ENABLED']:
+        cache.set_many({_sticky_key(user_id): True, 'db-sticky:last-write': time.time()}, conf['STICKY_SECONDS'])
+
+
+def is_sticky(user):
+    return bool(user and user.is_authenticated and cache.get(_sticky_key(user.pk)))
+
+
+def replica_may_lag():
+    """Whether anyone wrote recently enough for the replica to still be behind."""
+    last_write = cache.get('db-sticky:last-write')
+    return last_write is not None and time.time() - last_write < get_replica_settings()['STICKY_SECONDS']
+
+
+def use_replica_for(user):
+    """Switch reads in the current context to the replica unless ``user`` wrote recently."""
+    conf = get_replica_settings()
+    if not conf['ENABLED'] or conf['ALIAS'] not in settings.DATABASES or is_sticky(user):
+        return None
+    return _read_alias.set(conf['ALIAS'])
+
+
+def reset_read_alias(token):
+    _read_alias.reset(token)
+
+
+class ReplicaRouter:
+    """
+    Sends reads to the replica only inside ``use_replica_for`` (read-only profile
+    endpoints); everything else, and all writes, use ``default``.
+    """
+
+    def db_for_read(self, model, **hints):
+        return _read_alias.get()
+
+    def db_for_write(self, model, **hints):
+        return None
+
+    def allow_relation(self, obj1, obj2, **hints):
+        return True
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        # Реплика — копия primary, её схему не мигрируют отдельно
+        if db == get_replica_settings()['ALIAS']:
+            return False
+        return None
@@ -0,0 +1,106 @@
+from datetime import timedelta
+
+from django.db import IntegrityError
+from django.db.models import Q
+from rest_framework.authtoken.models import Token
+
+from .cache import LRUCache
+from .conf import get_settings
+from .models import TokenActivity
+
+TOKEN_EXPIRY_DEFAULTS = {
+    'ABSOLUTE_TTL': None,  # Секунды; None — без ограничения срока жизни
+    'IDLE_TTL': None,  # Секунды; None — без ограничения простоя
+    # Использование токена пишется в БД не чаще раза за столько секунд (на процесс)
+    'ACTIVITY_RESOLUTION': 5 * 60,
+    'LOCAL_MAXSIZE': 10000,
+    'SWEEP_BATCH_SIZE': 500,
+}
+
+
+def get_expiry_settings():
+    return get_settings('AUTH_TOKEN_EXPIRY', TOKEN_EXPIRY_DEFAULTS)
+
+
+class TokenActivityTracker:
+    """
+    Enforces the absolute and idle TTLs of DRF tokens.
+
+    The last use is the latest of the token's creation, the ``TokenActivity`` row loaded
+    with the token and the uses this process has written. A use is written (one upsert)
+    only once the last known one is ``ACTIVITY_RESOLUTION`` old, so busy tokens cost a
+    write every few minutes, not every request. Another worker may have written a newer
+    use, so a token that looks idle is re-read from the database before it is rejected.
+    """
+
+    def __init__(self):
+        self._seen = None
+
+    @property
+    def conf(self):
+        return get_expiry_settings()
+
+    @property
+    def seen(self):
+        if self._seen is None:
+            self._seen = LRUCache(maxsize=self.conf['LOCAL_MAXSIZE'])
+        return self._seen
+
+    def last_used(self, token):
+        stamps = [token.created, self.seen.get(token.key)]
+        if Token.activity.is_cached(token):
+            try:
+                stamps.append(token.activity.last_used)
+            except TokenActivity.DoesNotExist:
+                pass
+        return max(stamp for stamp in stamps if stamp is not None)
+
+    def is_expired(self, token, now):
+        conf = self.conf
+        if conf['ABSOLUTE_TTL'] is not None and now - token.created > timedelta(seconds=conf['ABSOLUTE_TTL']):
+            return True
+        if conf['IDLE_TTL'] is None:
+            return False
+        idle = timedelta(seconds=conf['IDLE_TTL'])
+        if now - self.last_used(token) <= idle:
+            return False
+        last_used = TokenActivity.objects.filter(token=token.key).values_list('last_used', flat=True).first()
+        if last_used is None or now - last_used > idle:
+            return True
+        self.seen.set(token.key, last_used)
+        return False
+
+    def touch(self, token, now):
+        conf = self.conf
+        if conf['IDLE_TTL'] is None or now - self.last_used(token) < timedelta(seconds=conf['ACTIVITY_RESOLUTION']):
+            return
+        try:
+            TokenActivity.objects.bulk_create(
+                [TokenActivity(token_id=token.key, last_used=now)],
+                update_conflicts=True, unique_fields=['token'], update_fields=['last_used'],
+            )
+        except IntegrityError:
+            return  # Токен удалён параллельным выходом
+        self.seen.set(token.key, now)
+
+    def clear(self):
+        self.seen.clear()
+
+
+token_activity = TokenActivityTracker()
+
+
+def expired_token_filters(now):
+    """
+    Conditions matching expired tokens, one per index: ``created`` for the absolute
+    TTL and never-used tokens, ``last_used`` for the rest.
+    """
+    conf = get_expiry_settings()
+    filters = []
+    if conf['ABSOLUTE_TTL'] is not None:
+        filters.append(Q(created__lt=now - timedelta(seconds=conf['ABSOLUTE_TTL'])))
+    if conf['IDLE_TTL'] is not None:
+        cutoff = now - timedelta(seconds=conf['IDLE_TTL'])
+        filters.append(Q(activity__isnull=True, created__lt=cutoff))
+        filters.append(Q(activity__last_used__lt=cutoff))
+    return filters
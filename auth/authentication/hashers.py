@@ -0,0 +1,20 @@
+import time
+
+from django.contrib.auth.hashers import PBKDF2PasswordHasher
+
+from .metrics import record_hashing
+
+
+class InstrumentedPBKDF2PasswordHasher(PBKDF2PasswordHasher):
+    """
+    ``PBKDF2PasswordHasher`` that reports the time of every ``encode`` (hashing, checking
+    and ``harden_runtime`` all go through it). Same algorithm name, so existing hashes
+    stay valid.
+    """
+
+    def encode(self, password, salt, iterations=None):
+        started = time.perf_counter()
+        try:
+            return super().encode(password, salt, iterations)
+        finally:
+            record_hashing(time.perf_counter() - started)
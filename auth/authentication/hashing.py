@@ -0,0 +1,79 @@
+import asyncio
+import contextvars
+import functools
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from django.db import close_old_connections
+
+from .conf import get_settings
+
+HASHING_POOL_DEFAULTS = {
+    'MAX_WORKERS': 4,
+    'MAX_QUEUE': 64,
+}
+
+
+class PoolSaturated(Exception):
+    pass
+
+
+def _run_job(func, *args, **kwargs):
+    # Потоки пула держат собственные соединения с БД, закрываем их как в конце запроса
+    close_old_connections()
+    try:
+        return func(*args, **kwargs)
+    finally:
+        close_old_connections()
+
+
+class HashingPool:
+    """
+    Bounded thread pool for password hashing and checking.
+
+    At most ``MAX_WORKERS`` jobs run at once and at most ``MAX_QUEUE`` more wait for a
+    worker; anything beyond that is rejected with ``PoolSaturated`` instead of queueing
+    without limit.
+    """
+
+    def __init__(self):
+        self._executor = None
+        self._slots = None
+        self._lock = threading.Lock()
+
+    def _get(self):
+        if self._executor is None:
+            with self._lock:
+                if self._executor is None:
+                    conf = get_settings('AUTH_HASHING_POOL', HASHING_POOL_DEFAULTS)
+                    self._slots = threading.BoundedSemaphore(conf['MAX_WORKERS'] + conf['MAX_QUEUE'])
+                    self._executor = ThreadPoolExecutor(
+                        max_workers=conf['MAX_WORKERS'], thread_name_prefix='hashing'
+                    )
+        return self._executor, self._slots
+
+    def submit(self, func, *args, **kwargs):
+        executor, slots = self._get()
+        if not slots.acquire(blocking=False):
+            raise PoolSaturated
+        context = contextvars.copy_context()
+        try:
+            future = executor.submit(context.run, functools.partial(_run_job, func, *args, **kwargs))
+        except BaseException:
+            slots.release()
+            raise
+        # Слот освобождается по завершении задачи, даже если клиент уже отключился
+        future.add_done_callback(lambda f: slots.release())
+        return future
+
+    async def run(self, func, *args, **kwargs):
+        return await asyncio.wrap_future(self.submit(func, *args, **kwargs))
+
+    def shutdown(self, wait=True):
+        with self._lock:
+            if self._executor is not None:
+                self._executor.shutdown(wait=wait)
+                self._executor = self._slots = None
+
+
+hashing_pool = HashingPool()
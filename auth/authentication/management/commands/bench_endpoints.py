@@ -0,0 +1,180 @@
+import json
+import time
+import urllib.error
+import urllib.request
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test import override_settings
+from django.test.testcases import LiveServerThread
+from django.test.utils import CaptureQueriesContext
+from rest_framework.authtoken.models import Token
+from rest_framework.test import APIClient
+
+from authentication.benchmarks import benchmark_database, compare_to_baseline, seed_users, summarize
+from authentication.models import CustomUser, UserProfile
+
+ENDPOINTS = ('register', 'login', 'list', 'retrieve', 'update', 'search', 'logout')
+HASHING_ENDPOINTS = {'register', 'login'}  # Каждый запрос — полный PBKDF2, им хватает меньшего числа итераций
+PASSWORD = 'Bench-pass1'
+
+
+class ClientTransport:
+    """Requests through the Django test client, counting queries per request."""
+
+    name = 'client'
+
+    def __init__(self):
+        self.client = APIClient()
+
+    def request(self, method, path, data=None, token=None):
+        headers = {'HTTP_AUTHORIZATION': f'Token {token}'} if token else {}
+        body = json.dumps(data) if data is not None else None
+        with CaptureQueriesContext(connection) as queries:
+            started = time.perf_counter()
+            response = self.client.generic(method, path, body, 'application/json', **headers)
+            elapsed = time.perf_counter() - started
+        return response.status_code, elapsed, len(queries)
+
+
+class LiveTransport:
+    """Real HTTP requests to a live local server thread (queries are not visible from here)."""
+
+    name = 'live'
+
+    def __init__(self):
+        self.thread = LiveServerThread('localhost', lambda handler: handler)
+        self.thread.daemon = True
+        self.thread.start()
+        self.thread.is_ready.wait()
+        if self.thread.error:
+            raise self.thread.error
+        self.base_url = f'http://localhost:{self.thread.port}'
+
+    def request(self, method, path, data=None, token=None):
+        headers = {'Content-Type': 'application/json'}
+        if token:
+            headers['Authorization'] = f'Token {token}'
+        body = json.dumps(data).encode() if data is not None else None
+        request = urllib.request.Request(self.base_url + path, data=body, headers=headers, method=method)
+        started = time.perf_counter()
+        try:
+            with urllib.request.urlopen(request) as response:
+                response.read()
+                status = response.status
+        except urllib.error.HTTPError as e:
+            status = e.code
+        return status, time.perf_counter() - started, None
+
+    def close(self):
+        self.thread.terminate()
+
+
+class Command(BaseCommand):
+    help = (
+        'Latency, throughput and query-count benchmark of the auth endpoints on a seeded dataset, '
+        'through the test client and/or a live local server. --check fails on regressions '
+        'against a stored baseline.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=10000, help='Seeded users, e.g. 10000 to 1000000')
+        parser.add_argument('--iterations', type=int, default=200)
+        parser.add_argument('--hash-iterations', type=int, default=20, help='Iterations for register and login')
+        parser.add_argument('--mode', choices=['client', 'live', 'both'], default='client')
+        parser.add_argument('--endpoints', nargs='+', choices=ENDPOINTS, default=list(ENDPOINTS))
+        parser.add_argument('--response-cache', action='store_true',
+                            help='Keep the profile response cache on (by default it is off to measure real work)')
+        parser.add_argument('--save-baseline', metavar='PATH', help='Write the results as a JSON baseline')
+        parser.add_argument('--check', metavar='PATH', help='Fail if results regress against this baseline')
+        parser.add_argument('--latency-tolerance', type=float, default=2.0,
+                            help='Allowed p95 slowdown factor in --check mode')
+
+    def handle(self, *args, **options):
+        modes = ['client', 'live'] if options['mode'] == 'both' else [options['mode']]
+        overrides = override_settings(
+            LOGIN_THROTTLE={'ENABLED': False},
+            PROFILES_RESPONSE_CACHE={'ENABLED': options['response_cache']},
+            ALLOWED_HOSTS=['localhost', 'testserver'],
+        )
+        results = {}
+        with benchmark_database(), overrides:
+            started = time.monotonic()
+            self.emails = seed_users(options['users'], password=PASSWORD)
+            self.stdout.write(f"Seeded {options['users']} users in {time.monotonic() - started:.1f}s")
+            self.prepare()
+            for mode in modes:
+                transport = ClientTransport() if mode == 'client' else LiveTransport()
+                try:
+                    results[mode] = self.run_mode(transport, options)
+                finally:
+                    if mode == 'live':
+                        transport.close()
+
+        if options['save_baseline']:
+            with open(options['save_baseline'], 'w') as f:
+                json.dump(results, f, indent=2, sort_keys=True)
+            self.stdout.write(f"Baseline written to {options['save_baseline']}")
+        if options['check']:
+            with open(options['check']) as f:
+                failures = compare_to_baseline(results, json.load(f), options['latency_tolerance'])
+            if failures:
+                raise CommandError('Benchmark regressions:\n' + '\n'.join(failures))
+            self.stdout.write(self.style.SUCCESS('No regressions against the baseline.'))
+
+    def prepare(self):
+        # Разные пользователи для разных сценариев: логин и выход меняют токены
+        self.reader = CustomUser.objects.get(email=self.emails[0])
+        self.leaver = CustomUser.objects.get(email=self.emails[1])
+        self.login_emails = self.emails[2:] or self.emails
+        self.token = Token.objects.get_or_create(user=self.reader)[0].key
+        self.profile_ids = list(UserProfile.objects.order_by('id').values_list('id', flat=True)[:1000])
+        self.own_profile = self.reader.profile.pk
+
+    def scenario(self, endpoint, i, run_id):
+        """``(method, path, data, token)`` of the ``i``-th request; untimed setup happens here."""
+        if endpoint == 'register':
+            email = f'bench-{run_id}-{i}@register.example.com'
+            return 'POST', '/api/register/', {
+                'email': email, 'first_name': 'Bench', 'last_name': 'User', 'password': PASSWORD,
+                'password2': PASSWORD, 'profile': {'additional_info': ''},
+            }, None
+        if endpoint == 'login':
+            email = self.login_emails[i % len(self.login_emails)]
+            return 'POST', '/api/login/', {'email': email, 'password': PASSWORD}, None
+        if endpoint == 'list':
+            return 'GET', '/api/profiles/', None, self.token
+        if endpoint == 'retrieve':
+            return 'GET', f'/api/profiles/{self.profile_ids[i % len(self.profile_ids)]}/', None, self.token
+        if endpoint == 'update':
+            return 'PATCH', f'/api/profiles/{self.own_profile}/', {'additional_info': f'bench {i}'}, self.token
+        if endpoint == 'search':
+            return 'GET', f'/api/profiles/?search=user{(i * 7919) % len(self.emails)}@', None, self.token
+        if endpoint == 'logout':
+            token = Token.objects.get_or_create(user=self.leaver)[0].key
+            return 'POST', '/api/logout/', None, token
+        raise ValueError(endpoint)
+
+    def run_mode(self, transport, options):
+        self.stdout.write(f"\n[{transport.name}] {'endpoint':<10}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}"
+                          f"{'req/s':>10}{'queries':>9}")
+        results = {}
+        for endpoint in options['endpoints']:
+            iterations = options['hash_iterations'] if endpoint in HASHING_ENDPOINTS else options['iterations']
+            samples, query_counts = [], []
+            for i in range(iterations):
+                status, elapsed, queries = transport.request(*self.scenario(endpoint, i, transport.name))
+                if status >= 400:
+                    raise CommandError(f'{endpoint} request {i} failed with HTTP {status}')
+                samples.append(elapsed)
+                if queries is not None:
+                    query_counts.append(queries)
+            stats = summarize(samples)
+            stats['queries'] = max(query_counts) if query_counts else None
+            results[endpoint] = stats
+            queries = '-' if stats['queries'] is None else stats['queries']
+            self.stdout.write(
+                f"{' ' * (len(transport.name) + 3)}{endpoint:<10}{stats['p50'] * 1000:>10.2f}{stats['p95'] * 1000:>10.2f}"
+                f"{stats['p99'] * 1000:>10.2f}{stats['throughput']:>10.0f}{queries:>9}"
+            )
+        return results
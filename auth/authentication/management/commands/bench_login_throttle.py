@@ -0,0 +1,66 @@
+import time
+from unittest import mock
+
+from django.contrib.auth.hashers import PBKDF2PasswordHasher
+from django.core.management.base import BaseCommand
+from django.test import override_settings
+from rest_framework.test import APIRequestFactory
+
+from authentication.benchmarks import benchmark_database, seed_users
+from authentication.throttling import login_throttle
+from authentication.views import UserLoginView
+
+
+class Command(BaseCommand):
+    help = (
+        'Replay credential-stuffing attacks at increasing rates against the login view and report '
+        'CPU time and password hashes. With LOGIN_THROTTLE both stay flat as the rate grows.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rates', type=int, nargs='+', default=[10, 100, 1000], help='Attempts per second')
+        parser.add_argument('--seconds', type=float, default=2.0, help='Simulated attack duration')
+        parser.add_argument('--emails', type=int, default=20, help='Distinct targeted accounts')
+        parser.add_argument('--ips', type=int, default=5, help='Distinct attacker addresses')
+        parser.add_argument('--baseline', action='store_true',
+                            help='Also replay without throttling (hashes every attempt, slow)')
+
+    def handle(self, *args, **options):
+        with benchmark_database():
+            emails = seed_users(options['emails'])
+            self.view = UserLoginView.as_view()
+            self.factory = APIRequestFactory()
+
+            self.stdout.write(f"{'rate/s':>8}{'attempts':>10}{'throttle':>10}{'cpu ms':>10}{'hashes':>8}{'429s':>8}")
+            for rate in options['rates']:
+                for enabled in ((False, True) if options['baseline'] else (True,)):
+                    cpu, hashes, rejected, attempts = self.replay(rate, enabled, emails, options)
+                    self.stdout.write(
+                        f"{rate:>8}{attempts:>10}{'on' if enabled else 'off':>10}{cpu * 1000:>10.0f}{hashes:>8}{rejected:>8}"
+                    )
+
+    def replay(self, rate, enabled, emails, options):
+        login_throttle.reset()
+        attempts = int(rate * options['seconds'])
+        now = [0.0]
+        verify = PBKDF2PasswordHasher.verify
+        with override_settings(LOGIN_THROTTLE={'ENABLED': enabled, 'STORE': 'local'}), \
+                mock.patch.object(PBKDF2PasswordHasher, 'verify', autospec=True, side_effect=verify) as hasher:
+            # Время атаки моделируется: ведра пополняются по частоте попыток, а не по длительности хеширования
+            buckets = login_throttle.buckets()
+            buckets.clock = lambda: now[0]
+            rejected = 0
+            started = time.process_time()
+            try:
+                for i in range(attempts):
+                    now[0] = i / rate
+                    request = self.factory.post(
+                        '/api/login/',
+                        {'email': emails[i % len(emails)], 'password': f'guess{i}'},
+                        REMOTE_ADDR=f'203.0.113.{i % options["ips"] + 1}',
+                    )
+                    rejected += self.view(request).status_code == 429
+            finally:
+                del buckets.clock
+            cpu = time.process_time() - started
+        return cpu, hasher.call_count, rejected, attempts
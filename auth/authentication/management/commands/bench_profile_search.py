@@ -0,0 +1,45 @@
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import connection
+from rest_framework import filters
+from rest_framework.request import Request
+from rest_framework.test import APIRequestFactory
+
+from authentication.benchmarks import benchmark_database, measure, seed_users, summarize
+from authentication.models import UserProfile
+from authentication.search import ProfileSearchFilter, has_search_index
+from authentication.views import UserProfileViewSet
+
+
+class Command(BaseCommand):
+    help = 'Compare the icontains SearchFilter with the indexed profile search on a seeded dataset.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--profiles', type=int, default=100000, help='Dataset size, e.g. 1000000')
+        parser.add_argument('--iterations', type=int, default=20)
+        parser.add_argument('--terms', nargs='+', default=['user4242@', 'bench.example', '2122004242', 'nomatch'])
+
+    def handle(self, *args, **options):
+        with benchmark_database():
+            started = time.monotonic()
+            seed_users(options['profiles'])
+            self.stdout.write(f"Seeded {options['profiles']} profiles in {time.monotonic() - started:.1f}s "
+                              f"(FTS5 trigram index: {'yes' if has_search_index(connection) else 'no'})")
+
+            factory = APIRequestFactory()
+            view = UserProfileViewSet()
+            queryset = UserProfile.objects.select_related('user')
+            backends = [('SearchFilter (icontains)', filters.SearchFilter()), ('ProfileSearchFilter', ProfileSearchFilter())]
+
+            self.stdout.write(f"{'term':<16}{'backend':<28}{'p50 ms':>10}{'p95 ms':>10}{'rows':>8}")
+            for term in options['terms']:
+                request = Request(factory.get('/', {'search': term}))
+                for name, backend in backends:
+                    # Первая страница списка, как в API
+                    run = lambda: list(backend.filter_queryset(request, queryset, view).order_by('-created_at', '-id')[:50])
+                    rows = len(run())
+                    stats = summarize(measure(run, options['iterations']))
+                    self.stdout.write(
+                        f"{term:<16}{name:<28}{stats['p50'] * 1e3:>10.2f}{stats['p95'] * 1e3:>10.2f}{rows:>8}"
+                    )
@@ -0,0 +1,45 @@
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.test import override_settings
+from django.test.utils import CaptureQueriesContext
+from rest_framework.authentication import TokenAuthentication
+from rest_framework.authtoken.models import Token
+from rest_framework.request import Request
+from rest_framework.test import APIRequestFactory
+
+from authentication.authentication import CachedTokenAuthentication, token_cache
+from authentication.benchmarks import benchmark_database, measure, summarize
+from authentication.models import CustomUser
+from authentication.tokens import SignedTokenAuthentication, issue_token
+
+
+class Command(BaseCommand):
+    help = 'Compare per-request verification cost of opaque, cached and signed tokens.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--iterations', type=int, default=10000)
+
+    def handle(self, *args, **options):
+        iterations = options['iterations']
+        with benchmark_database(), override_settings(AUTH_SIGNED_TOKENS={'ENABLED': True}):
+            user = CustomUser.objects.create_user(email='bench@example.com', password='Bench-pass1')
+            token = Token.objects.create(user=user)
+            token_cache.clear()
+
+            factory = APIRequestFactory()
+            cases = [
+                ('TokenAuthentication', TokenAuthentication(), f'Token {token.key}'),
+                ('CachedTokenAuthentication', CachedTokenAuthentication(), f'Token {token.key}'),
+                ('SignedTokenAuthentication', SignedTokenAuthentication(), f'Bearer {issue_token(user)}'),
+            ]
+
+            self.stdout.write(f"{'backend':<28}{'p50 us':>10}{'p99 us':>10}{'ops/s':>12}{'queries':>10}")
+            for name, backend, header in cases:
+                request = Request(factory.get('/', HTTP_AUTHORIZATION=header))
+                backend.authenticate(request)  # прогрев кэшей
+                with CaptureQueriesContext(connection) as queries:
+                    stats = summarize(measure(lambda: backend.authenticate(request), iterations))
+                self.stdout.write(
+                    f"{name:<28}{stats['p50'] * 1e6:>10.1f}{stats['p99'] * 1e6:>10.1f}"
+                    f"{stats['throughput']:>12.0f}{len(queries) / iterations:>10.2f}"
+                )
@@ -0,0 +1,49 @@
+import time
+from pathlib import Path
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from authentication.schema import FORMATS, generate_schema, get_schema_settings, schema_filename
+
+
+class Command(BaseCommand):
+    help = (
+        'Generate the OpenAPI schema (JSON and YAML) for OPENAPI_SCHEMA["MODE"] = "prebuilt". '
+        'With --check, fail if the stored files are missing or differ from the current code.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--output-dir', help='Directory for openapi.json/openapi.yaml (default: OPENAPI_SCHEMA["PATH"])')
+        parser.add_argument('--check', action='store_true', help='Only compare with the stored schema, write nothing')
+
+    def handle(self, *args, **options):
+        if not settings.SWAGGER_ENABLED:
+            # Аннотации представлений (authentication.swagger) без drf_yasg не загружаются: схема вышла бы неполной
+            raise CommandError('SWAGGER_ENABLED is off: run with SWAGGER_ENABLED=1 to build the schema.')
+        path = Path(options['output_dir'] or get_schema_settings()['PATH'])
+        started = time.monotonic()
+        documents = generate_schema()
+        elapsed = time.monotonic() - started
+
+        if options['check']:
+            stale = [
+                schema_filename(fmt) for fmt in FORMATS
+                if not (path / schema_filename(fmt)).is_file() or (path / schema_filename(fmt)).read_bytes() != documents[fmt]
+            ]
+            if stale:
+                raise CommandError(
+                    f"Stored OpenAPI schema is stale or missing in {path}: {', '.join(stale)}. "
+                    f"Run manage.py build_openapi_schema."
+                )
+            self.stdout.write(self.style.SUCCESS(f'OpenAPI schema in {path} is up to date.'))
+            return
+
+        path.mkdir(parents=True, exist_ok=True)
+        for fmt, body in documents.items():
+            tmp = path / f'{schema_filename(fmt)}.tmp'
+            tmp.write_bytes(body)
+            tmp.replace(path / schema_filename(fmt))
+        self.stdout.write(self.style.SUCCESS(
+            f"Wrote {', '.join(schema_filename(fmt) for fmt in FORMATS)} to {path} (generated in {elapsed * 1000:.0f} ms)."
+        ))
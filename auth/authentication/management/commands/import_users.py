@@ -0,0 +1,244 @@
+import csv
+import json
+import os
+import re
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+from itertools import islice
+
+import django
+import phonenumbers
+from django.contrib.auth.hashers import make_password
+from django.core.exceptions import ValidationError
+from django.core.management.base import BaseCommand, CommandError
+from django.core.validators import validate_email
+from django.db import IntegrityError, connection, transaction
+
+from authentication.models import CustomUser, UserProfile
+from authentication.response_cache import response_cache
+from authentication.search import search_document
+
+NAME_FIELDS = ('first_name', 'last_name')
+FLAG_FIELDS = ('is_property_owner', 'is_admin')
+NAME_RE = re.compile('^[a-zA-Z]*$')  # Как в CustomUser.clean
+TRUE_VALUES = {'1', 'true', 'yes', 'y', 't'}
+INSERT_ATTEMPTS = 3  # Попыток вставить пачку целиком, пока параллельные регистрации занимают email
+
+
+def _init_worker():
+    # Для spawn-воркеров (macOS/Windows): настройки Django не наследуются от родителя
+    os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'auth.settings')
+    django.setup()
+
+
+def read_rows(stream, fmt):
+    """Yield ``(row_number, dict)`` pairs from a CSV or JSONL stream without loading it whole."""
+    if fmt == 'csv':
+        for number, row in enumerate(csv.DictReader(stream), start=1):
+            yield number, row
+    else:
+        for number, line in enumerate(stream, start=1):
+            line = line.strip()
+            if line:
+                try:
+                    yield number, json.loads(line)
+                except ValueError:
+                    yield number, None
+
+
+def clean_row(row):
+    """Return a normalized copy of ``row`` or raise ``ValueError`` with the rejection reason."""
+    if not isinstance(row, dict):
+        raise ValueError('Malformed row')
+
+    email = CustomUser.objects.normalize_email((row.get('email') or '').strip())
+    if not email:
+        raise ValueError('The Email must be set')
+    try:
+        validate_email(email)
+    except ValidationError:
+        raise ValueError('Invalid email address')
+    if len(email) > CustomUser._meta.get_field('email').max_length:
+        raise ValueError('Email is too long')
+
+    cleaned = {'email': email, 'password': row.get('password') or None}
+    for field in NAME_FIELDS:
+        value = (row.get(field) or '').strip()
+        if not NAME_RE.match(value):
+            raise ValueError(f'{field} must contain only letters')
+        if len(value) > 150:
+            raise ValueError(f'{field} is too long')
+        cleaned[field] = value
+    for field in FLAG_FIELDS:
+        value = row.get(field)
+        cleaned[field] = value if isinstance(value, bool) else str(value or '').strip().lower() in TRUE_VALUES
+
+    phone = (row.get('phone_number') or '').strip()
+    if phone:
+        try:
+            parsed = phonenumbers.parse(phone, None)
+        except phonenumbers.NumberParseException:
+            raise ValueError('Invalid phone number format')
+        if not phonenumbers.is_valid_number(parsed):
+            raise ValueError('The phone number entered is not valid')
+        phone = phonenumbers.format_number(parsed, phonenumbers.PhoneNumberFormat.E164)
+    cleaned['phone_number'] = phone or None
+    cleaned['additional_info'] = row.get('additional_info') or ''
+    return cleaned
+
+
+class Command(BaseCommand):
+    help = (
+        'Bulk import users with profiles from CSV or JSONL. Passwords are hashed on a process pool '
+        'and rows are inserted with bulk_create, bypassing per-instance save signals.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help="CSV/JSONL file, or '-' for stdin")
+        parser.add_argument('--format', choices=['csv', 'jsonl'], help='Input format (default: by file extension)')
+        parser.add_argument('--batch-size', type=int, default=1000)
+        parser.add_argument('--workers', type=int, default=os.cpu_count() or 1, help='Hashing processes')
+        parser.add_argument('--checkpoint', help='Checkpoint file (default: <path>.checkpoint)')
+        parser.add_argument('--resume', action='store_true', help='Skip rows up to the stored checkpoint')
+        parser.add_argument('--rejects', help='CSV report of rejected rows (default: <path>.rejects.csv)')
+
+    def handle(self, *args, **options):
+        path = options['path']
+        fmt = options['format'] or ('jsonl' if path.endswith(('.jsonl', '.ndjson')) else 'csv')
+        base = 'import_users' if path == '-' else path
+        checkpoint_path = options['checkpoint'] or f'{base}.checkpoint'
+        rejects_path = options['rejects'] or f'{base}.rejects.csv'
+        batch_size = options['batch_size']
+        if batch_size < 1:
+            raise CommandError('--batch-size must be positive')
+
+        start_after = self.read_checkpoint(checkpoint_path) if options['resume'] else 0
+        self.imported = self.rejected = 0
+        self.workers = options['workers']
+        started = time.monotonic()
+
+        stream = sys.stdin if path == '-' else open(path, newline='', encoding='utf-8')
+        with stream, open(rejects_path, 'a' if options['resume'] else 'w', newline='') as rejects_file, \
+                ProcessPoolExecutor(max_workers=self.workers, initializer=_init_worker) as pool:
+            self.rejects = csv.writer(rejects_file)
+            if not options['resume'] or rejects_file.tell() == 0:
+                self.rejects.writerow(['row', 'email', 'reason'])
+
+            rows = ((n, row) for n, row in read_rows(stream, fmt) if n > start_after)
+            while True:
+                batch = list(islice(rows, batch_size))
+                if not batch:
+                    break
+                self.import_batch(batch, pool)
+                self.write_checkpoint(checkpoint_path, batch[-1][0])
+                rejects_file.flush()
+                if options['verbosity'] > 1:
+                    self.stdout.write(f'row {batch[-1][0]}: {self.imported} imported, {self.rejected} rejected')
+
+        elapsed = time.monotonic() - started
+        self.stdout.write(self.style.SUCCESS(
+            f'Imported {self.imported} users, rejected {self.rejected} rows in {elapsed:.1f}s '
+            f'({self.imported / elapsed if elapsed else 0:.0f} users/s). Rejected rows: {rejects_path}'
+        ))
+
+    def reject(self, number, row, reason):
+        email = row.get('email', '') if isinstance(row, dict) else ''
+        self.rejects.writerow([number, email, reason])
+        self.rejected += 1
+
+    def import_batch(self, batch, pool):
+        valid = []
+        seen_emails, seen_phones = set(), set()
+        for number, row in batch:
+            try:
+                cleaned = clean_row(row)
+            except ValueError as e:
+                self.reject(number, row, str(e))
+                continue
+            if cleaned['email'] in seen_emails:
+                self.reject(number, row, 'Duplicate email in input')
+            elif cleaned['phone_number'] and cleaned['phone_number'] in seen_phones:
+                self.reject(number, row, 'Duplicate phone number in input')
+            else:
+                seen_emails.add(cleaned['email'])
+                if cleaned['phone_number']:
+                    seen_phones.add(cleaned['phone_number'])
+                valid.append((number, cleaned))
+
+        valid = self.drop_existing(valid)
+        if not valid:
+            return
+
+        passwords = [cleaned.pop('password') for _, cleaned in valid]
+        chunksize = max(1, len(passwords) // (self.workers * 4))
+        hashes = list(pool.map(make_password, passwords, chunksize=chunksize))
+        for (_, cleaned), password in zip(valid, hashes):
+            cleaned['password'] = password
+
+        for _ in range(INSERT_ATTEMPTS):
+            try:
+                self.insert(valid)
+                return
+            except IntegrityError:
+                # Параллельная регистрация заняла email/телефон: перепроверяем и повторяем
+                valid = self.drop_existing(valid)
+                if not valid:
+                    return
+        # Конфликты не прекращаются: строки вставляются по одной, конфликтующие уходят в отклонённые
+        for number, cleaned in valid:
+            try:
+                self.insert([(number, cleaned)])
+            except IntegrityError as e:
+                self.reject(number, cleaned, f'Could not insert: {e}')
+
+    def drop_existing(self, valid):
+        emails = [cleaned['email'] for _, cleaned in valid]
+        phones = [cleaned['phone_number'] for _, cleaned in valid if cleaned['phone_number']]
+        taken_emails = set(CustomUser.objects.filter(email__in=emails).values_list('email', flat=True))
+        taken_phones = {
+            str(phone) for phone in UserProfile.objects.filter(phone_number__in=phones).values_list('phone_number', flat=True)
+        }
+        kept = []
+        for number, cleaned in valid:
+            if cleaned['email'] in taken_emails:
+                self.reject(number, cleaned, 'Email is already in use')
+            elif cleaned['phone_number'] in taken_phones:
+                self.reject(number, cleaned, 'Phone number is already in use')
+            else:
+                kept.append((number, cleaned))
+        return kept
+
+    def insert(self, valid):
+        profile_fields = ('phone_number', 'additional_info')
+        with transaction.atomic():
+            users = CustomUser.objects.bulk_create([
+                CustomUser(**{k: v for k, v in cleaned.items() if k not in profile_fields}) for _, cleaned in valid
+            ])
+            if not connection.features.can_return_rows_from_bulk_insert:
+                ids = dict(CustomUser.objects.filter(email__in=[u.email for u in users]).values_list('email', 'id'))
+                for user in users:
+                    user.pk = ids[user.email]
+            # Те же профили, что создал бы сигнал create_or_update_user_profile
+            UserProfile.objects.bulk_create([
+                UserProfile(
+                    user=user, search_document=search_document(user.email, cleaned['phone_number']),
+                    **{k: cleaned[k] for k in profile_fields}
+                )
+                for user, (_, cleaned) in zip(users, valid)
+            ])
+        response_cache.invalidate_lists()  # bulk_create не отправляет post_save
+        self.imported += len(users)
+
+    def read_checkpoint(self, path):
+        try:
+            with open(path) as f:
+                return json.load(f)['row']
+        except FileNotFoundError:
+            return 0
+
+    def write_checkpoint(self, path, row):
+        tmp = f'{path}.tmp'
+        with open(tmp, 'w') as f:
+            json.dump({'row': row}, f)
+        os.replace(tmp, path)
@@ -0,0 +1,47 @@
+import operator
+import time
+from functools import reduce
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.utils import timezone
+from rest_framework.authtoken.models import Token
+
+from authentication.expiry import expired_token_filters, get_expiry_settings
+
+
+class Command(BaseCommand):
+    help = (
+        'Delete DRF tokens past their absolute or idle TTL (AUTH_TOKEN_EXPIRY) in small '
+        'batches, each in its own short transaction, so logins are not locked out meanwhile.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, help='Tokens per DELETE (default SWEEP_BATCH_SIZE)')
+        parser.add_argument('--pause', type=float, default=0.05, help='Seconds between batches')
+        parser.add_argument('--max-batches', type=int, help='Stop after this many batches')
+        parser.add_argument('--dry-run', action='store_true', help='Only count expired tokens')
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size'] or get_expiry_settings()['SWEEP_BATCH_SIZE']
+        now = timezone.now()
+        filters = expired_token_filters(now)
+        if options['dry_run']:
+            expired = Token.objects.filter(reduce(operator.or_, filters)).count() if filters else 0
+            self.stdout.write(f'{expired} expired tokens')
+            return
+
+        deleted = batches = 0
+        for condition in filters:
+            # Каждое условие — диапазон по своему индексу (created или last_used), без полного просмотра
+            while options['max_batches'] is None or batches < options['max_batches']:
+                keys = list(Token.objects.filter(condition).values_list('key', flat=True)[:batch_size])
+                if not keys:
+                    break
+                with transaction.atomic():
+                    deleted += Token.objects.filter(key__in=keys).delete()[1].get(Token._meta.label, 0)
+                batches += 1
+                if len(keys) < batch_size:
+                    break
+                time.sleep(options['pause'])
+        self.stdout.write(f'Deleted {deleted} expired tokens in {batches} batches')
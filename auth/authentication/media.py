@@ -0,0 +1,133 @@
+import mimetypes
+import os
+import re
+
+from django.core.exceptions import SuspiciousFileOperation
+from django.http import FileResponse, Http404, HttpResponse, StreamingHttpResponse
+from django.utils.cache import get_conditional_response, patch_cache_control
+from django.utils.http import http_date, quote_etag
+from django.views.decorators.http import require_safe
+
+from .conf import get_settings
+from .models import UserProfile
+from .storage import is_content_addressed
+
+MEDIA_SERVING_DEFAULTS = {
+    'MODE': 'django',  # 'django', 'x-sendfile' (Apache/lighttpd) или 'x-accel-redirect' (nginx)
+    'ACCEL_PREFIX': '/protected-media/',  # internal location nginx для MEDIA_ROOT
+    'IMMUTABLE_MAX_AGE': 365 * 24 * 60 * 60,
+    'MAX_AGE': 60 * 60,
+}
+
+RANGE_RE = re.compile(r'^bytes=(\d*)-(\d*)$')
+CHUNK_SIZE = 64 * 1024
+
+
+class RangeNotSatisfiable(Exception):
+    pass
+
+
+def parse_range(header, size):
+    """
+    ``(start, end)`` (inclusive) of a single ``bytes=`` range, or ``None`` to send the
+    whole file. Multiple or malformed ranges are ignored, as RFC 9110 allows.
+    """
+    match = RANGE_RE.match(header.strip())
+    if not match or match.groups() == ('', ''):
+        return None
+    start, end = match.groups()
+    if not start:
+        length = int(end)
+        if not length or not size:
+            raise RangeNotSatisfiable
+        return max(size - length, 0), size - 1
+    start, end = int(start), min(int(end), size - 1) if end else size - 1
+    if start >= size or start > end:
+        raise RangeNotSatisfiable
+    return start, end
+
+
+def _read_range(file, start, length):
+    try:
+        file.seek(start)
+        while length > 0:
+            chunk = file.read(min(CHUNK_SIZE, length))
+            if not chunk:
+                break
+            length -= len(chunk)
+            yield chunk
+    finally:
+        file.close()
+
+
+@require_safe
+def serve_media(request, path):
+    """
+    Serve a file from the photo storage.
+
+    Content-addressed files never change and are cached by clients for a year; other
+    files (the default picture, photos uploaded before hashing) are revalidated hourly.
+    In ``x-sendfile``/``x-accel-redirect`` mode only headers are produced and the web
+    server sends the body, including ``Range`` requests.
+    """
+    conf = get_settings('MEDIA_SERVING', MEDIA_SERVING_DEFAULTS)
+    storage = UserProfile._meta.get_field('photo').storage
+    try:
+        full_path = storage.path(path)
+    except SuspiciousFileOperation:
+        raise Http404
+    try:
+        stat = os.stat(full_path)
+    except (FileNotFoundError, NotADirectoryError):
+        raise Http404
+    if not os.path.isfile(full_path):
+        raise Http404
+
+    immutable = is_content_addressed(path)
+    # У файлов с хешем в имени содержимое неизменно: ETag — сам хеш
+    etag = quote_etag(os.path.splitext(os.path.basename(path))[0] if immutable else f'{stat.st_mtime_ns:x}-{stat.st_size:x}')
+    response = get_conditional_response(request, etag=etag, last_modified=int(stat.st_mtime))
+    if response is None:
+        response = _file_response(request, conf, path, full_path, stat.st_size, etag)
+    response.headers['ETag'] = etag
+    response.headers['Last-Modified'] = http_date(stat.st_mtime)
+    if immutable:
+        patch_cache_control(response, public=True, max_age=conf['IMMUTABLE_MAX_AGE'], immutable=True)
+    else:
+        patch_cache_control(response, public=True, max_age=conf['MAX_AGE'])
+    return response
+
+
+def _file_response(request, conf, path, full_path, size, etag):
+    content_type = mimetypes.guess_type(full_path)[0] or 'application/octet-stream'
+    if conf['MODE'] == 'x-sendfile':
+        response = HttpResponse(content_type=content_type)
+        response.headers['X-Sendfile'] = full_path
+        return response
+    if conf['MODE'] == 'x-accel-redirect':
+        response = HttpResponse(content_type=content_type)
+        response.headers['X-Accel-Redirect'] = conf['ACCEL_PREFIX'].rstrip('/') + '/' + path.lstrip('/')
+        return response
+
+    byte_range = None
+    # If-Range: частичный ответ только если у клиента та же версия файла
+    if 'HTTP_RANGE' in request.META and request.META.get('HTTP_IF_RANGE', etag) == etag:
+        try:
+            byte_range = parse_range(request.META['HTTP_RANGE'], size)
+        except RangeNotSatisfiable:
+            response = HttpResponse(status=416)
+            response.headers['Content-Range'] = f'bytes */{size}'
+            return response
+
+    if byte_range is None:
+        # FileResponse отдаётся через wsgi.file_wrapper (sendfile в gunicorn)
+        response = FileResponse(open(full_path, 'rb'), content_type=content_type)
+    else:
+        start, end = byte_range
+        response = StreamingHttpResponse(
+            _read_range(open(full_path, 'rb'), start, end - start + 1), status=206, content_type=content_type
+        )
+        response.headers['Content-Range'] = f'bytes {start}-{end}/{size}'
+        response.headers['Content-Length'] = str(end - start + 1)
+    response.headers['Accept-Ranges'] = 'bytes'
+    return response
@@ -0,0 +1,391 @@
+import atexit
+import bisect
+import contextvars
+import functools
+import ipaddress
+import json
+import logging
+import os
+import threading
+import time
+from contextlib import ExitStack
+
+from django.conf import settings
+from django.db import connections
+from django.http import Http404, HttpResponse
+from django.views.decorators.http import require_safe
+
+from .conf import get_settings
+
+logger = logging.getLogger(__name__)
+
+METRICS_DEFAULTS = {
+    'ENABLED': True,
+    # Адреса и сети, которым доступен /metrics; None — доступен всем. За nginx все запросы приходят
+    # с частного адреса, поэтому по умолчанию только loopback
+    'ALLOWED_IPS': ('127.0.0.0/8', '::1'),
+    'SLOW_REQUEST_SECONDS': None,  # None — журнал медленных запросов выключен
+    'MAX_LOGGED_QUERIES': 50,
+    # Каталог файлов метрик воркеров, которые /metrics суммирует; None — только метрики своего процесса
+    'MULTIPROCESS_DIR': None,
+    'MULTIPROCESS_INTERVAL': 5,  # Секунды между записями файла процесса
+}
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+QUERY_COUNT_BUCKETS = (0, 1, 2, 3, 5, 8, 13, 21, 34, 55, 100)
+
+_current = contextvars.ContextVar('request_metrics', default=None)
+
+
+def get_metrics_settings():
+    return get_settings('METRICS', METRICS_DEFAULTS)
+
+
+def _labels(names, values):
+    if not names:
+        return ''
+    pairs = (
+        '%s="%s"' % (name, str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n'))
+        for name, value in zip(names, values)
+    )
+    return '{%s}' % ','.join(pairs)
+
+
+class Counter:
+    type = 'counter'
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = labelnames
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, *labels, amount=1):
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+    def state(self):
+        with self._lock:
+            return dict(self._values)
+
+    @staticmethod
+    def merge(into, state):
+        for labels, value in state.items():
+            into[labels] = into.get(labels, 0) + value
+
+    def samples(self, state):
+        for labels, value in sorted(state.items()):
+            yield self.name + _labels(self.labelnames, labels), value
+
+    def clear(self):
+        with self._lock:
+            self._values.clear()
+
+
+class Histogram:
+    """Fixed-bucket histogram: one list of counts per label set, cumulated only when rendered."""
+
+    type = 'histogram'
+
+    def __init__(self, name, documentation, labelnames=(), buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = labelnames
+        self.buckets = tuple(buckets)
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value, *labels):
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(labels)
+            if series is None:
+                series = self._series[labels] = [[0] * (len(self.buckets) + 1), 0.0]
+            series[0][index] += 1
+            series[1] += value
+
+    def state(self):
+        with self._lock:
+            return {labels: [list(counts), total] for labels, (counts, total) in self._series.items()}
+
+    @staticmethod
+    def merge(into, state):
+        for labels, (counts, total) in state.items():
+            if labels in into:
+                merged = into[labels]
+                merged[0] = [a + b for a, b in zip(merged[0], counts)]
+                merged[1] += total
+            else:
+                into[labels] = [list(counts), total]
+
+    def samples(self, state):
+        names = self.labelnames + ('le',)
+        for labels, (counts, total) in sorted(state.items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets + ('+Inf',), counts):
+                cumulative += count
+                yield f'{self.name}_bucket' + _labels(names, labels + (bound,)), cumulative
+            yield f'{self.name}_sum' + _labels(self.labelnames, labels), total
+            yield f'{self.name}_count' + _labels(self.labelnames, labels), cumulative
+
+    def clear(self):
+        with self._lock:
+            self._series.clear()
+
+
+class Registry:
+    def __init__(self):
+        self.metrics = []
+
+    def register(self, metric):
+        self.metrics.append(metric)
+        return metric
+
+    def state(self):
+        return {metric.name: metric.state() for metric in self.metrics}
+
+    def render(self, states=None):
+        """Text exposition of this process' metrics, or of the sum of ``states`` (see ``state()``)."""
+        states = [self.state()] if states is None else states
+        lines = []
+        for metric in self.metrics:
+            merged = {}
+            for state in states:
+                metric.merge(merged, state.get(metric.name, {}))
+            lines.append(f'# HELP {metric.name} {metric.documentation}')
+            lines.append(f'# TYPE {metric.name} {metric.type}')
+            lines.extend(f'{name} {value}' for name, value in metric.samples(merged))
+        return '\n'.join(lines) + '\n'
+
+    def clear(self):
+        for metric in self.metrics:
+            metric.clear()
+
+
+# Метрики живут в памяти процесса; с MULTIPROCESS_DIR /metrics суммирует файлы всех воркеров (MultiprocessStore)
+registry = Registry()
+request_duration = registry.register(Histogram(
+    'http_request_duration_seconds', 'Request latency by URL name.', ('view', 'method'),
+))
+requests_total = registry.register(Counter(
+    'http_requests_total', 'Responses by URL name and status code.', ('view', 'method', 'status'),
+))
+request_queries = registry.register(Histogram(
+    'http_request_db_queries', 'Database queries per request.', ('view',), buckets=QUERY_COUNT_BUCKETS,
+))
+request_db_time = registry.register(Histogram(
+    'http_request_db_seconds', 'Time spent in database queries per request.', ('view',),
+))
+hasher_time = registry.register(Histogram(
+    'password_hasher_seconds', 'Time spent hashing passwords per call.', ('view',),
+))
+token_cache_lookups = registry.register(Counter(
+    'token_cache_lookups_total', 'Token authentication cache lookups by result (local, shared, miss).',
+    ('view', 'result'),
+))
+slow_requests = registry.register(Counter(
+    'http_slow_requests_total', 'Requests slower than METRICS["SLOW_REQUEST_SECONDS"].', ('view',),
+))
+
+
+class MultiprocessStore:
+    """
+    Per-process metric files for servers with several worker processes.
+
+    Every process writes its registry state to ``<MULTIPROCESS_DIR>/<pid>-<random>.json``
+    every ``MULTIPROCESS_INTERVAL`` seconds (from a daemon thread) and at exit; ``/metrics``
+    writes its own file and renders the sum of all of them. Files of exited workers are
+    kept, and the random suffix keeps a worker reusing a dead one's pid from overwriting
+    them, so counters never go backwards when a worker is replaced; the directory is
+    emptied when the server starts (``gunicorn.conf.py``).
+    """
+
+    def __init__(self, registry):
+        self.registry = registry
+        self._writer_pid = None
+        self._lock = threading.Lock()
+        self._filenames = {}
+
+    @property
+    def directory(self):
+        return get_metrics_settings()['MULTIPROCESS_DIR']
+
+    def write(self):
+        directory = self.directory
+        if not directory:
+            return
+        state = {
+            name: [[list(labels), value] for labels, value in metric_state.items()]
+            for name, metric_state in self.registry.state().items()
+        }
+        pid = os.getpid()
+        # Свой файл на каждый процесс: pid после fork или перезапуска воркера может повториться
+        filename = self._filenames.setdefault(pid, f'{pid}-{os.urandom(4).hex()}.json')
+        path = os.path.join(directory, filename)
+        with open(f'{path}.tmp', 'w') as f:
+            json.dump(state, f)
+        os.replace(f'{path}.tmp', path)
+
+    def read_all(self):
+        directory = self.directory
+        states = []
+        for filename in os.listdir(directory):
+            if not filename.endswith('.json'):
+                continue
+            try:
+                with open(os.path.join(directory, filename)) as f:
+                    data = json.load(f)
+            except (OSError, ValueError):
+                continue  # Файл удалили при перезапуске сервера
+            states.append({name: {tuple(labels): value for labels, value in series} for name, series in data.items()})
+        return states
+
+    def ensure_writer(self):
+        """Start the writer thread of this process (threads do not survive fork)."""
+        if not self.directory or self._writer_pid == os.getpid():
+            return
+        with self._lock:
+            if self._writer_pid == os.getpid():
+                return
+            self._writer_pid = os.getpid()
+        atexit.register(self.write)
+        threading.Thread(target=self._run_writer, name='metrics-writer', daemon=True).start()
+
+    def _run_writer(self):
+        while True:
+            time.sleep(get_metrics_settings()['MULTIPROCESS_INTERVAL'])
+            try:
+                self.write()
+            except OSError:
+                logger.exception('Could not write the metrics of process %d', os.getpid())
+
+
+metrics_store = MultiprocessStore(registry)
+
+
+class RequestMetrics:
+    """What hooks recorded during one request; reported under the URL name once it is resolved."""
+
+    __slots__ = ('queries', 'db_time', 'sql', 'max_sql', 'hashing', 'token_cache')
+
+    def __init__(self, max_sql=0):
+        self.queries = 0
+        self.db_time = 0.0
+        self.sql = []
+        self.max_sql = max_sql
+        self.hashing = []
+        self.token_cache = []
+
+    def __call__(self, execute, sql, params, many, context):
+        # connection.execute_wrapper: время каждого запроса; текст SQL — только для журнала медленных
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            elapsed = time.perf_counter() - started
+            self.queries += 1
+            self.db_time += elapsed
+            if len(self.sql) < self.max_sql:
+                self.sql.append((elapsed, sql))
+
+
+def record_hashing(seconds):
+    stats = _current.get()
+    if stats is None:
+        hasher_time.observe(seconds, '')
+    else:
+        stats.hashing.append(seconds)
+
+
+def record_token_cache(result):
+    stats = _current.get()
+    if stats is not None:
+        stats.token_cache.append(result)
+
+
+class MetricsMiddleware:
+    """
+    Records latency, query count and time, password hashing time and token cache
+    lookups per URL name. Unresolved paths are reported as ``unmatched`` to keep the
+    label set bounded.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        conf = get_metrics_settings()
+        if not conf['ENABLED']:
+            return self.get_response(request)
+        if conf['MULTIPROCESS_DIR']:
+            metrics_store.ensure_writer()
+
+        slow = conf['SLOW_REQUEST_SECONDS']
+        stats = RequestMetrics(conf['MAX_LOGGED_QUERIES'] if slow is not None else 0)
+        token = _current.set(stats)
+        started = time.perf_counter()
+        try:
+            with ExitStack() as stack:
+                for alias in settings.DATABASES:
+                    stack.enter_context(connections[alias].execute_wrapper(stats))
+                response = self.get_response(request)
+        finally:
+            _current.reset(token)
+        elapsed = time.perf_counter() - started
+
+        match = request.resolver_match
+        view = (match.url_name or match.view_name) if match else 'unmatched'
+        request_duration.observe(elapsed, view, request.method)
+        requests_total.inc(view, request.method, response.status_code)
+        request_queries.observe(stats.queries, view)
+        request_db_time.observe(stats.db_time, view)
+        for seconds in stats.hashing:
+            hasher_time.observe(seconds, view)
+        for result in stats.token_cache:
+            token_cache_lookups.inc(view, result)
+        if slow is not None and elapsed >= slow:
+            slow_requests.inc(view)
+            self.log_slow_request(request, view, elapsed, stats)
+        return response
+
+    def log_slow_request(self, request, view, elapsed, stats):
+        # Параметры запросов не пишутся: в них могут быть хеши паролей, токены и email
+        queries = '\n'.join(f'  {seconds * 1000:.1f} ms  {sql}' for seconds, sql in stats.sql)
+        if stats.queries > len(stats.sql):
+            queries += f'\n  ... {stats.queries - len(stats.sql)} more'
+        logger.warning(
+            'Slow request %s %s (%s): %.0f ms, %d queries in %.0f ms, hashing %.0f ms\n%s',
+            request.method, request.path, view, elapsed * 1000, stats.queries, stats.db_time * 1000,
+            sum(stats.hashing) * 1000, queries,
+        )
+
+
+@functools.lru_cache(maxsize=8)
+def _networks(allowed):
+    return tuple(ipaddress.ip_network(network, strict=False) for network in allowed)
+
+
+def is_allowed_ip(address, allowed):
+    try:
+        address = ipaddress.ip_address(address)
+    except ValueError:
+        return False
+    return any(address in network for network in _networks(tuple(allowed)))
+
+
+@require_safe
+def metrics_view(request):
+    """Prometheus text exposition of this process' metrics, or of all workers' with ``MULTIPROCESS_DIR``."""
+    conf = get_metrics_settings()
+    if not conf['ENABLED']:
+        raise Http404
+    allowed = conf['ALLOWED_IPS']
+    if allowed is not None and not is_allowed_ip(request.META.get('REMOTE_ADDR', ''), allowed):
+        raise Http404
+    if conf['MULTIPROCESS_DIR']:
+        metrics_store.write()
+        text = registry.render(metrics_store.read_all())
+    else:
+        text = registry.render()
+    return HttpResponse(text, content_type='text/plain; version=0.0.4; charset=utf-8')
@@ -0,0 +1,21 @@
+# Generated by Django 4.2.7 on 2026-10-18 08:46
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('authentication', '0002_alter_userprofile_photo'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='userprofile',
+            index=models.Index(fields=['created_at', 'id'], name='profile_created_at_id_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='userprofile',
+            index=models.Index(fields=['modified_at', 'id'], name='profile_modified_at_id_idx'),
+        ),
+    ]
@@ -0,0 +1,32 @@
+# Generated by Django 4.2.7 on 2026-10-18 08:47
+
+from django.db import migrations, models
+
+
+def fill_search_document(apps, schema_editor):
+    UserProfile = apps.get_model('authentication', 'UserProfile')
+    profiles = UserProfile.objects.using(schema_editor.connection.alias).select_related('user')
+    batch = []
+    for profile in profiles.iterator(chunk_size=2000):
+        profile.search_document = f"{profile.user.email.lower()} {profile.phone_number or ''}".rstrip()
+        batch.append(profile)
+        if len(batch) >= 2000:
+            profiles.bulk_update(batch, ['search_document'])
+            batch = []
+    profiles.bulk_update(batch, ['search_document'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('authentication', '0003_userprofile_keyset_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='userprofile',
+            name='search_document',
+            field=models.TextField(blank=True, default='', editable=False),
+        ),
+        migrations.RunPython(fill_search_document, migrations.RunPython.noop),
+    ]
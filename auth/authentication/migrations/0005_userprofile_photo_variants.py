@@ -0,0 +1,18 @@
+# Generated by Django 4.2.7 on 2026-10-18 08:59
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('authentication', '0004_userprofile_search_document'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='userprofile',
+            name='photo_variants',
+            field=models.JSONField(blank=True, default=dict, editable=False),
+        ),
+    ]
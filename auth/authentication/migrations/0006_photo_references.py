@@ -0,0 +1,44 @@
+# Generated by Django 4.2.7 on 2026-10-18 09:02
+
+import authentication.storage
+from django.db import migrations, models
+from django.db.models import Count
+
+
+def count_photo_references(apps, schema_editor):
+    UserProfile = apps.get_model('authentication', 'UserProfile')
+    PhotoReference = apps.get_model('authentication', 'PhotoReference')
+    db = schema_editor.connection.alias
+    default = UserProfile._meta.get_field('photo').default
+    counts = (
+        UserProfile.objects.using(db).exclude(photo__in=['', default]).exclude(photo__isnull=True)
+        .values('photo').annotate(references=Count('id'))
+    )
+    PhotoReference.objects.using(db).bulk_create(
+        [PhotoReference(name=row['photo'], references=row['references']) for row in counts.iterator()],
+        batch_size=1000,
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('authentication', '0005_userprofile_photo_variants'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PhotoReference',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=255, unique=True)),
+                ('references', models.PositiveIntegerField(default=0)),
+            ],
+        ),
+        migrations.AlterField(
+            model_name='userprofile',
+            name='photo',
+            field=models.ImageField(blank=True, default='Default.png', null=True, storage=authentication.storage.get_photo_storage, upload_to='photos'),
+        ),
+        migrations.RunPython(count_photo_references, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,27 @@
+# Generated by Django 4.2.7 on 2026-10-18 09:40
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('authtoken', '0003_tokenproxy'),
+        ('authentication', '0006_photo_references'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='TokenActivity',
+            fields=[
+                ('token', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='activity', serialize=False, to='authtoken.token')),
+                ('last_used', models.DateTimeField(db_index=True)),
+            ],
+        ),
+        # Таблица authtoken чужая (rest_framework): индекс по created для удаления по абсолютному TTL
+        migrations.RunSQL(
+            'CREATE INDEX IF NOT EXISTS authtoken_token_created_idx ON authtoken_token (created)',
+            'DROP INDEX IF EXISTS authtoken_token_created_idx',
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 4.2.7 on 2026-10-18 09:33
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('authentication', '0007_token_activity'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='customuser',
+            name='last_seen',
+            field=models.DateTimeField(blank=True, editable=False, null=True, verbose_name='last seen'),
+        ),
+    ]
@@ -1,20 +1,89 @@
+import copy
 import re
 
 from django.contrib.auth.models import AbstractUser, BaseUserManager
 from django.core.exceptions import ValidationError
-from django.db import models
+from django.db import models, transaction
+from django.db.models.fields.files import FieldFile, ImageFieldFile
 from phonenumber_field.modelfields import PhoneNumberField
+from rest_framework.authtoken.models import Token
 from django.utils.translation import gettext_lazy as _
 
+from .search import search_document
+from .storage import acquire_photo, get_photo_storage, release_photo
+
+
+class DirtyFieldsMixin:
+    """
+    Remembers the field values last loaded from or written to the database, so that
+    saving an existing row writes only the fields that changed. ``post_save`` receivers
+    see the changed fields in ``update_fields``.
+
+    A ``save()`` with no changed field returns without a query and without sending
+    ``pre_save``/``post_save``: nothing was written, so there is nothing to react to.
+    Pass ``update_fields`` to save and send them regardless.
+    """
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        instance._snapshot()
+        return instance
+
+    def _snapshot(self, field_names=None):
+        saved = self.__dict__.setdefault('_saved_values', {})
+        for field in self._meta.concrete_fields:
+            if field.attname in self.__dict__ and (field_names is None or field.name in field_names):
+                saved[field.attname] = self._saved_value(self.__dict__[field.attname])
+
+    @staticmethod
+    def _saved_value(value):
+        if isinstance(value, FieldFile):
+            # FieldFile.save() меняет имя в том же объекте: снимок хранит само имя
+            return value.name
+        return copy.deepcopy(value) if isinstance(value, (dict, list)) else value
+
+    def get_dirty_fields(self):
+        """Return the names of changed fields, or ``None`` if the instance was never saved."""
+        saved = self.__dict__.get('_saved_values')
+        if saved is None:
+            return None
+        return {
+            field.name for field in self._meta.concrete_fields
+            if field.attname in self.__dict__ and not field.primary_key
+            and (field.attname not in saved or saved[field.attname] != self._saved_value(self.__dict__[field.attname]))
+        }
+
+    def save(self, force_insert=False, force_update=False, using=None, update_fields=None):
+        if not self._state.adding and not force_insert and update_fields is None:
+            dirty = self.get_dirty_fields()
+            if dirty is not None:
+                if not dirty:
+                    return
+                update_fields = dirty | {f.name for f in self._meta.concrete_fields if getattr(f, 'auto_now', False)}
+        super().save(force_insert=force_insert, force_update=force_update, using=using, update_fields=update_fields)
+        self._snapshot(update_fields)
+
+    def refresh_from_db(self, using=None, fields=None):
+        super().refresh_from_db(using=using, fields=fields)
+        self._snapshot(fields)
+
 
 class CustomUserManager(BaseUserManager):
-    def create_user(self, email, password=None, **extra_fields):
+    def create_user(self, email, password=None, profile_data=None, validate_unique=True, **extra_fields):
+        """
+        ``profile_data`` goes straight into the profile INSERT done by the ``post_save``
+        signal. ``validate_unique=False`` skips the uniqueness query of ``full_clean`` for
+        callers that already checked it (the unique index still guards the INSERT).
+        """
         if not email:
             raise ValueError(_('The Email must be set'))
         email = self.normalize_email(email)
         user = self.model(email=email, **extra_fields)
         user.set_password(password)
-        user.full_clean()
+        user.full_clean(validate_unique=validate_unique)
+        if profile_data is not None:
+            user._profile_data = profile_data
         user.save(using=self._db)
         return user
 
@@ -24,11 +93,13 @@ class CustomUserManager(BaseUserManager):
         return self.create_user(email, password, **extra_fields)
 
 
-class CustomUser(AbstractUser):
+class CustomUser(DirtyFieldsMixin, AbstractUser):
     username = None
     email = models.EmailField(_('email address'), unique=True)
     is_property_owner = models.BooleanField(default=False)
     is_admin = models.BooleanField(default=False)
+    # Последний аутентифицированный запрос; пишется пакетно (USER_ACTIVITY), с задержкой до FLUSH_INTERVAL
+    last_seen = models.DateTimeField(_('last seen'), null=True, blank=True, editable=False)
 
     USERNAME_FIELD = 'email'
     REQUIRED_FIELDS = []
@@ -54,13 +125,76 @@ class CustomUser(AbstractUser):
             raise ValidationError(_('Last name must contain only letters.'))
 
 
-class UserProfile(models.Model):
+class PhotoFieldFile(ImageFieldFile):
+    def save(self, name, content, save=True):
+        # Файл закреплён до коммита (ContentAddressedStorage.save): профиль должен сослаться на него в той же транзакции
+        with transaction.atomic():
+            super().save(name, content, save)
+
+
+class PhotoField(models.ImageField):
+    """``ImageField`` whose ``photo.save(name, content)`` stores the file and the profile in one transaction."""
+    attr_class = PhotoFieldFile
+
+    def deconstruct(self):
+        name, path, args, kwargs = super().deconstruct()
+        return name, 'django.db.models.ImageField', args, kwargs  # Поведение не меняет схему
+
+
+class UserProfile(DirtyFieldsMixin, models.Model):
     user = models.OneToOneField(CustomUser, on_delete=models.CASCADE, related_name='profile')
-    photo = models.ImageField(upload_to='photos', null=True, blank=True, default='Default.png')
+    photo = PhotoField(upload_to='photos', storage=get_photo_storage, null=True, blank=True, default='Default.png')
+    # Имена уменьшенных WebP-копий фото ({вариант: файл}), заполняет фоновая обработка
+    photo_variants = models.JSONField(default=dict, blank=True, editable=False)
     phone_number = PhoneNumberField(unique=True, null=True, blank=True)
     additional_info = models.TextField(_('additional information'), blank=True)
     created_at = models.DateTimeField(auto_now_add=True)
     modified_at = models.DateTimeField(auto_now=True)
+    # Нормализованные email и телефон для поиска; поддерживается в save() и сигналом смены email
+    search_document = models.TextField(blank=True, default='', editable=False)
+
+    class Meta:
+        # Индексы под keyset-пагинацию по (created_at, id) и (modified_at, id)
+        indexes = [
+            models.Index(fields=['created_at', 'id'], name='profile_created_at_id_idx'),
+            models.Index(fields=['modified_at', 'id'], name='profile_modified_at_id_idx'),
+        ]
 
     def __str__(self):
         return f"{self.user.email}'s profile"
+
+    def save(self, *args, **kwargs):
+        if self._state.adding or 'phone_number' in (self.get_dirty_fields() or ()):
+            self.search_document = search_document(self.user.email, self.phone_number)
+        adding = self._state.adding
+        old_photo = None
+        update_fields = kwargs.get('update_fields')
+        if not adding and 'photo' in (self.get_dirty_fields() or ()) and (update_fields is None or 'photo' in update_fields):
+            old_photo = self._saved_values['photo']
+            self.photo_variants = {}  # Варианты нового фото появятся после фоновой обработки
+        with transaction.atomic(using=kwargs.get('using'), savepoint=False):
+            super().save(*args, **kwargs)
+            # Файлы фото общие для одинаковых загрузок: учитываем ссылки профилей на них
+            if adding:
+                acquire_photo(self.photo.name)
+            elif old_photo is not None:
+                acquire_photo(self.photo.name)
+                release_photo(old_photo)
+
+
+class PhotoReference(models.Model):
+    """Number of profiles referencing a stored photo file (files are shared by content hash)."""
+    name = models.CharField(max_length=255, unique=True)
+    references = models.PositiveIntegerField(default=0)
+
+    def __str__(self):
+        return f'{self.name} ({self.references})'
+
+
+class TokenActivity(models.Model):
+    """When a DRF token was last used, recorded at most once per ``ACTIVITY_RESOLUTION``."""
+    token = models.OneToOneField(Token, on_delete=models.CASCADE, primary_key=True, related_name='activity')
+    last_used = models.DateTimeField(db_index=True)
+
+    def __str__(self):
+        return f'{self.token_id}: {self.last_used}'
@@ -0,0 +1,98 @@
+from django.db.models import Q
+from django.utils.dateparse import parse_datetime
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import Cursor, CursorPagination
+
+from .conf import get_settings
+
+PAGINATION_DEFAULTS = {
+    'PAGE_SIZE': 50,
+    'MAX_PAGE_SIZE': 500,
+}
+
+
+def _value(row, name):
+    return row[name] if isinstance(row, dict) else getattr(row, name)
+
+
+class KeysetPagination(CursorPagination):
+    """
+    Cursor pagination over ``(<ordering field>, id)`` pairs.
+
+    The cursor stores the key of the row at the page boundary, and every page is one
+    range scan on the matching ``(field, id)`` index. Unlike DRF's ``CursorPagination``,
+    it never falls back to OFFSET when many rows share the same timestamp, so deep
+    pages cost the same as the first one.
+    """
+
+    ordering = '-created_at'
+    page_size_query_param = 'page_size'
+
+    def get_page_size(self, request):
+        conf = get_settings('PROFILES_PAGINATION', PAGINATION_DEFAULTS)
+        self.page_size = conf['PAGE_SIZE']
+        self.max_page_size = conf['MAX_PAGE_SIZE']
+        return super().get_page_size(request)
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.request = request
+        self.base_url = request.build_absolute_uri()
+        self.page_size = self.get_page_size(request)
+        if not self.page_size:
+            return None
+
+        self.ordering = self.get_ordering(request, queryset, view)[:1]
+        field = self.ordering[0].lstrip('-')
+        cursor = self.cursor = self.decode_cursor(request)
+        reverse = cursor.reverse if cursor else False
+
+        # Обратный курсор (ссылка previous) читает страницу в обратном порядке и разворачивает её
+        descending = self.ordering[0].startswith('-') != reverse
+        if descending:
+            queryset = queryset.order_by(f'-{field}', '-id')
+        else:
+            queryset = queryset.order_by(field, 'id')
+
+        if cursor is not None:
+            value, pk = cursor.position
+            op, op_eq = ('lt', 'lte') if descending else ('gt', 'gte')
+            # (field, id) < (value, pk), записано так, чтобы использовать индекс по (field, id)
+            queryset = queryset.filter(Q(**{f'{field}__{op_eq}': value}) & (
+                Q(**{f'{field}__{op}': value}) | Q(**{f'id__{op}': pk})
+            ))
+
+        rows = list(queryset[:self.page_size + 1])
+        has_more = len(rows) > self.page_size
+        self.page = rows[:self.page_size]
+        if reverse:
+            self.page.reverse()
+            self.has_next, self.has_previous = cursor is not None, has_more
+        else:
+            self.has_next, self.has_previous = has_more, cursor is not None
+        return self.page
+
+    def get_next_link(self):
+        if not self.has_next or not self.page:
+            return None
+        return self.encode_cursor(Cursor(offset=0, reverse=False, position=self._position(self.page[-1])))
+
+    def get_previous_link(self):
+        if not self.has_previous or not self.page:
+            return None
+        return self.encode_cursor(Cursor(offset=0, reverse=True, position=self._position(self.page[0])))
+
+    def _position(self, row):
+        return f"{_value(row, self.ordering[0].lstrip('-')).isoformat()}|{_value(row, 'id')}"
+
+    def decode_cursor(self, request):
+        cursor = super().decode_cursor(request)
+        if cursor is None:
+            return None
+        try:
+            value, pk = cursor.position.rsplit('|', 1)
+            position = (parse_datetime(value), int(pk))
+        except (AttributeError, ValueError):
+            raise NotFound(self.invalid_cursor_message)
+        if position[0] is None:
+            raise NotFound(self.invalid_cursor_message)
+        return Cursor(offset=0, reverse=cursor.reverse, position=position)
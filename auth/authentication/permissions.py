@@ -0,0 +1,162 @@
+import time
+
+from django.contrib.auth.models import Group, Permission
+from django.core.cache import caches
+from django.db import transaction
+from django.db.models import IntegerField, Value
+from rest_framework.permissions import BasePermission
+
+from .cache import LRUCache
+from .conf import get_settings
+from .models import CustomUser
+
+PERMISSION_CACHE_DEFAULTS = {
+    'CACHE_ALIAS': 'default',
+    'KEY_PREFIX': 'user-perms',
+    'TIMEOUT': 5 * 60,  # Предел устаревания записи, если инвалидация не дошла до кэша
+    'VERSION_TIMEOUT': 24 * 60 * 60,  # Версии пользователя; дольше TIMEOUT, чтобы записи истекали раньше них
+    # Индекс прав меняется только миграциями; столько секунд процесс не перечитывает его из кэша
+    'INDEX_LOCAL_TIMEOUT': 60,
+}
+
+ROLE_FLAGS = ('is_active', 'is_staff', 'is_superuser', 'is_admin', 'is_property_owner')
+
+DIRECT, GROUP = 1, 2
+
+
+class PermissionCache:
+    """
+    Per-user ``(direct bits, group bits, role flags)`` in the shared cache.
+
+    Bit ``n`` of a permission set stands for the ``Permission`` with pk ``n``: pks never
+    change, so the sets stay valid while permissions are added. ``index()`` maps
+    ``'app_label.codename'`` to that bit.
+
+    Each entry is stored with the user's version, read in the same round trip and bumped
+    with ``incr`` when the user's groups, direct permissions, group permissions or role
+    flags change. An entry built from data read before the change is stored under the old
+    version and ignored, so it cannot overwrite the invalidation. A stale entry is rebuilt
+    on the next check with one query (two for users not loaded from the database).
+    """
+
+    def __init__(self):
+        self._index = LRUCache(maxsize=1)
+
+    @property
+    def conf(self):
+        return get_settings('PERMISSION_CACHE', PERMISSION_CACHE_DEFAULTS)
+
+    @property
+    def cache(self):
+        return caches[self.conf['CACHE_ALIAS']]
+
+    def _key(self, user_id):
+        return f"{self.conf['KEY_PREFIX']}:{user_id}"
+
+    def _version_key(self, user_id):
+        return f"{self.conf['KEY_PREFIX']}:{user_id}:version"
+
+    def index(self):
+        index = self._index.get('index')
+        if index is None:
+            conf = self.conf
+            key = f"{conf['KEY_PREFIX']}:index"
+            index = self.cache.get(key)
+            if index is None:
+                index = {
+                    f'{app_label}.{codename}': pk
+                    for pk, app_label, codename in Permission.objects.values_list('pk', 'content_type__app_label', 'codename')
+                }
+                self.cache.set(key, index, timeout=conf['TIMEOUT'])
+            self._index.set('index', index, timeout=conf['INDEX_LOCAL_TIMEOUT'])
+        return index
+
+    def entry(self, user):
+        key, version_key = self._key(user.pk), self._version_key(user.pk)
+        values = self.cache.get_many([key, version_key])
+        version = values.get(version_key, 0)
+        cached = values.get(key)
+        if cached is not None and cached[0] == version:
+            return cached[1]
+        entry = self.build(user)
+        # Версия прочитана до запроса в БД: после её увеличения эта запись уже не подойдёт
+        self.cache.set(key, (version, entry), timeout=self.conf['TIMEOUT'])
+        return entry
+
+    def build(self, user):
+        if user._state.adding:
+            # Пользователь из подписанного токена: флаги в нём могут устареть, берутся из БД
+            values = CustomUser.objects.filter(pk=user.pk).values_list(*ROLE_FLAGS).first() or ()
+        else:
+            values = [getattr(user, name) for name in ROLE_FLAGS]
+        flags = sum(1 << i for i, value in enumerate(values) if value)
+
+        direct = CustomUser.user_permissions.through.objects.filter(customuser_id=user.pk) \
+            .values_list('permission_id', Value(DIRECT, output_field=IntegerField()))
+        grouped = Group.permissions.through.objects.filter(group__user=user.pk) \
+            .values_list('permission_id', Value(GROUP, output_field=IntegerField()))
+        user_bits = group_bits = 0
+        for pk, source in direct.union(grouped):
+            if source == DIRECT:
+                user_bits |= 1 << pk
+            else:
+                group_bits |= 1 << pk
+        return user_bits, group_bits, flags
+
+    def roles(self, user):
+        """Names of the ``ROLE_FLAGS`` currently set on ``user``, even one rebuilt from a signed token."""
+        flags = self.entry(user)[2]
+        return {name for i, name in enumerate(ROLE_FLAGS) if flags >> i & 1}
+
+    def has_role(self, user, flag):
+        if not user or not user.is_authenticated:
+            return False
+        flags = self.entry(user)[2]
+        return bool(flags & 1 << ROLE_FLAGS.index('is_active') and flags & 1 << ROLE_FLAGS.index(flag))
+
+    def names(self, bits):
+        return {name for name, pk in self.index().items() if bits >> pk & 1}
+
+    def invalidate(self, user_ids):
+        keys = [self._version_key(user_id) for user_id in user_ids]
+        if keys:
+            # Сразу и после коммита: запрос между ними мог собрать запись по старым данным
+            self._bump(keys)
+            transaction.on_commit(lambda: self._bump(keys))
+
+    def _bump(self, keys):
+        for key in keys:
+            try:
+                self.cache.incr(key)
+            except ValueError:
+                # Начальное значение по времени: истёкшая версия не начнётся заново с номера живых записей
+                if not self.cache.add(key, time.time_ns(), timeout=self.conf['VERSION_TIMEOUT']):
+                    self.cache.incr(key)
+
+    def invalidate_index(self):
+        self._index.clear()
+        self.cache.delete(f"{self.conf['KEY_PREFIX']}:index")
+
+
+permission_cache = PermissionCache()
+
+
+class IsAdminRole(BasePermission):
+    """``is_admin`` users, checked against the current flags even for signed tokens."""
+
+    def has_permission(self, request, view):
+        return permission_cache.has_role(request.user, 'is_admin')
+
+
+class IsPropertyOwnerRole(BasePermission):
+    """``is_property_owner`` users, checked against the current flags even for signed tokens."""
+
+    def has_permission(self, request, view):
+        return permission_cache.has_role(request.user, 'is_property_owner')
+
+
+class IsStaffRole(BasePermission):
+    """``IsAdminUser`` answered from the cached flags: no query, and current for signed tokens."""
+
+    def has_permission(self, request, view):
+        return permission_cache.has_role(request.user, 'is_staff')
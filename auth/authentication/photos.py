@@ -0,0 +1,166 @@
+import io
+import logging
+import os
+import threading
+from concurrent import futures
+
+from django.core.files.base import ContentFile
+from django.db import close_old_connections
+from django.utils import timezone
+from PIL import Image, ImageOps, UnidentifiedImageError
+
+from .conf import get_settings
+from .storage import collect_photo
+
+logger = logging.getLogger(__name__)
+
+PHOTO_PROCESSING_DEFAULTS = {
+    'ASYNC': True,
+    'WORKERS': 2,
+    'MAX_UPLOAD_SIZE': 5 * 1024 * 1024,
+    'MAX_PIXELS': 25_000_000,
+    'FORMATS': ('JPEG', 'PNG', 'GIF', 'WEBP'),
+    'VARIANTS': {'thumbnail': 128, 'small': 320, 'medium': 800},  # Наибольшая сторона, px
+    'WEBP_QUALITY': 80,
+}
+
+
+class InvalidPhoto(ValueError):
+    pass
+
+
+def get_photo_settings():
+    return get_settings('PHOTO_PROCESSING', PHOTO_PROCESSING_DEFAULTS)
+
+
+def inspect_photo(file):
+    """
+    Check an uploaded photo's size, format and dimensions from its header only, without
+    decoding the pixels. Raises ``InvalidPhoto``.
+    """
+    conf = get_photo_settings()
+    if file.size > conf['MAX_UPLOAD_SIZE']:
+        raise InvalidPhoto(f"The image is larger than {conf['MAX_UPLOAD_SIZE'] // (1024 * 1024)} MB.")
+    file.seek(0)
+    try:
+        with Image.open(file) as image:
+            image_format, (width, height) = image.format, image.size
+    except (UnidentifiedImageError, OSError, Image.DecompressionBombError):
+        raise InvalidPhoto('Upload a valid image.')
+    finally:
+        file.seek(0)
+    if image_format not in conf['FORMATS']:
+        raise InvalidPhoto(f"Unsupported image format. Allowed: {', '.join(conf['FORMATS'])}.")
+    if width * height > conf['MAX_PIXELS']:
+        raise InvalidPhoto('The image has too many pixels.')
+
+
+def variant_name(name, variant):
+    directory, filename = os.path.split(name)
+    stem = os.path.splitext(filename)[0]
+    return os.path.join(directory, 'variants', f'{stem}.{variant}.webp')
+
+
+def render_variants(file):
+    """Decode the image once and return ``{variant: webp bytes}`` for every configured size."""
+    conf = get_photo_settings()
+    sizes = conf['VARIANTS']
+    with Image.open(file) as image:
+        # JPEG декодируется сразу в уменьшенном масштабе (DCT scaling), если это позволяет наибольший вариант
+        largest = max(sizes.values())
+        image.draft('RGB', (largest, largest))
+        image = ImageOps.exif_transpose(image)
+        image = image.convert('RGBA' if image.mode in ('RGBA', 'LA', 'P') else 'RGB')
+    rendered = {}
+    # От большего к меньшему: каждый вариант уменьшается из предыдущего, а не из оригинала
+    for variant, size in sorted(sizes.items(), key=lambda item: -item[1]):
+        image.thumbnail((size, size), Image.LANCZOS)
+        buffer = io.BytesIO()
+        image.save(buffer, 'WEBP', quality=conf['WEBP_QUALITY'], method=4)
+        rendered[variant] = buffer.getvalue()
+    return rendered
+
+
+def process_photo(profile_id, name):
+    """
+    Generate the WebP variants of ``name`` and record them on the profile, unless the
+    profile has meanwhile got another photo.
+    """
+    from .models import UserProfile
+    from .response_cache import response_cache
+
+    storage = UserProfile._meta.get_field('photo').storage
+    variants = {variant: variant_name(name, variant) for variant in get_photo_settings()['VARIANTS']}
+    # Одинаковые фото хранятся одним файлом: его варианты могли быть построены для другого профиля
+    if not all(storage.exists(target) for target in variants.values()):
+        with storage.open(name) as file:
+            rendered = render_variants(file)
+        for variant, content in rendered.items():
+            storage.save_derived(variants[variant], ContentFile(content))
+
+    updated = UserProfile.objects.filter(pk=profile_id, photo=name).update(
+        photo_variants=variants, modified_at=timezone.now()
+    )
+    if updated:
+        response_cache.invalidate_profile(profile_id)
+    else:
+        collect_photo(name)  # Фото заменили или профиль удалили, пока шла обработка
+    return variants
+
+
+def _process(profile_id, name):
+    try:
+        process_photo(profile_id, name)
+    except Exception:
+        logger.exception('Processing photo %s of profile %s failed', name, profile_id)
+
+
+def _run_job(profile_id, name):
+    # Потоки обработки держат собственные соединения с БД, закрываем их как в конце запроса
+    close_old_connections()
+    try:
+        _process(profile_id, name)
+    finally:
+        close_old_connections()
+
+
+class PhotoPipeline:
+    """
+    In-process background queue for photo variants.
+
+    Requests only store the original and enqueue ``(profile_id, photo name)``; a small
+    pool of worker threads decodes the image and writes the variants (Pillow releases
+    the GIL while resizing and encoding). With ``ASYNC`` off the work runs inline.
+    """
+
+    def __init__(self):
+        self._executor = None
+        self._pending = set()
+        self._lock = threading.Lock()
+
+    def submit(self, profile_id, name):
+        if not get_photo_settings()['ASYNC']:
+            _process(profile_id, name)
+            return None
+        with self._lock:
+            if self._executor is None:
+                self._executor = futures.ThreadPoolExecutor(
+                    max_workers=get_photo_settings()['WORKERS'], thread_name_prefix='photos'
+                )
+            future = self._executor.submit(_run_job, profile_id, name)
+            self._pending.add(future)
+        future.add_done_callback(self._pending.discard)
+        return future
+
+    def join(self, timeout=None):
+        """Wait for the jobs queued so far."""
+        return futures.wait(list(self._pending), timeout=timeout)
+
+    def shutdown(self, wait=True):
+        with self._lock:
+            if self._executor is not None:
+                self._executor.shutdown(wait=wait)
+                self._executor = None
+
+
+photo_pipeline = PhotoPipeline()
@@ -0,0 +1,128 @@
+import hashlib
+import threading
+import time
+
+from django.core.cache import caches
+from django.db import transaction
+from django.http import HttpResponse
+
+from .conditional import mark_profiles_changed
+from .conf import get_settings
+
+RESPONSE_CACHE_DEFAULTS = {
+    'ENABLED': True,
+    'CACHE_ALIAS': 'default',
+    'KEY_PREFIX': 'profiles-response',
+    'TIMEOUT': 300,
+}
+
+CACHED_HEADERS = ('Content-Type', 'ETag', 'Last-Modified', 'Vary', 'Allow')
+
+
+def visibility_key(request):
+    """What the requesting user may see: all authenticated users currently share it per role."""
+    user = request.user
+    return 'staff={}:admin={}:owner={}'.format(
+        int(getattr(user, 'is_staff', False)),
+        int(getattr(user, 'is_admin', False)),
+        int(getattr(user, 'is_property_owner', False)),
+    )
+
+
+class ProfileResponseCache:
+    """
+    Rendered ``UserProfileViewSet`` list and detail responses in the Django cache.
+
+    Detail keys embed a per-profile version and list keys a global generation. Saving
+    or deleting a profile (or a user field shown in it) bumps both, so invalidation is
+    one or two increments instead of a key scan; it also moves the list validators
+    (``profiles_changed_at``). Old entries are never read again and
+    expire with ``TIMEOUT``.
+    """
+
+    def __init__(self):
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+    @property
+    def conf(self):
+        return get_settings('PROFILES_RESPONSE_CACHE', RESPONSE_CACHE_DEFAULTS)
+
+    @property
+    def enabled(self):
+        return self.conf['ENABLED']
+
+    @property
+    def cache(self):
+        return caches[self.conf['CACHE_ALIAS']]
+
+    def _version(self, name):
+        key = f"{self.conf['KEY_PREFIX']}:{name}"
+        version = self.cache.get(key)
+        if version is None:
+            # Начальное значение по времени: если счётчик вытеснят, старые ключи не совпадут с новыми
+            self.cache.add(key, time.time_ns(), timeout=None)
+            version = self.cache.get(key)
+        return version
+
+    def _bump(self, name):
+        key = f"{self.conf['KEY_PREFIX']}:{name}"
+        try:
+            self.cache.incr(key)
+        except ValueError:
+            self.cache.set(key, time.time_ns(), timeout=None)
+
+    def _request_digest(self, request):
+        parts = [visibility_key(request), request.get_full_path(), request.get_host(), request.META.get('HTTP_ACCEPT', '')]
+        return hashlib.md5('|'.join(parts).encode()).hexdigest()
+
+    def list_key(self, request):
+        generation = self._version('list-generation')
+        return f"{self.conf['KEY_PREFIX']}:list:{generation}:{self._request_digest(request)}"
+
+    def detail_key(self, request, pk):
+        version = self._version(f'profile:{pk}')
+        return f"{self.conf['KEY_PREFIX']}:detail:{pk}:{version}:{self._request_digest(request)}"
+
+    def get(self, key):
+        entry = self.cache.get(key)
+        with self._lock:
+            if entry is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+        if entry is None:
+            return None
+        response = HttpResponse(entry['content'], status=entry['status'])
+        for header, value in entry['headers'].items():
+            response.headers[header] = value
+        return response
+
+    def set(self, key, response):
+        self.cache.set(key, {
+            'content': response.content,
+            'status': response.status_code,
+            'headers': {h: response.headers[h] for h in CACHED_HEADERS if h in response.headers},
+        }, timeout=self.conf['TIMEOUT'])
+
+    def invalidate_profile(self, pk):
+        self._bump(f'profile:{pk}')
+        self.invalidate_lists()
+        # Повторно после коммита: параллельный запрос мог закэшировать данные до фиксации транзакции
+        transaction.on_commit(lambda: (self._bump(f'profile:{pk}'), self.invalidate_lists()))
+
+    def invalidate_lists(self):
+        self._bump('list-generation')
+        mark_profiles_changed()  # ETag/Last-Modified списка меняются и с выключенным кэшем ответов
+
+    def stats(self):
+        total = self.hits + self.misses
+        return {'hits': self.hits, 'misses': self.misses, 'hit_ratio': self.hits / total if total else 0.0}
+
+    def reset_stats(self):
+        with self._lock:
+            self.hits = self.misses = 0
+
+
+response_cache = ProfileResponseCache()
@@ -0,0 +1,121 @@
+import hashlib
+import logging
+import threading
+
+from django.conf import settings
+from django.http import Http404, HttpResponse
+from django.utils.cache import get_conditional_response, patch_cache_control
+from django.utils.http import quote_etag
+from django.views.decorators.http import require_safe
+from drf_yasg import openapi
+from drf_yasg.codecs import OpenAPICodecJson, OpenAPICodecYaml
+from drf_yasg.generators import OpenAPISchemaGenerator
+from drf_yasg.views import get_schema_view
+from rest_framework import permissions
+from rest_framework.authentication import TokenAuthentication
+
+from .conf import get_settings
+
+logger = logging.getLogger(__name__)
+
+OPENAPI_SCHEMA_DEFAULTS = {
+    'MODE': 'lazy',  # 'dynamic' (на каждый запрос), 'lazy' (один раз на процесс) или 'prebuilt' (из файлов)
+    'PATH': settings.BASE_DIR / 'openapi',
+}
+
+FORMATS = {
+    'json': (OpenAPICodecJson, 'application/json'),
+    'yaml': (OpenAPICodecYaml, 'application/yaml; charset=utf-8'),
+}
+
+api_info = openapi.Info(
+    title="Users API",
+    default_version='v1',
+    description="API for managing users",
+    terms_of_service="https://www.google.com/policies/terms/",
+    contact=openapi.Contact(email="dev@trophystays.com"),
+    license=openapi.License(name="BSD License"),
+)
+
+schema_view = get_schema_view(
+    api_info,
+    public=True,
+    permission_classes=(permissions.AllowAny,),
+    authentication_classes=(TokenAuthentication,),
+)
+
+
+def get_schema_settings():
+    return get_settings('OPENAPI_SCHEMA', OPENAPI_SCHEMA_DEFAULTS)
+
+
+def schema_filename(fmt):
+    return f'openapi.{fmt}'
+
+
+def generate_schema():
+    """Build the OpenAPI document for all URLs and return ``{format: bytes}``."""
+    schema = OpenAPISchemaGenerator(api_info).get_schema(request=None, public=True)
+    return {fmt: codec(validators=[]).encode(schema) for fmt, (codec, _) in FORMATS.items()}
+
+
+class SchemaDocument:
+    """The schema in every format, rendered once and kept in memory with its ETag."""
+
+    def __init__(self, documents):
+        self.documents = documents
+        self.etags = {fmt: quote_etag(hashlib.md5(body).hexdigest()) for fmt, body in documents.items()}
+
+    @classmethod
+    def load(cls, path):
+        return cls({fmt: (path / schema_filename(fmt)).read_bytes() for fmt in FORMATS})
+
+
+class SchemaStore:
+    def __init__(self):
+        self._document = None
+        self._lock = threading.Lock()
+
+    def get(self):
+        if self._document is None:
+            with self._lock:
+                if self._document is None:
+                    self._document = self._build()
+        return self._document
+
+    def _build(self):
+        conf = get_schema_settings()
+        if conf['MODE'] == 'prebuilt':
+            try:
+                return SchemaDocument.load(conf['PATH'])
+            except FileNotFoundError:
+                logger.warning(
+                    'Prebuilt OpenAPI schema not found in %s, generating it; run manage.py build_openapi_schema',
+                    conf['PATH'],
+                )
+        return SchemaDocument(generate_schema())
+
+    def clear(self):
+        self._document = None
+
+
+schema_store = SchemaStore()
+
+
+@require_safe
+def openapi_view(request, format):
+    """``/swagger.json`` and ``/swagger.yaml`` served from the precomputed document."""
+    fmt = format.lstrip('.')
+    if fmt not in FORMATS:
+        raise Http404
+    if get_schema_settings()['MODE'] == 'dynamic':
+        return schema_view.without_ui(cache_timeout=0)(request, format=format)
+
+    document = schema_store.get()
+    etag = document.etags[fmt]
+    response = get_conditional_response(request, etag=etag)
+    if response is None:
+        response = HttpResponse(document.documents[fmt], content_type=FORMATS[fmt][1])
+    response.headers['ETag'] = etag
+    patch_cache_control(response, public=True, no_cache=True)  # Клиент перепроверяет по ETag и получает 304
+    return response
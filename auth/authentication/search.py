@@ -0,0 +1,112 @@
+from django.db import OperationalError, connections
+from rest_framework import filters
+
+SEARCH_TABLE = 'authentication_userprofile_search'
+PROFILE_TABLE = 'authentication_userprofile'
+MIN_INDEXED_TERM = 3  # Триграммный индекс не может искать подстроки короче трёх символов
+# Для частых терминов упорядоченный просмотр с ранней остановкой на странице дешевле,
+# чем материализовать все совпадения из индекса
+MAX_INDEXED_MATCHES = 1000
+
+_TRIGGERS = {
+    f'{SEARCH_TABLE}_ai': f"""
+        CREATE TRIGGER IF NOT EXISTS {SEARCH_TABLE}_ai AFTER INSERT ON {PROFILE_TABLE} BEGIN
+            INSERT INTO {SEARCH_TABLE}(rowid, search_document) VALUES (new.id, new.search_document);
+        END""",
+    f'{SEARCH_TABLE}_ad': f"""
+        CREATE TRIGGER IF NOT EXISTS {SEARCH_TABLE}_ad AFTER DELETE ON {PROFILE_TABLE} BEGIN
+            INSERT INTO {SEARCH_TABLE}({SEARCH_TABLE}, rowid, search_document)
+                VALUES ('delete', old.id, old.search_document);
+        END""",
+    f'{SEARCH_TABLE}_au': f"""
+        CREATE TRIGGER IF NOT EXISTS {SEARCH_TABLE}_au AFTER UPDATE OF search_document ON {PROFILE_TABLE} BEGIN
+            INSERT INTO {SEARCH_TABLE}({SEARCH_TABLE}, rowid, search_document)
+                VALUES ('delete', old.id, old.search_document);
+            INSERT INTO {SEARCH_TABLE}(rowid, search_document) VALUES (new.id, new.search_document);
+        END""",
+}
+
+_available = {}
+
+
+def search_document(email, phone_number):
+    """Normalized text that profile search matches against: lowercase email and E.164 phone."""
+    return f"{(email or '').lower()} {phone_number or ''}".rstrip()
+
+
+def ensure_search_index(connection):
+    """
+    Create the SQLite FTS5 trigram index over ``UserProfile.search_document`` and the
+    triggers that keep it in sync, if missing.
+
+    SQLite drops triggers whenever a migration rebuilds the profile table, so this runs
+    after every ``migrate`` and rebuilds the index if any trigger had to be recreated.
+    Returns whether the index is available.
+    """
+    _available.pop(connection.alias, None)
+    if connection.vendor != 'sqlite' or PROFILE_TABLE not in connection.introspection.table_names():
+        return False
+    with connection.cursor() as cursor:
+        try:
+            cursor.execute(
+                f"CREATE VIRTUAL TABLE IF NOT EXISTS {SEARCH_TABLE} USING fts5("
+                f"search_document, content='{PROFILE_TABLE}', content_rowid='id', tokenize='trigram')"
+            )
+        except OperationalError:
+            return False  # SQLite собран без FTS5 или старше 3.34 (нет триграмм)
+        cursor.execute("SELECT name FROM sqlite_master WHERE type = 'trigger' AND tbl_name = %s", [PROFILE_TABLE])
+        existing = {row[0] for row in cursor.fetchall()}
+        missing = [sql for name, sql in _TRIGGERS.items() if name not in existing]
+        for sql in missing:
+            cursor.execute(sql)
+        if missing:
+            cursor.execute(f"INSERT INTO {SEARCH_TABLE}({SEARCH_TABLE}) VALUES ('rebuild')")
+    return True
+
+
+def has_search_index(connection):
+    if connection.alias not in _available:
+        _available[connection.alias] = (
+            connection.vendor == 'sqlite' and SEARCH_TABLE in connection.introspection.table_names()
+        )
+    return _available[connection.alias]
+
+
+def _match_phrase(term):
+    return '"{}"'.format(term.replace('"', '""'))
+
+
+class ProfileSearchFilter(filters.SearchFilter):
+    """
+    ``SearchFilter`` with the semantics of ``icontains`` over ``user__email`` and
+    ``phone_number``, answered from ``UserProfile.search_document``.
+
+    Selective terms are looked up in the FTS5 trigram index where available. Short or
+    very common terms, and other databases, use one substring match on a single column
+    instead of two across a join.
+    """
+
+    def filter_queryset(self, request, queryset, view):
+        terms = self.get_search_terms(request)
+        if not terms:
+            return queryset
+
+        connection = connections[queryset.db]
+        indexed = has_search_index(connection)
+        for term in terms:
+            ids = self.indexed_matches(connection, term) if indexed and len(term) >= MIN_INDEXED_TERM else None
+            if ids is not None:
+                queryset = queryset.filter(pk__in=ids)
+            else:
+                queryset = queryset.filter(search_document__contains=term.lower())
+        return queryset
+
+    def indexed_matches(self, connection, term):
+        """Profile ids matching ``term`` from the trigram index, or ``None`` if the term is too common."""
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f'SELECT rowid FROM {SEARCH_TABLE} WHERE search_document MATCH %s LIMIT %s',
+                [_match_phrase(term), MAX_INDEXED_MATCHES + 1],
+            )
+            ids = [row[0] for row in cursor.fetchall()]
+        return ids if len(ids) <= MAX_INDEXED_MATCHES else None
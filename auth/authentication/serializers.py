@@ -5,10 +5,22 @@ from rest_framework import serializers, exceptions
 from django.contrib.auth import get_user_model, authenticate
 from phonenumbers import parse as parse_phone, is_valid_number
 from django.utils.translation import gettext_lazy as _
+from django.db.models.fields.files import FieldFile
+from .conf import get_settings
 from .models import UserProfile, CustomUser
+from .photos import InvalidPhoto, inspect_photo
+from .tokens import REFRESH, verify_token
 
 User = get_user_model()
 
+PROFILES_BATCH_DEFAULTS = {
+    'MAX_SIZE': 100,
+}
+
+TOKEN_INTROSPECTION_DEFAULTS = {
+    'MAX_TOKENS': 100,
+}
+
 
 class UserSerializer(serializers.ModelSerializer):
     class Meta:
@@ -16,12 +28,44 @@ class UserSerializer(serializers.ModelSerializer):
         fields = ('id', 'email', 'is_property_owner', 'is_admin')
 
 
+class PhotoVariantsField(serializers.Field):
+    """URLs of the resized WebP copies of the photo; empty until they are generated."""
+
+    def __init__(self, **kwargs):
+        kwargs['read_only'] = True
+        super().__init__(**kwargs)
+
+    def to_representation(self, value):
+        storage = UserProfile._meta.get_field('photo').storage
+        request = self.context.get('request')
+        urls = {}
+        for variant, name in value.items():
+            url = storage.url(name)
+            urls[variant] = request.build_absolute_uri(url) if request is not None else url
+        return urls
+
+
 class UserProfileSerializer(serializers.ModelSerializer):
     user = UserSerializer(read_only=True)
+    photo_variants = PhotoVariantsField()
 
     class Meta:
         model = UserProfile
-        fields = ('user', 'photo', 'phone_number', 'additional_info', 'created_at', 'modified_at')
+        fields = ('user', 'photo', 'photo_variants', 'phone_number', 'additional_info', 'created_at', 'modified_at')
+
+    def __init__(self, *args, fields=None, **kwargs):
+        super().__init__(*args, **kwargs)
+        if fields is not None:
+            for name in set(self.fields) - set(fields):  # Разреженный набор полей (?fields= / ?omit=)
+                self.fields.pop(name)
+
+    def validate_photo(self, value):
+        if value:
+            try:
+                inspect_photo(value)
+            except InvalidPhoto as e:
+                raise serializers.ValidationError(str(e))
+        return value
 
     def validate_phone_number(self, value):
         try:
@@ -41,6 +85,92 @@ class UserProfileSerializer(serializers.ModelSerializer):
         return user_profile
 
 
+def get_profile_fields(query_params):
+    """Profile fields selected with ``?fields=`` and ``?omit=``, in the default field order."""
+    available = UserProfileSerializer.Meta.fields
+    requested = [name.strip() for name in query_params.get('fields', '').split(',') if name.strip()]
+    omitted = {name.strip() for name in query_params.get('omit', '').split(',') if name.strip()}
+    unknown = (set(requested) | omitted) - set(available)
+    if unknown:
+        raise serializers.ValidationError({'fields': [f"Unknown field(s): {', '.join(sorted(unknown))}."]})
+    return tuple(name for name in available if (not requested or name in requested) and name not in omitted)
+
+
+class ProfileRowSerializer:
+    """
+    Read-only fast path producing exactly the ``UserProfileSerializer`` representation.
+
+    It works from ``.values()`` rows (or model instances), binds the serializer fields
+    once and calls their ``to_representation`` directly for each row. This skips the
+    per-object field lookup and ``ReturnDict`` machinery of ``ModelSerializer``.
+    """
+
+    # Всегда выбираются: id для retrieve, даты для keyset-пагинации
+    key_lookups = ('id', 'created_at', 'modified_at')
+
+    def __init__(self, fields=None, context=None):
+        serializer = UserProfileSerializer(fields=fields, context=context)
+        self.photo_field = UserProfile._meta.get_field('photo')
+        self.layout = []
+        lookups = list(self.key_lookups)
+        for name, field in serializer.fields.items():
+            if isinstance(field, serializers.BaseSerializer):
+                nested = [(f'{field.source}__{child.source}', child) for child in field.fields.values()]
+                self.layout.append((name, nested))
+                lookups.extend(lookup for lookup, _ in nested)
+            else:
+                self.layout.append((name, field))
+                lookups.append(field.source)
+        self.lookups = tuple(dict.fromkeys(lookups))
+
+    def _represent(self, field, value):
+        if value is None:
+            return None
+        if field.source == self.photo_field.name and not isinstance(value, FieldFile):
+            value = self.photo_field.attr_class(None, self.photo_field, value)
+        return field.to_representation(value)
+
+    def to_representation(self, row):
+        if not isinstance(row, dict):
+            row = self.instance_row(row)
+        data = {}
+        for name, field in self.layout:
+            if isinstance(field, list):
+                data[name] = {child.field_name: self._represent(child, row[lookup]) for lookup, child in field}
+            else:
+                data[name] = self._represent(field, row[field.source])
+        return data
+
+    def instance_row(self, instance):
+        row = {}
+        for lookup in self.lookups:
+            value = instance
+            for attr in lookup.split('__'):
+                value = getattr(value, attr)
+            row[lookup] = value
+        return row
+
+    def many(self, rows):
+        return [self.to_representation(row) for row in rows]
+
+
+class ProfileBatchSerializer(serializers.Serializer):
+    ids = serializers.ListField(child=serializers.IntegerField(min_value=1), required=False, default=list)
+    emails = serializers.ListField(child=serializers.EmailField(), required=False, default=list)
+
+    def validate(self, data):
+        # Повторы не считаются в лимит и не дублируют условия запроса
+        data['ids'] = list(dict.fromkeys(data['ids']))
+        data['emails'] = list(dict.fromkeys(data['emails']))
+        size = len(data['ids']) + len(data['emails'])
+        if not size:
+            raise serializers.ValidationError(_('Provide ids or emails.'))
+        max_size = get_settings('PROFILES_BATCH', PROFILES_BATCH_DEFAULTS)['MAX_SIZE']
+        if size > max_size:
+            raise serializers.ValidationError(_('At most %(max)d ids and emails per request.') % {'max': max_size})
+        return data
+
+
 class UserRegistrationSerializer(serializers.ModelSerializer):
     password2 = serializers.CharField(style={'input_type': 'password'}, write_only=True)
     profile = UserProfileSerializer(required=True)
@@ -48,6 +178,7 @@ class UserRegistrationSerializer(serializers.ModelSerializer):
     class Meta:
         model = CustomUser
         fields = ['email', 'first_name', 'last_name', 'password', 'password2', 'profile']
+        extra_kwargs = {'email': {'validators': []}}  # Уникальность проверяет validate_email, один раз
 
     def validate_password(self, value):
         if len(value) < 8:
@@ -68,6 +199,7 @@ class UserRegistrationSerializer(serializers.ModelSerializer):
         return data
 
     def validate_email(self, value):
+        value = CustomUser.objects.normalize_email(value)  # Сравнивается так же, как будет сохранён
         if CustomUser.objects.filter(email=value).exists():
             raise serializers.ValidationError("Email is already in use.")
         return value
@@ -75,10 +207,8 @@ class UserRegistrationSerializer(serializers.ModelSerializer):
     def create(self, validated_data):
         profile_data = validated_data.pop('profile')
         validated_data.pop('password2')
-        user = CustomUser.objects.create_user(**validated_data)
-        UserProfile.objects.create(user=user, **profile_data)
-        # Token.objects.create(user=user)
-        return user
+        # Профиль создаётся сигналом post_save сразу с данными регистрации и остаётся в user.profile
+        return CustomUser.objects.create_user(profile_data=profile_data, validate_unique=False, **validated_data)
 
 
 class UserLoginSerializer(serializers.Serializer):
@@ -86,12 +216,36 @@ class UserLoginSerializer(serializers.Serializer):
     password = serializers.CharField(style={'input_type': 'password'})
 
     def validate(self, data):
-        user = authenticate(email=data['email'], password=data['password'])
+        # Единственная проверка пароля за весь логин: представление берет пользователя отсюда
+        user = authenticate(self.context.get('request'), email=data['email'], password=data['password'])
         if user is None:
             raise serializers.ValidationError(_("Invalid login credentials"))
+        data['user'] = user
         return data
 
 
+class TokenIntrospectionSerializer(serializers.Serializer):
+    token = serializers.CharField(required=False)
+    tokens = serializers.ListField(child=serializers.CharField(), required=False, allow_empty=False)
+
+    def validate(self, data):
+        if ('token' in data) == ('tokens' in data):
+            raise serializers.ValidationError(_('Provide either token or tokens.'))
+        max_tokens = get_settings('TOKEN_INTROSPECTION', TOKEN_INTROSPECTION_DEFAULTS)['MAX_TOKENS']
+        if len(data.get('tokens', ())) > max_tokens:
+            raise serializers.ValidationError({'tokens': [_('At most %(max)d tokens per request.') % {'max': max_tokens}]})
+        return data
 
 
+class TokenRefreshSerializer(serializers.Serializer):
+    refresh = serializers.CharField()
 
+    def validate(self, data):
+        payload = verify_token(data['refresh'], REFRESH)
+        # Роли перечитываются из БД, чтобы новый access-токен отражал актуальные флаги
+        try:
+            data['user'] = CustomUser.objects.get(pk=payload['uid'], is_active=True)
+        except CustomUser.DoesNotExist:
+            raise exceptions.AuthenticationFailed(_('User inactive or deleted.'))
+        data['payload'] = payload
+        return data
@@ -1,20 +1,132 @@
-from django.db.models.signals import post_save, post_delete
+from django.contrib.auth.models import Group, Permission
+from django.db.models.signals import m2m_changed, post_migrate, post_save, post_delete, pre_delete
+from django.db import transaction
 from django.dispatch import receiver
+from rest_framework.authtoken.models import Token
+from django.utils import timezone
+from .authentication import token_cache
+from .db import mark_recent_write
 from .models import CustomUser, UserProfile
-from django.core.files.storage import FileSystemStorage
-from django.conf import settings
+from .permissions import ROLE_FLAGS, permission_cache
+from .photos import photo_pipeline
+from .response_cache import response_cache
+from .search import search_document
+from .storage import release_photo
 
-user_storage = FileSystemStorage(location=settings.MEDIA_ROOT / 'user_profiles')
+PROFILE_USER_FIELDS = {'email', 'is_property_owner', 'is_admin'}  # Поля UserSerializer, кроме id
 
 
 @receiver(post_save, sender=CustomUser)
 def create_or_update_user_profile(sender, instance, created, **kwargs):
     if created:
-        UserProfile.objects.get_or_create(user=instance)
-    instance.profile.save()
+        # Новый пользователь ещё не может иметь профиль: сразу INSERT с данными регистрации, без SELECT и UPDATE
+        UserProfile.objects.create(user=instance, **instance.__dict__.pop('_profile_data', {}))
+    elif CustomUser.profile.is_cached(instance):
+        # Записываются только изменённые поля профиля (или ничего), а не весь профиль при каждом save()
+        instance.profile.save()
+
+
+@receiver(post_save, sender=CustomUser)
+def sync_profile_with_user(sender, instance, created, update_fields=None, **kwargs):
+    # Поля пользователя входят в представление профиля: их изменение обновляет modified_at (ETag)
+    changed = PROFILE_USER_FIELDS if update_fields is None else PROFILE_USER_FIELDS.intersection(update_fields)
+    if created or not changed:
+        return
+    if CustomUser.profile.is_cached(instance):
+        profiles = [(instance.profile.pk, instance.profile.phone_number)]
+    else:
+        profiles = UserProfile.objects.filter(user=instance).values_list('pk', 'phone_number')
+    now = timezone.now()
+    for pk, phone_number in profiles:
+        values = {'modified_at': now}
+        if 'email' in changed:
+            values['search_document'] = search_document(instance.email, phone_number)
+        UserProfile.objects.filter(pk=pk).update(**values)
+        response_cache.invalidate_profile(pk)
+
+
+@receiver(post_save, sender=CustomUser)
+def invalidate_user_tokens(sender, instance, created, **kwargs):
+    if not created:
+        token_cache.invalidate_user(instance.pk)
+
+
+@receiver(post_save, sender=CustomUser)
+def invalidate_user_roles(sender, instance, created, update_fields=None, **kwargs):
+    if not created and (update_fields is None or set(ROLE_FLAGS).intersection(update_fields)):
+        permission_cache.invalidate([instance.pk])
+
+
+@receiver(m2m_changed, sender=CustomUser.groups.through)
+@receiver(m2m_changed, sender=CustomUser.user_permissions.through)
+def invalidate_user_permissions(sender, instance, action, reverse, pk_set, **kwargs):
+    if action not in ('post_add', 'post_remove', 'pre_clear'):
+        return
+    if not reverse:
+        user_ids = [instance.pk]
+    elif action == 'pre_clear':
+        user_ids = instance.user_set.values_list('pk', flat=True)  # Группа или право теряют всех пользователей
+    else:
+        user_ids = pk_set
+    permission_cache.invalidate(user_ids)
+
+
+@receiver(m2m_changed, sender=Group.permissions.through)
+def invalidate_group_permissions(sender, instance, action, reverse, pk_set, **kwargs):
+    if action not in ('post_add', 'post_remove', 'pre_clear'):
+        return
+    if not reverse:
+        users = CustomUser.objects.filter(groups=instance)
+    elif action == 'pre_clear':
+        users = CustomUser.objects.filter(groups__permissions=instance)
+    else:
+        users = CustomUser.objects.filter(groups__in=pk_set)
+    permission_cache.invalidate(users.values_list('pk', flat=True).distinct())
+
+
+@receiver(pre_delete, sender=Group)
+def invalidate_group_members(sender, instance, **kwargs):
+    permission_cache.invalidate(instance.user_set.values_list('pk', flat=True))
+
+
+@receiver(post_save, sender=Permission)
+@receiver(post_delete, sender=Permission)
+@receiver(post_migrate)
+def invalidate_permission_index(sender, **kwargs):
+    # Миграции создают права через bulk_create, без post_save
+    permission_cache.invalidate_index()
+
+
+@receiver(post_save, sender=CustomUser)
+@receiver(post_save, sender=Token)
+def stick_user_to_primary(sender, instance, **kwargs):
+    # Вход (last_login, новый токен) и изменения пользователя: следующие чтения идут с primary
+    mark_recent_write(instance.pk if sender is CustomUser else instance.user_id)
+
+
+@receiver(post_delete, sender=Token)
+def invalidate_cached_token(sender, instance, **kwargs):
+    token_cache.invalidate(instance.key)
+
+
+@receiver(post_save, sender=UserProfile)
+@receiver(post_delete, sender=UserProfile)
+def invalidate_profile_responses(sender, instance, **kwargs):
+    response_cache.invalidate_profile(instance.pk)
+    mark_recent_write(instance.user_id)
+
+
+@receiver(post_save, sender=UserProfile)
+def process_uploaded_photo(sender, instance, update_fields=None, **kwargs):
+    if update_fields is not None and 'photo' not in update_fields:
+        return
+    name = instance.photo.name
+    if name and name != UserProfile._meta.get_field('photo').default and not instance.photo_variants:
+        # Варианты строятся в фоне после коммита: запрос не ждёт декодирования изображения
+        transaction.on_commit(lambda: photo_pipeline.submit(instance.pk, name))
 
 
 @receiver(post_delete, sender=UserProfile)
 def delete_photo(sender, instance, **kwargs):
-    if instance.photo:
-        instance.photo.delete(save=False)
+    # Файл общий для одинаковых фото (и картинки по умолчанию): удаляется, когда на него не осталось ссылок
+    release_photo(instance.photo.name)
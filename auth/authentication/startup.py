@@ -0,0 +1,70 @@
+import gc
+import time
+
+from django.db import connections
+
+
+def _phonenumbers():
+    import phonenumbers
+
+    # Метаданные регионов загружаются лениво, по региону при первом номере из него
+    phonenumbers.PhoneMetadata.load_all()
+    phonenumbers.is_valid_number(phonenumbers.parse('+14155552671', None))
+
+
+def _hashers():
+    from django.contrib.auth.hashers import get_hashers
+
+    get_hashers()
+
+
+def _urls():
+    from django.urls import get_resolver
+
+    # Импортирует все представления и компилирует шаблоны URL
+    get_resolver()._populate()
+
+
+def _serializers():
+    from .serializers import ProfileRowSerializer, UserProfileSerializer, UserRegistrationSerializer
+
+    UserProfileSerializer().fields
+    UserRegistrationSerializer().fields
+    ProfileRowSerializer()
+
+
+def _pillow():
+    from PIL import Image
+
+    Image.init()  # Все плагины форматов, а не только базовые
+
+
+WARM_UP_STEPS = (
+    ('phonenumbers', _phonenumbers),
+    ('hashers', _hashers),
+    ('urls', _urls),
+    ('serializers', _serializers),
+    ('pillow', _pillow),
+)
+
+
+def warm_up(freeze=True):
+    """
+    Load what the first requests of every worker would otherwise load lazily, and return
+    the seconds spent per step. Called in the gunicorn master before forking (see
+    ``gunicorn.conf.py``) so the workers share these pages copy-on-write.
+
+    Nothing here may open a database connection: it would be shared by the forked
+    workers. With ``freeze`` the loaded objects are moved out of the GC's reach
+    (``gc.freeze()``), so collections in the workers do not touch, and copy, them.
+    """
+    timings = {}
+    for name, step in WARM_UP_STEPS:
+        started = time.perf_counter()
+        step()
+        timings[name] = time.perf_counter() - started
+    connections.close_all()
+    if freeze:
+        gc.collect()
+        gc.freeze()
+    return timings
@@ -0,0 +1,117 @@
+import hashlib
+import os
+import posixpath
+import re
+
+from django.core.files import File
+from django.core.files.storage import FileSystemStorage
+from django.db import transaction
+from django.db.models import F
+
+HASHED_NAME_RE = re.compile(r'^[0-9a-f]{64}(\.[a-z0-9]+)?$')
+
+
+def is_content_addressed(name):
+    """Whether ``name`` is a content hash name, i.e. its contents never change."""
+    return bool(HASHED_NAME_RE.match(posixpath.basename(name)))
+
+
+class ContentAddressedStorage(FileSystemStorage):
+    """
+    ``FileSystemStorage`` that names files by the SHA-256 of their contents.
+
+    ``photos/me.jpg`` is stored as ``photos/<2 hex>/<sha256>.jpg``, so identical uploads
+    share one file and saving a file that already exists writes nothing. Files are
+    shared, so they must be deleted only through ``release_photo`` (reference counted).
+
+    Saving pins the file with a reference until the surrounding transaction commits,
+    so a concurrent ``collect_photo`` cannot delete it between the existence check and
+    the moment the saving profile's own reference (``acquire_photo``) is committed.
+    """
+
+    def save(self, name, content, max_length=None):
+        if name is None:
+            name = content.name
+        if not hasattr(content, 'chunks'):
+            content = File(content, name)
+        name = self.hashed_name(name, content)
+        with transaction.atomic():
+            # Ссылка берётся до проверки: collect_photo удаляет файл только без ссылок и ждёт этой транзакции
+            acquire_photo(name)
+            transaction.on_commit(lambda: release_photo(name))
+            if self.exists(name):
+                return name  # Такой файл уже есть: повторная загрузка ничего не пишет
+            return super().save(name, content, max_length=max_length)
+
+    def hashed_name(self, name, content):
+        digest = hashlib.sha256()
+        content.seek(0)
+        for chunk in content.chunks():
+            digest.update(chunk)
+        content.seek(0)
+        directory, filename = posixpath.split(name)
+        extension = os.path.splitext(filename)[1].lower()
+        digest = digest.hexdigest()
+        return posixpath.join(directory, digest[:2], digest + extension)
+
+    def save_derived(self, name, content):
+        """Write a file derived from a stored one (e.g. a resized variant) under exactly ``name``."""
+        if self.exists(name):
+            self.delete(name)
+        return super().save(name, content)
+
+
+photo_storage = ContentAddressedStorage()
+
+
+def get_photo_storage():
+    return photo_storage
+
+
+def _is_default(name):
+    from .models import UserProfile
+
+    return not name or name == UserProfile._meta.get_field('photo').default
+
+
+def acquire_photo(name):
+    """Count one more profile referencing the stored photo ``name``."""
+    from .models import PhotoReference
+
+    if _is_default(name):
+        return
+    while True:
+        # Атомарное увеличение; строку, удалённую параллельным collect_photo, заводим заново
+        if PhotoReference.objects.filter(name=name).update(references=F('references') + 1):
+            return
+        _, created = PhotoReference.objects.get_or_create(name=name, defaults={'references': 1})
+        if created:
+            return
+
+
+def release_photo(name):
+    """Drop one reference to ``name``; the file goes away after commit if nothing references it."""
+    from .models import PhotoReference
+
+    if _is_default(name):
+        return
+    PhotoReference.objects.filter(name=name, references__gt=0).update(references=F('references') - 1)
+    transaction.on_commit(lambda: collect_photo(name))
+
+
+def collect_photo(name):
+    """Delete the photo ``name`` and its variants unless some profile still references it."""
+    from .models import PhotoReference, UserProfile
+    from .photos import get_photo_settings, variant_name
+
+    storage = UserProfile._meta.get_field('photo').storage
+    with transaction.atomic():
+        # Проверка и удаление строки — один DELETE; файлы удаляются, пока строка заблокирована им,
+        # так что загрузка того же файла (acquire_photo в save()) ждёт коммита и пишет файл заново
+        deleted, _ = PhotoReference.objects.filter(name=name, references=0).delete()
+        if not deleted:
+            return False
+        storage.delete(name)
+        for variant in get_photo_settings()['VARIANTS']:
+            storage.delete(variant_name(name, variant))
+    return True
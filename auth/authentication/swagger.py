@@ -0,0 +1,15 @@
+from django.conf import settings
+
+# Аннотации схемы для представлений: с выключенной документацией drf_yasg не импортируется
+if settings.SWAGGER_ENABLED:
+    from drf_yasg.openapi import Response as _Response
+    from drf_yasg.utils import swagger_auto_schema
+
+    def schema_response(description):
+        return _Response(description=description)
+else:
+    def swagger_auto_schema(**kwargs):
+        return lambda view: view
+
+    def schema_response(description):
+        return None
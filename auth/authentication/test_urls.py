@@ -0,0 +1,8 @@
+from django.urls import path
+
+from .async_views import async_login_view
+
+# Асинхронные представления подключаются в auth.urls только при ASYNC_AUTH_VIEWS, известном при импорте
+urlpatterns = [
+    path('api/login/', async_login_view),
+]
@@ -1,3 +1,1259 @@
-from django.test import TestCase
+import importlib
+import io
+import os
+import shutil
+import tempfile
+import threading
+import time
+from datetime import timedelta
+from pathlib import Path
+from unittest import mock
 
-# Create your tests here.
+from django.contrib.auth.hashers import PBKDF2PasswordHasher
+from django.contrib.auth.models import Group, Permission
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import CommandError, call_command
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.core.cache import cache
+from django.db import IntegrityError, connection, connections
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from rest_framework.authtoken.models import Token
+from PIL import Image
+from rest_framework.test import APIClient
+
+from .activity import user_activity
+from .benchmarks import compare_to_baseline
+from .management.commands.import_users import Command as ImportUsersCommand
+from .authentication import TokenCache, token_cache
+from .checks import check_shared_caches
+from .expiry import token_activity
+from .hashing import HashingPool, PoolSaturated, hashing_pool
+from .metrics import metrics_store, registry
+from .permissions import IsAdminRole, IsPropertyOwnerRole, permission_cache
+from .models import CustomUser, PhotoReference, TokenActivity, UserProfile
+from .photos import photo_pipeline, variant_name
+from .schema import generate_schema, schema_store
+from .response_cache import response_cache
+from .search import SEARCH_TABLE, has_search_index, search_document
+from .serializers import ProfileRowSerializer
+from .startup import warm_up
+from .throttling import LocalBuckets, login_throttle
+from .tokens import REFRESH, issue_token, issue_token_pair, revocation_list, user_from_payload, verify_token
+
+# The login throttle is process-wide, so the suite would share its buckets; only LoginThrottleTests turns it on.
+throttle_off = override_settings(LOGIN_THROTTLE={'ENABLED': False})
+
+
+def setUpModule():
+    throttle_off.enable()
+
+
+def tearDownModule():
+    throttle_off.disable()
+
+
+class CachedTokenAuthenticationTests(TestCase):
+    def setUp(self):
+        token_cache.clear()
+        self.user = CustomUser.objects.create_user(email='john@example.com', password='Secret-pass1')
+        self.token = Token.objects.create(user=self.user)
+        self.client = APIClient()
+        self.client.credentials(HTTP_AUTHORIZATION=f'Token {self.token.key}')
+
+    @override_settings(PROFILES_RESPONSE_CACHE={'ENABLED': False})
+    def test_repeat_requests_skip_token_lookup(self):
+        url = f'/api/profiles/{self.user.profile.pk}/'
+        self.assertEqual(self.client.get(url).status_code, 200)
+        # Only the profile itself is fetched once the token is cached.
+        with self.assertNumQueries(1):
+            self.assertEqual(self.client.get(url).status_code, 200)
+
+    def test_deleted_token_is_invalidated(self):
+        url = f'/api/profiles/{self.user.profile.pk}/'
+        self.assertEqual(self.client.get(url).status_code, 200)
+        Token.objects.filter(user=self.user).delete()
+        self.assertEqual(self.client.get(url).status_code, 401)
+
+    def test_deactivated_user_is_invalidated(self):
+        url = f'/api/profiles/{self.user.profile.pk}/'
+        self.assertEqual(self.client.get(url).status_code, 200)
+        self.user.is_active = False
+        self.user.save()
+        self.assertEqual(self.client.get(url).status_code, 401)
+
+    def test_invalidation_reaches_other_workers(self):
+        # Two workers: each has its own local LRU in front of the one shared backend.
+        worker_a, worker_b = TokenCache(), TokenCache()
+        worker_a.set(self.token)
+        self.assertEqual(worker_b.get(self.token.key), self.token)
+        worker_a.invalidate(self.token.key)
+        self.assertIsNone(worker_a.get(self.token.key))
+        # Worker B may serve its local copy for LOCAL_TIMEOUT, but not for the shared TIMEOUT.
+        later = time.monotonic() + worker_b.conf['LOCAL_TIMEOUT'] + 1
+        with mock.patch('authentication.cache.time.monotonic', return_value=later):
+            self.assertIsNone(worker_b.get(self.token.key))
+
+    @override_settings(WORKER_PROCESSES=2)
+    def test_several_workers_require_a_shared_cache(self):
+        errors = check_shared_caches(None)
+        self.assertTrue(errors)
+        self.assertEqual({error.id for error in errors}, {'authentication.E001'})
+        shared = {'default': {'BACKEND': 'django.core.cache.backends.db.DatabaseCache', 'LOCATION': 'cache'}}
+        with override_settings(CACHES=shared):
+            self.assertEqual(check_shared_caches(None), [])
+
+
+class UserLoginViewTests(TestCase):
+    def setUp(self):
+        self.user = CustomUser.objects.create_user(email='john@example.com', password='Secret-pass1')
+        Token.objects.create(user=self.user)
+        self.client = APIClient()
+
+    def login(self, password='Secret-pass1'):
+        return self.client.post('/api/login/', {'email': 'john@example.com', 'password': password}, format='json')
+
+    def test_login_hashes_password_once(self):
+        with mock.patch.object(
+            PBKDF2PasswordHasher, 'verify', autospec=True, side_effect=PBKDF2PasswordHasher.verify
+        ) as verify:
+            response = self.login()
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(verify.call_count, 1)
+
+    def test_login_query_budget(self):
+        # Includes the cascade DELETE of the rotated token's TokenActivity row; last_login is buffered
+        with self.assertNumQueries(15):
+            response = self.login()
+        self.assertEqual(response.status_code, 200)
+
+    def test_login_rotates_token(self):
+        old_key = Token.objects.get(user=self.user).key
+        response = self.login()
+        self.assertNotEqual(response.data['token'], old_key)
+        self.assertEqual(list(Token.objects.filter(user=self.user).values_list('key', flat=True)), [response.data['token']])
+
+    def test_invalid_credentials(self):
+        self.assertEqual(self.login(password='wrong').status_code, 400)
+
+
+@override_settings(AUTH_SIGNED_TOKENS={'ENABLED': True})
+class SignedTokenTests(TestCase):
+    def setUp(self):
+        self.user = CustomUser.objects.create_user(email='john@example.com', password='Secret-pass1', is_admin=True)
+        self.client = APIClient()
+
+    def test_login_issues_signed_tokens(self):
+        response = self.client.post(
+            '/api/login/', {'email': 'john@example.com', 'password': 'Secret-pass1'}, format='json'
+        )
+        self.assertIn('access', response.data)
+        self.assertIn('refresh', response.data)
+
+    def test_access_token_verified_without_db(self):
+        self.client.credentials(HTTP_AUTHORIZATION=f'Bearer {issue_token(self.user)}')
+        profile = self.user.profile
+        # Только выборка самого профиля
+        with self.assertNumQueries(1):
+            self.assertEqual(self.client.get(f'/api/profiles/{profile.pk}/').status_code, 200)
+
+    def test_logout_revokes_access_and_refresh_tokens(self):
+        tokens = issue_token_pair(self.user)
+        self.client.credentials(HTTP_AUTHORIZATION=f'Bearer {tokens["access"]}')
+        self.assertEqual(self.client.post('/api/logout/').status_code, 200)
+        self.assertEqual(self.client.get(f'/api/profiles/{self.user.profile.pk}/').status_code, 401)
+        self.client.credentials()
+        response = self.client.post('/api/token/refresh/', {'refresh': tokens['refresh']}, format='json')
+        self.assertEqual(response.status_code, 401)
+
+    def test_logout_revokes_refreshed_tokens_of_the_same_login(self):
+        tokens = issue_token_pair(self.user)
+        refreshed = self.client.post('/api/token/refresh/', {'refresh': tokens['refresh']}, format='json').data
+        self.client.credentials(HTTP_AUTHORIZATION=f'Bearer {refreshed["access"]}')
+        self.assertEqual(self.client.post('/api/logout/').status_code, 200)
+        self.client.credentials()
+        response = self.client.post('/api/token/refresh/', {'refresh': refreshed['refresh']}, format='json')
+        self.assertEqual(response.status_code, 401)
+
+    def test_concurrent_refreshes_claim_the_token_once(self):
+        payload = verify_token(issue_token(self.user, REFRESH), REFRESH)
+        # Both requests passed verification before either revoked the token.
+        self.assertTrue(revocation_list.claim(payload))
+        self.assertFalse(revocation_list.claim(payload))
+
+    def test_refresh_token_is_single_use(self):
+        refresh = issue_token(self.user, REFRESH)
+        response = self.client.post('/api/token/refresh/', {'refresh': refresh}, format='json')
+        self.assertEqual(response.status_code, 200)
+        self.client.credentials(HTTP_AUTHORIZATION=f'Bearer {response.data["access"]}')
+        self.assertEqual(self.client.get(f'/api/profiles/{self.user.profile.pk}/').status_code, 200)
+        self.client.credentials()
+        response = self.client.post('/api/token/refresh/', {'refresh': refresh}, format='json')
+        self.assertEqual(response.status_code, 401)
+
+    def test_access_token_rejected_as_refresh(self):
+        response = self.client.post('/api/token/refresh/', {'refresh': issue_token(self.user)}, format='json')
+        self.assertEqual(response.status_code, 401)
+
+
+class HashingPoolTests(TestCase):
+    @override_settings(AUTH_HASHING_POOL={'MAX_WORKERS': 1, 'MAX_QUEUE': 1})
+    def test_rejects_jobs_beyond_queue_limit(self):
+        pool = HashingPool()
+        release = threading.Event()
+        running = pool.submit(release.wait)
+        queued = pool.submit(lambda: 'done')
+        with self.assertRaises(PoolSaturated):
+            pool.submit(lambda: 'rejected')
+        release.set()
+        self.assertTrue(running.result())
+        self.assertEqual(queued.result(), 'done')
+        # Слоты освобождаются после выполнения задач
+        self.assertEqual(pool.submit(lambda: 'again').result(), 'again')
+        pool.shutdown()
+
+
+@override_settings(ROOT_URLCONF='authentication.test_urls')
+class AsyncLoginViewTests(TransactionTestCase):
+    def setUp(self):
+        CustomUser.objects.create_user(email='john@example.com', password='Secret-pass1')
+
+    async def test_login_runs_on_hashing_pool(self):
+        with mock.patch('authentication.hashing.hashing_pool.submit', wraps=hashing_pool.submit) as submit:
+            response = await self.async_client.post(
+                '/api/login/', {'email': 'john@example.com', 'password': 'Secret-pass1'}, content_type='application/json'
+            )
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(submit.call_count, 1)
+        self.assertIn('token', response.json())
+
+
+class ImportUsersCommandTests(TestCase):
+    def test_imports_users_with_profiles_and_reports_rejects(self):
+        CustomUser.objects.create_user(email='taken@example.com', password='Secret-pass1')
+        with tempfile.TemporaryDirectory() as tmp:
+            source = os.path.join(tmp, 'users.jsonl')
+            with open(source, 'w') as f:
+                f.write('{"email": "ann@example.com", "password": "Pass-word1", "phone_number": "+14155552671"}\n')
+                f.write('{"email": "taken@example.com", "password": "Pass-word1"}\n')
+                f.write('{"email": "not-an-email"}\n')
+                f.write('{"email": "bob@example.com", "first_name": "Bob", "is_admin": true}\n')
+            call_command('import_users', source, workers=1, batch_size=2, stdout=io.StringIO())
+
+            with open(f'{source}.rejects.csv') as f:
+                rejected_rows = [line.split(',')[0] for line in f.read().splitlines()[1:]]
+            with open(f'{source}.checkpoint') as f:
+                checkpoint = f.read()
+
+        self.assertEqual(rejected_rows, ['2', '3'])
+        self.assertEqual(checkpoint, '{"row": 4}')
+        ann = CustomUser.objects.get(email='ann@example.com')
+        self.assertTrue(ann.check_password('Pass-word1'))
+        self.assertEqual(str(ann.profile.phone_number), '+14155552671')
+        self.assertTrue(CustomUser.objects.get(email='bob@example.com').is_admin)
+        self.assertEqual(UserProfile.objects.count(), 3)
+
+    def test_rows_that_keep_conflicting_are_rejected(self):
+        insert = ImportUsersCommand.insert
+
+        def conflicting_insert(command, valid):
+            # A conflict the existence check never sees, e.g. a registration racing every retry.
+            if any(cleaned['email'] == 'bob@example.com' for _, cleaned in valid):
+                raise IntegrityError('UNIQUE constraint failed')
+            insert(command, valid)
+
+        with tempfile.TemporaryDirectory() as tmp:
+            source = os.path.join(tmp, 'users.jsonl')
+            with open(source, 'w') as f:
+                f.write('{"email": "ann@example.com", "password": "Pass-word1"}\n')
+                f.write('{"email": "bob@example.com", "password": "Pass-word1"}\n')
+            with mock.patch.object(ImportUsersCommand, 'insert', conflicting_insert):
+                call_command('import_users', source, workers=1, batch_size=2, stdout=io.StringIO())
+            with open(f'{source}.rejects.csv') as f:
+                rejected_rows = [line.split(',')[0] for line in f.read().splitlines()[1:]]
+
+        self.assertEqual(rejected_rows, ['2'])
+        self.assertEqual(list(CustomUser.objects.values_list('email', flat=True)), ['ann@example.com'])
+
+
+class WriteAmplificationTests(TestCase):
+    def setUp(self):
+        self.user = CustomUser.objects.create_user(email='john@example.com', password='Secret-pass1')
+        self.client = APIClient()
+
+    def writes(self, request):
+        with CaptureQueriesContext(connection) as queries:
+            response = request()
+        statements = [q['sql'].split(' ', 1)[0] for q in queries.captured_queries]
+        return response, [s for s in statements if s in ('INSERT', 'UPDATE', 'DELETE')]
+
+    def test_login_does_not_touch_profile(self):
+        modified_at = self.user.profile.modified_at
+        response, writes = self.writes(lambda: self.client.post(
+            '/api/login/', {'email': 'john@example.com', 'password': 'Secret-pass1'}, format='json'
+        ))
+        self.assertEqual(response.status_code, 200)
+        # session INSERT, token INSERT, session UPDATE; last_login goes through the activity buffer
+        self.assertEqual(writes, ['INSERT', 'INSERT', 'UPDATE'])
+        self.user.profile.refresh_from_db()
+        self.assertEqual(self.user.profile.modified_at, modified_at)
+
+    def test_registration_writes(self):
+        response, writes = self.writes(lambda: self.client.post('/api/register/', {
+            'email': 'jane@example.com', 'password': 'Secret-pass1', 'password2': 'Secret-pass1',
+            'profile': {'phone_number': '+14155552671'},
+        }, format='json'))
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(response.data['user']['phone_number'], '+14155552671')
+        # user, profile with the registration data, token
+        self.assertEqual(writes, ['INSERT', 'INSERT', 'INSERT'])
+
+    def test_registration_query_budget(self):
+        data = {
+            'email': 'jane@example.com', 'password': 'Secret-pass1', 'password2': 'Secret-pass1',
+            'profile': {'phone_number': '+14155552671', 'additional_info': 'Hi'},
+        }
+        # email check, phone check, SAVEPOINT, 3 INSERTs, RELEASE; the response needs no reads
+        with self.assertNumQueries(7):
+            response = self.client.post('/api/register/', data, format='json')
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(response.data['user']['additional_info'], 'Hi')
+        self.assertEqual(UserProfile.objects.get(user__email='jane@example.com').additional_info, 'Hi')
+
+        response = self.client.post('/api/register/', {**data, 'email': 'jane@EXAMPLE.com', 'profile': {}}, format='json')
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('email', response.data)
+
+    def test_profile_update_writes_changed_fields_only(self):
+        self.client.force_authenticate(self.user)
+        response, writes = self.writes(lambda: self.client.patch(
+            f'/api/profiles/{self.user.profile.pk}/', {'additional_info': 'Hello'}, format='json'
+        ))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(writes, ['UPDATE'])
+        _, writes = self.writes(lambda: self.client.patch(
+            f'/api/profiles/{self.user.profile.pk}/', {'additional_info': 'Hello'}, format='json'
+        ))
+        self.assertEqual(writes, [])
+
+    def test_unchanged_user_save_is_skipped(self):
+        user = CustomUser.objects.get(pk=self.user.pk)
+        with self.assertNumQueries(0):
+            user.save()
+        user.first_name = 'John'
+        with CaptureQueriesContext(connection) as queries:
+            user.save()
+        self.assertEqual(len(queries), 1)
+        self.assertNotIn('"password"', queries[0]['sql'])
+
+    @override_settings(PHOTO_PROCESSING={'ASYNC': False})
+    def test_field_file_save_is_written(self):
+        media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media_root)
+        with override_settings(MEDIA_ROOT=media_root):
+            # Snapshot taken when the profile was created, after pre_save wrapped the photo in a FieldFile.
+            profile = self.user.profile
+            # FieldFile.save() renames that same object before saving the profile.
+            with self.captureOnCommitCallbacks(execute=True):
+                profile.photo.save('photo.png', image_upload())
+        stored = UserProfile.objects.filter(pk=profile.pk).values_list('photo', flat=True).get()
+        self.assertEqual(stored, profile.photo.name)
+        self.assertNotEqual(stored, 'Default.png')
+        self.assertEqual(PhotoReference.objects.get(name=stored).references, 1)
+
+
+class ProfilePaginationTests(TestCase):
+    def setUp(self):
+        self.users = [
+            CustomUser.objects.create_user(email=f'user{i}@example.com', password='Secret-pass1') for i in range(5)
+        ]
+        # Одинаковые created_at у части профилей: порядок определяется id
+        UserProfile.objects.filter(user__in=self.users[1:4]).update(created_at=self.users[1].profile.created_at)
+        self.client = APIClient()
+        self.client.force_authenticate(self.users[0])
+
+    def emails(self, response):
+        return [item['user']['email'] for item in response.data['results']]
+
+    def test_walks_pages_forward_and_back(self):
+        expected = [u.email for u in sorted(
+            self.users, key=lambda u: (UserProfile.objects.get(user=u).created_at, u.profile.pk), reverse=True
+        )]
+        response = self.client.get('/api/profiles/', {'page_size': 2})
+        pages = [self.emails(response)]
+        while response.data['next']:
+            response = self.client.get(response.data['next'])
+            pages.append(self.emails(response))
+        self.assertEqual(sum(pages, []), expected)
+        self.assertEqual([len(page) for page in pages], [2, 2, 1])
+
+        response = self.client.get(response.data['previous'])
+        self.assertEqual(self.emails(response), pages[1])
+        self.assertIsNotNone(response.data['next'])
+
+    def test_ordering_by_modified_at(self):
+        response = self.client.get('/api/profiles/', {'ordering': 'modified_at', 'page_size': 10})
+        self.assertEqual(self.emails(response), [u.email for u in self.users])
+
+    def test_invalid_cursor(self):
+        self.assertEqual(self.client.get('/api/profiles/', {'cursor': 'garbage'}).status_code, 404)
+
+
+class ProfileSearchTests(TestCase):
+    def setUp(self):
+        self.ann = CustomUser.objects.create_user(email='Ann.Smith@Example.com', password='Secret-pass1')
+        self.bob = CustomUser.objects.create_user(email='bob@example.org', password='Secret-pass1')
+        self.bob.profile.phone_number = '+14155552671'
+        self.bob.profile.save()
+        self.client = APIClient()
+        self.client.force_authenticate(self.ann)
+
+    def search(self, term):
+        response = self.client.get('/api/profiles/', {'search': term})
+        return sorted(item['user']['email'] for item in response.data['results'])
+
+    def test_matches_substrings_case_insensitively(self):
+        self.assertEqual(self.search('smith@ex'), ['Ann.Smith@example.com'])
+        self.assertEqual(self.search('EXAMPLE'), ['Ann.Smith@example.com', 'bob@example.org'])
+        self.assertEqual(self.search('55526'), ['bob@example.org'])
+        self.assertEqual(self.search('nobody'), [])
+
+    def test_short_terms_and_multiple_terms(self):
+        self.assertEqual(self.search('.o'), ['bob@example.org'])
+        self.assertEqual(self.search('example 4155'), ['bob@example.org'])
+
+    def test_email_change_updates_search(self):
+        self.ann.email = 'carol@example.net'
+        self.ann.save()
+        self.assertEqual(self.search('carol'), ['carol@example.net'])
+        self.assertEqual(self.search('smith'), [])
+
+    def test_email_change_builds_the_same_document_as_save(self):
+        for user, email in ((self.ann, 'Carol@Example.net'), (CustomUser.objects.get(pk=self.bob.pk), 'dave@example.net')):
+            user.email = email
+            user.save()
+            profile = UserProfile.objects.get(user=user)
+            self.assertEqual(profile.search_document, search_document(user.email, profile.phone_number))
+        self.assertEqual(UserProfile.objects.get(user=self.ann).search_document, 'carol@example.net')
+
+    def test_uses_fts_index_on_sqlite(self):
+        self.assertTrue(has_search_index(connection))
+        with CaptureQueriesContext(connection) as queries:
+            self.search('smith')
+        self.assertTrue(any(SEARCH_TABLE in query['sql'] for query in queries))
+
+
+class ProfileReadPathTests(TestCase):
+    def setUp(self):
+        for i in range(3):
+            user = CustomUser.objects.create_user(email=f'user{i}@example.com', password='Secret-pass1', is_admin=i == 0)
+            user.profile.phone_number = f'+1415555267{i}'
+            user.profile.additional_info = f'Info {i}'
+            user.profile.save()
+        UserProfile.objects.filter(user__email='user2@example.com').update(photo=None)
+        self.user = user
+        self.client = APIClient()
+        self.client.force_authenticate(user)
+
+    def get_both(self, url, params=None):
+        fast = self.client.get(url, params)
+        with override_settings(PROFILES_FAST_READ=False):
+            slow = self.client.get(url, params)
+        self.assertEqual(fast.status_code, 200)
+        return fast, slow
+
+    def test_fast_path_is_byte_identical(self):
+        for url in ['/api/profiles/', f'/api/profiles/{self.user.profile.pk}/']:
+            fast, slow = self.get_both(url)
+            self.assertEqual(fast.content, slow.content)
+
+    def test_sparse_fieldsets(self):
+        fast, slow = self.get_both('/api/profiles/', {'fields': 'user,phone_number'})
+        self.assertEqual(fast.content, slow.content)
+        self.assertEqual(list(fast.data['results'][0]), ['user', 'phone_number'])
+
+        fast, slow = self.get_both(f'/api/profiles/{self.user.profile.pk}/', {'omit': 'user,photo,photo_variants'})
+        self.assertEqual(fast.content, slow.content)
+        self.assertEqual(list(fast.data), ['phone_number', 'additional_info', 'created_at', 'modified_at'])
+
+    def test_sparse_fieldsets_narrow_the_query(self):
+        with CaptureQueriesContext(connection) as queries:
+            self.client.get('/api/profiles/', {'fields': 'phone_number'})
+        sql = queries[-1]['sql']
+        self.assertNotIn('authentication_customuser', sql)
+        self.assertNotIn('additional_info', sql)
+
+    def test_unknown_field(self):
+        self.assertEqual(self.client.get('/api/profiles/', {'fields': 'password'}).status_code, 400)
+
+
+class ConditionalGetTests(TestCase):
+    def setUp(self):
+        self.user = CustomUser.objects.create_user(email='john@example.com', password='Secret-pass1')
+        self.other = CustomUser.objects.create_user(email='jane@example.com', password='Secret-pass1')
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        self.url = f'/api/profiles/{self.user.profile.pk}/'
+
+    def assert_not_modified(self, url, **headers):
+        with mock.patch.object(ProfileRowSerializer, 'to_representation') as to_representation:
+            response = self.client.get(url, **headers)
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response.content, b'')
+        to_representation.assert_not_called()
+        return response
+
+    def test_retrieve_etag_and_last_modified(self):
+        response = self.client.get(self.url)
+        self.assertIn('ETag', response.headers)
+        self.assertIn('Last-Modified', response.headers)
+        not_modified = self.assert_not_modified(self.url, HTTP_IF_NONE_MATCH=response.headers['ETag'])
+        self.assertEqual(not_modified.headers['ETag'], response.headers['ETag'])
+        self.assert_not_modified(self.url, HTTP_IF_MODIFIED_SINCE=response.headers['Last-Modified'])
+
+    def test_retrieve_changes_after_update(self):
+        etag = self.client.get(self.url).headers['ETag']
+        self.client.patch(self.url, {'additional_info': 'Updated'}, format='json')
+        response = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response.headers['ETag'], etag)
+
+    def test_user_changes_change_profile_etag(self):
+        etag = self.client.get(self.url).headers['ETag']
+        self.user.is_property_owner = True
+        self.user.save()
+        self.assertEqual(self.client.get(self.url, HTTP_IF_NONE_MATCH=etag).status_code, 200)
+
+    def test_list_etag_follows_changes_and_deletions(self):
+        etag = self.client.get('/api/profiles/').headers['ETag']
+        self.assert_not_modified('/api/profiles/', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(self.client.get('/api/profiles/', {'fields': 'user'}, HTTP_IF_NONE_MATCH=etag).status_code, 200)
+        self.other.delete()
+        self.assertEqual(self.client.get('/api/profiles/', HTTP_IF_NONE_MATCH=etag).status_code, 200)
+
+    @override_settings(PROFILES_RESPONSE_CACHE={'ENABLED': False})
+    def test_list_validators_do_not_scan_the_table(self):
+        etag = self.client.get('/api/profiles/').headers['ETag']
+        with self.assertNumQueries(0):
+            self.assert_not_modified('/api/profiles/', HTTP_IF_NONE_MATCH=etag)
+        UserProfile.objects.filter(pk=self.other.profile.pk).update(additional_info='Imported')
+        response_cache.invalidate_lists()  # What bulk writers such as import_users do
+        self.assertEqual(self.client.get('/api/profiles/', HTTP_IF_NONE_MATCH=etag).status_code, 200)
+
+
+class ProfileResponseCacheTests(TestCase):
+    def setUp(self):
+        response_cache.reset_stats()
+        self.user = CustomUser.objects.create_user(email='john@example.com', password='Secret-pass1')
+        self.other = CustomUser.objects.create_user(email='jane@example.com', password='Secret-pass1')
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        self.url = f'/api/profiles/{self.other.profile.pk}/'
+
+    def test_hit_without_queries(self):
+        first = self.client.get('/api/profiles/')
+        with self.assertNumQueries(0):
+            second = self.client.get('/api/profiles/')
+        self.assertEqual(second.status_code, 200)
+        self.assertEqual(second.content, first.content)
+        self.assertEqual(second.headers['ETag'], first.headers['ETag'])
+        with self.assertNumQueries(0):
+            self.assertEqual(self.client.get('/api/profiles/', HTTP_IF_NONE_MATCH=first.headers['ETag']).status_code, 304)
+        self.assertEqual(response_cache.stats()['hits'], 2)
+
+    def test_profile_update_invalidates(self):
+        self.client.get(self.url)
+        self.client.get('/api/profiles/')
+        self.client.patch(self.url, {'additional_info': 'Updated'}, format='json')
+        self.assertEqual(self.client.get(self.url).json()['additional_info'], 'Updated')
+        self.assertEqual(self.client.get('/api/profiles/').json()['results'][0]['additional_info'], 'Updated')
+
+    def test_user_change_invalidates(self):
+        self.client.get(self.url)
+        self.other.email = 'janet@example.com'
+        self.other.save()
+        self.assertEqual(self.client.get(self.url).json()['user']['email'], 'janet@example.com')
+
+    def test_delete_invalidates(self):
+        self.assertEqual(len(self.client.get('/api/profiles/').json()['results']), 2)
+        self.other.delete()
+        self.assertEqual(len(self.client.get('/api/profiles/').json()['results']), 1)
+        self.assertEqual(self.client.get(self.url).status_code, 404)
+
+    def test_keys_separate_query_and_visibility(self):
+        self.client.get('/api/profiles/')
+        self.client.get('/api/profiles/', {'search': 'jane'})
+        admin = CustomUser.objects.create_superuser(email='admin@example.com', password='Secret-pass1')
+        response_cache.reset_stats()
+        self.client.force_authenticate(admin)
+        self.client.get('/api/profiles/')
+        self.assertEqual(response_cache.stats()['hits'], 0)
+
+    def test_stats_requires_admin(self):
+        self.assertEqual(self.client.get('/api/profiles/cache-stats/').status_code, 403)
+        self.client.force_authenticate(CustomUser.objects.create_superuser(email='admin@example.com', password='Secret-pass1'))
+        self.assertEqual(set(self.client.get('/api/profiles/cache-stats/').json()), {'hits', 'misses', 'hit_ratio'})
+
+
+def image_upload(name='photo.png', size=(1200, 900), image_format='PNG', color='teal'):
+    buffer = io.BytesIO()
+    Image.new('RGB', size, color).save(buffer, image_format)
+    return SimpleUploadedFile(name, buffer.getvalue(), content_type=f'image/{image_format.lower()}')
+
+
+class ProfilePhotoTests(TestCase):
+    def setUp(self):
+        self.media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.media_root)
+        media = override_settings(MEDIA_ROOT=self.media_root)
+        media.enable()
+        self.addCleanup(media.disable)
+
+        self.user = CustomUser.objects.create_user(email='john@example.com', password='Secret-pass1')
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        self.url = f'/api/profiles/{self.user.profile.pk}/'
+
+    def upload(self, upload):
+        with self.captureOnCommitCallbacks(execute=True):
+            return self.client.patch(self.url, {'photo': upload}, format='multipart')
+
+    def test_upload_is_processed_in_background(self):
+        with mock.patch.object(photo_pipeline, 'submit') as submit:
+            response = self.upload(image_upload())
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['photo_variants'], {})
+        profile = UserProfile.objects.get(pk=self.user.profile.pk)
+        submit.assert_called_once_with(profile.pk, profile.photo.name)
+
+    @override_settings(PHOTO_PROCESSING={'ASYNC': False})
+    def test_variants_are_bounded_webp(self):
+        self.upload(image_upload())
+        profile = UserProfile.objects.get(pk=self.user.profile.pk)
+        self.assertEqual(set(profile.photo_variants), {'thumbnail', 'small', 'medium'})
+        self.assertEqual(profile.photo_variants['thumbnail'], variant_name(profile.photo.name, 'thumbnail'))
+        with profile.photo.storage.open(profile.photo_variants['thumbnail']) as f, Image.open(f) as image:
+            self.assertEqual((image.format, image.size), ('WEBP', (128, 96)))
+
+        urls = self.client.get(self.url).json()['photo_variants']
+        self.assertTrue(urls['medium'].startswith('http://testserver/images/photos/'))
+
+    @override_settings(PHOTO_PROCESSING={'ASYNC': False})
+    def test_replaced_and_deleted_photo_variants_are_removed(self):
+        self.upload(image_upload())
+        storage = UserProfile._meta.get_field('photo').storage
+        old = UserProfile.objects.get(pk=self.user.profile.pk).photo_variants
+        self.upload(image_upload('other.png', color='navy'))
+        new = UserProfile.objects.get(pk=self.user.profile.pk).photo_variants
+        self.assertFalse(any(storage.exists(name) for name in old.values()))
+        self.assertTrue(all(storage.exists(name) for name in new.values()))
+        with self.captureOnCommitCallbacks(execute=True):
+            self.user.delete()
+        self.assertFalse(any(storage.exists(name) for name in new.values()))
+
+    def test_invalid_uploads_are_rejected(self):
+        not_image = SimpleUploadedFile('photo.png', b'not an image', content_type='image/png')
+        self.assertEqual(self.client.patch(self.url, {'photo': not_image}, format='multipart').status_code, 400)
+        with override_settings(PHOTO_PROCESSING={'MAX_PIXELS': 1000}):
+            response = self.client.patch(self.url, {'photo': image_upload()}, format='multipart')
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('photo', response.json())
+
+
+class PhotoStorageTests(TestCase):
+    def setUp(self):
+        self.media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.media_root)
+        media = override_settings(MEDIA_ROOT=self.media_root, PHOTO_PROCESSING={'ASYNC': False})
+        media.enable()
+        self.addCleanup(media.disable)
+        self.storage = UserProfile._meta.get_field('photo').storage
+        self.users = [
+            CustomUser.objects.create_user(email=f'user{i}@example.com', password='Secret-pass1') for i in range(2)
+        ]
+
+    def set_photo(self, user, upload):
+        with self.captureOnCommitCallbacks(execute=True):
+            profile = UserProfile.objects.get(user=user)
+            profile.photo = upload
+            profile.save()
+        return profile
+
+    def test_identical_uploads_share_one_file(self):
+        first = self.set_photo(self.users[0], image_upload('a.png'))
+        second = self.set_photo(self.users[1], image_upload('b.png'))
+        self.assertEqual(first.photo.name, second.photo.name)
+        self.assertRegex(first.photo.name, r'^photos/[0-9a-f]{2}/[0-9a-f]{64}\.png$')
+        self.assertEqual(PhotoReference.objects.get(name=first.photo.name).references, 2)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.users[0].delete()
+        self.assertTrue(self.storage.exists(first.photo.name))
+        with self.captureOnCommitCallbacks(execute=True):
+            self.users[1].delete()
+        self.assertFalse(self.storage.exists(first.photo.name))
+        self.assertFalse(PhotoReference.objects.exists())
+
+    def test_upload_pins_a_file_being_collected(self):
+        name = self.set_photo(self.users[0], image_upload()).photo.name
+        with self.captureOnCommitCallbacks() as collection:
+            self.users[0].delete()
+        exists = self.storage.exists
+
+        def exists_then_collect(name):
+            found = exists(name)
+            while collection:
+                collection.pop()()  # The deletion's collection runs right after the upload's check.
+            return found
+
+        with mock.patch.object(self.storage, 'exists', exists_then_collect):
+            profile = self.set_photo(self.users[1], image_upload())
+        self.assertEqual(profile.photo.name, name)
+        self.assertTrue(self.storage.exists(name))
+        self.assertEqual(PhotoReference.objects.get(name=name).references, 1)
+
+    def test_default_photo_is_never_deleted(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            self.users[0].delete()
+        self.assertFalse(PhotoReference.objects.exists())
+
+    def test_serving_with_cache_headers_and_ranges(self):
+        name = self.set_photo(self.users[0], image_upload()).photo.name
+        with self.storage.open(name) as f:
+            content = f.read()
+        url = f'/images/{name}'
+
+        response = self.client.get(url)
+        self.assertEqual(b''.join(response.streaming_content), content)
+        self.assertIn('immutable', response.headers['Cache-Control'])
+        self.assertEqual(response.headers['Accept-Ranges'], 'bytes')
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=response.headers['ETag']).status_code, 304)
+
+        partial = self.client.get(url, HTTP_RANGE='bytes=10-19')
+        self.assertEqual(partial.status_code, 206)
+        self.assertEqual(b''.join(partial.streaming_content), content[10:20])
+        self.assertEqual(partial.headers['Content-Range'], f'bytes 10-19/{len(content)}')
+        self.assertEqual(b''.join(self.client.get(url, HTTP_RANGE='bytes=-5').streaming_content), content[-5:])
+        self.assertEqual(self.client.get(url, HTTP_RANGE=f'bytes={len(content)}-').status_code, 416)
+
+        self.assertEqual(self.client.get('/images/../settings.py').status_code, 404)
+        with override_settings(MEDIA_SERVING={'MODE': 'x-accel-redirect'}):
+            response = self.client.get(url)
+        self.assertEqual(response.headers['X-Accel-Redirect'], f'/protected-media/{name}')
+        self.assertEqual(response.content, b'')
+
+
+class OpenAPISchemaTests(TestCase):
+    def setUp(self):
+        schema_store.clear()
+        self.addCleanup(schema_store.clear)
+
+    def test_lazy_schema_is_generated_once(self):
+        with mock.patch('authentication.schema.generate_schema', wraps=generate_schema) as generate:
+            response = self.client.get('/swagger.json')
+            self.assertEqual(self.client.get('/swagger.yaml').status_code, 200)
+            self.assertEqual(self.client.get('/swagger.json', HTTP_IF_NONE_MATCH=response.headers['ETag']).status_code, 304)
+        self.assertEqual(generate.call_count, 1)
+        self.assertIn('/profiles/', response.json()['paths'])
+
+    def test_prebuilt_schema_and_stale_check(self):
+        path = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, path)
+        with self.assertRaises(CommandError):
+            call_command('build_openapi_schema', output_dir=path, check=True, stdout=io.StringIO())
+        call_command('build_openapi_schema', output_dir=path, stdout=io.StringIO())
+        call_command('build_openapi_schema', output_dir=path, check=True, stdout=io.StringIO())
+
+        with open(os.path.join(path, 'openapi.json'), 'wb') as f:
+            f.write(b'{"swagger": "2.0", "paths": {}}')
+        with override_settings(OPENAPI_SCHEMA={'MODE': 'prebuilt', 'PATH': Path(path)}), \
+                mock.patch('authentication.schema.generate_schema') as generate:
+            self.assertEqual(self.client.get('/swagger.json').json(), {'swagger': '2.0', 'paths': {}})
+        generate.assert_not_called()
+        with self.assertRaises(CommandError):
+            call_command('build_openapi_schema', output_dir=path, check=True, stdout=io.StringIO())
+
+    def test_disabled_swagger_annotations_skip_drf_yasg(self):
+        from . import swagger
+
+        self.addCleanup(importlib.reload, swagger)
+        with override_settings(SWAGGER_ENABLED=False), mock.patch.dict('sys.modules', {'drf_yasg.utils': None}):
+            importlib.reload(swagger)  # Would raise ImportError if drf_yasg.utils were imported
+        view = object()
+        self.assertIs(swagger.swagger_auto_schema(responses={200: swagger.schema_response('OK')})(view), view)
+
+
+@override_settings(DATABASE_READ_REPLICA={'ENABLED': True, 'ALIAS': 'replica', 'STICKY_SECONDS': 5})
+class ReadReplicaTests(TransactionTestCase):
+    databases = {'default', 'replica'}
+
+    def setUp(self):
+        self.user = CustomUser.objects.create_user(email='john@example.com', password='Secret-pass1')
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        self.url = f'/api/profiles/{self.user.profile.pk}/'
+        cache.clear()  # Forget the read-after-write window opened by creating the user
+
+    def queries_on(self, alias, *args, **kwargs):
+        with CaptureQueriesContext(connections[alias]) as queries:
+            response = self.client.generic(*args, **kwargs)
+        self.assertLess(response.status_code, 400)
+        return len(queries)
+
+    def test_reads_go_to_replica(self):
+        self.assertGreater(self.queries_on('replica', 'GET', '/api/profiles/'), 0)
+        self.assertGreater(self.queries_on('replica', 'GET', self.url), 0)
+
+    def test_reads_stick_to_primary_after_write(self):
+        self.client.patch(self.url, {'additional_info': 'Updated'}, format='json')
+        self.assertEqual(self.queries_on('replica', 'GET', self.url), 0)
+        self.assertEqual(self.client.get(self.url).json()['additional_info'], 'Updated')
+
+    def test_reads_stick_to_primary_after_login(self):
+        self.client.force_authenticate(None)
+        response = self.client.post('/api/login/', {'email': 'john@example.com', 'password': 'Secret-pass1'})
+        self.client.credentials(HTTP_AUTHORIZATION=f"Token {response.json()['token']}")
+        self.assertEqual(self.queries_on('replica', 'GET', '/api/profiles/'), 0)
+
+    def test_writes_use_primary(self):
+        self.assertEqual(self.queries_on('replica', 'PATCH', self.url, '{"additional_info": "x"}', 'application/json'), 0)
+
+    def test_sqlite_pragmas(self):
+        with connection.cursor() as cursor:
+            cursor.execute('PRAGMA synchronous')
+            self.assertEqual(cursor.fetchone()[0], 1)  # NORMAL
+
+
+@override_settings(LOGIN_THROTTLE={'ENABLED': True})
+class LoginThrottleTests(TestCase):
+    def setUp(self):
+        login_throttle.reset()
+        CustomUser.objects.create_user(email='john@example.com', password='Secret-pass1')
+
+    @override_settings(LOGIN_THROTTLE={'EMAIL_RATE': '3/min'})
+    def test_rejects_before_hashing(self):
+        credentials = {'email': 'John@example.com', 'password': 'wrong'}
+        for _ in range(3):
+            self.assertEqual(self.client.post('/api/login/', credentials).status_code, 400)
+        with mock.patch.object(PBKDF2PasswordHasher, 'verify') as verify, self.assertNumQueries(0):
+            response = self.client.post('/api/login/', {**credentials, 'email': 'john@example.com'})
+        self.assertEqual(response.status_code, 429)
+        self.assertGreaterEqual(int(response.headers['Retry-After']), 1)
+        verify.assert_not_called()
+        # A different email from the same IP is still allowed
+        self.assertEqual(self.client.post('/api/login/', {'email': 'jane@example.com', 'password': 'x'}).status_code, 400)
+
+    @override_settings(LOGIN_THROTTLE={'IP_RATE': '2/min'})
+    def test_token_endpoint_is_throttled_by_ip(self):
+        for i in range(2):
+            self.client.post('/api/token/', {'username': f'user{i}@example.com', 'password': 'x'})
+        self.assertEqual(self.client.post('/api/token/', {'username': 'other@example.com', 'password': 'x'}).status_code, 429)
+
+    @override_settings(LOGIN_THROTTLE={'IP_RATE': '2/min'})
+    def test_forwarded_for_header_does_not_bypass_ip_limit(self):
+        for i in range(2):
+            self.client.post('/api/login/', {'email': f'user{i}@example.com', 'password': 'x'}, HTTP_X_FORWARDED_FOR=f'10.0.0.{i}')
+        response = self.client.post('/api/login/', {'email': 'other@example.com', 'password': 'x'}, HTTP_X_FORWARDED_FOR='10.0.0.9')
+        self.assertEqual(response.status_code, 429)
+
+    def test_bucket_refills_and_evicts(self):
+        buckets = LocalBuckets(maxsize=2)
+        now = [0.0]
+        buckets.clock = lambda: now[0]
+        self.assertEqual(buckets.take('a', 1, 1.0), 0)
+        self.assertEqual(buckets.take('a', 1, 1.0), 1.0)
+        now[0] = 1.0
+        self.assertEqual(buckets.take('a', 1, 1.0), 0)
+        buckets.take('b', 1, 1.0)
+        buckets.take('c', 1, 1.0)
+        self.assertEqual(len(buckets._buckets), 2)
+
+
+class BenchmarkBaselineTests(TestCase):
+    def test_compare_to_baseline(self):
+        baseline = {'client': {'list': {'p95': 0.010, 'queries': 3}, 'login': {'p95': 0.300, 'queries': 14}}}
+        results = {'client': {'list': {'p95': 0.015, 'queries': 3}, 'login': {'p95': 0.700, 'queries': 15}}}
+        failures = compare_to_baseline(results, baseline, latency_tolerance=2.0)
+        self.assertEqual(len(failures), 2)
+        self.assertTrue(all(failure.startswith('client login') for failure in failures))
+        self.assertEqual(compare_to_baseline({'live': {}}, baseline), [])
+
+
+class MetricsTests(TestCase):
+    def setUp(self):
+        token_cache.clear()
+        self.user = CustomUser.objects.create_user(email='john@example.com', password='Secret-pass1')
+        registry.clear()
+
+    def metrics(self):
+        response = self.client.get('/metrics')
+        self.assertEqual(response.status_code, 200)
+        return response.content.decode()
+
+    def test_login_latency_queries_and_hashing(self):
+        self.client.post('/api/login/', {'email': 'john@example.com', 'password': 'Secret-pass1'})
+        text = self.metrics()
+        self.assertIn('http_request_duration_seconds_count{view="login",method="POST"} 1', text)
+        self.assertIn('http_requests_total{view="login",method="POST",status="200"} 1', text)
+        self.assertIn('http_request_db_queries_count{view="login"} 1', text)
+        self.assertIn('password_hasher_seconds_count{view="login"} 1', text)
+        self.assertIn('http_request_duration_seconds_bucket{view="login",method="POST",le="+Inf"} 1', text)
+
+    def test_token_cache_lookups(self):
+        token = Token.objects.create(user=self.user)
+        for _ in range(2):
+            self.client.get('/api/profiles/', HTTP_AUTHORIZATION=f'Token {token.key}')
+        text = self.metrics()
+        self.assertIn('token_cache_lookups_total{view="userprofile-list",result="miss"} 1', text)
+        self.assertIn('token_cache_lookups_total{view="userprofile-list",result="local"} 1', text)
+
+    def test_unresolved_paths_share_one_label(self):
+        self.client.get('/no/such/page/1')
+        self.client.get('/no/such/page/2')
+        self.assertIn('http_requests_total{view="unmatched",method="GET",status="404"} 2', self.metrics())
+
+    @override_settings(METRICS={'SLOW_REQUEST_SECONDS': 0})
+    def test_slow_request_log_includes_sql(self):
+        token = Token.objects.create(user=self.user)
+        with self.assertLogs('authentication.metrics', 'WARNING') as logs:
+            self.client.get('/api/profiles/', HTTP_AUTHORIZATION=f'Token {token.key}')
+        self.assertIn('userprofile-list', logs.output[0])
+        self.assertIn('SELECT', logs.output[0])
+
+    @override_settings(METRICS={'ALLOWED_IPS': ['10.0.0.1']})
+    def test_endpoint_restricted_by_ip(self):
+        self.assertEqual(self.client.get('/metrics').status_code, 404)
+        self.assertEqual(self.client.get('/metrics', REMOTE_ADDR='10.0.0.1').status_code, 200)
+
+    @override_settings(METRICS={})
+    def test_endpoint_private_by_default(self):
+        self.assertEqual(self.client.get('/metrics', REMOTE_ADDR='203.0.113.5').status_code, 404)
+        # Behind nginx every public request comes from a private address
+        self.assertEqual(self.client.get('/metrics', REMOTE_ADDR='192.168.1.10').status_code, 404)
+        self.assertEqual(self.client.get('/metrics', REMOTE_ADDR='::1').status_code, 200)
+
+    def test_workers_are_summed(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        with override_settings(METRICS={'MULTIPROCESS_DIR': directory}):
+            self.client.get('/no/such/page')
+            # Another worker's file: the same series plus one this process has not seen.
+            other = registry.state()
+            other['http_requests_total'] = {('unmatched', 'GET', 404): 2, ('login', 'POST', 200): 1}
+            with mock.patch('authentication.metrics.os.getpid', return_value=-1), \
+                    mock.patch.object(registry, 'state', return_value=other):
+                metrics_store.write()
+            text = self.metrics()
+        self.assertIn('http_requests_total{view="unmatched",method="GET",status="404"} 3', text)
+        self.assertIn('http_requests_total{view="login",method="POST",status="200"} 1', text)
+        self.assertIn('http_request_duration_seconds_count{view="unmatched",method="GET"} 2', text)
+
+    def test_reused_pid_keeps_the_dead_workers_file(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        with override_settings(METRICS={'MULTIPROCESS_DIR': directory}):
+            metrics_store.write()
+            # A new worker with the same pid starts with an empty registry
+            with mock.patch.object(metrics_store, '_filenames', {}):
+                metrics_store.write()
+        self.assertEqual(len(os.listdir(directory)), 2)
+
+
+class ProfileBatchTests(TestCase):
+    def setUp(self):
+        self.users = [CustomUser.objects.create_user(email=f'user{i}@example.com', password='Secret-pass1') for i in range(3)]
+        self.client = APIClient()
+        self.client.force_authenticate(self.users[0])
+
+    def test_one_query_keyed_by_identifier(self):
+        profile = self.users[1].profile
+        with self.assertNumQueries(1):
+            response = self.client.post('/api/profiles/batch/', {
+                'ids': [profile.pk, 999999], 'emails': ['user2@EXAMPLE.com', 'missing@example.com'],
+            }, format='json')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['ids'][str(profile.pk)], self.client.get(f'/api/profiles/{profile.pk}/').data)
+        self.assertIsNone(response.data['ids']['999999'])
+        self.assertEqual(response.data['emails']['user2@EXAMPLE.com']['user']['email'], 'user2@example.com')
+        self.assertIsNone(response.data['emails']['missing@example.com'])
+
+    def test_sparse_fields(self):
+        response = self.client.post('/api/profiles/batch/?fields=phone_number', {'ids': [self.users[0].profile.pk]}, format='json')
+        self.assertEqual(list(response.data['ids'][str(self.users[0].profile.pk)]), ['phone_number'])
+
+    @override_settings(PROFILES_BATCH={'MAX_SIZE': 2})
+    def test_limit(self):
+        self.assertEqual(self.client.post('/api/profiles/batch/', {'ids': [1, 2, 3]}, format='json').status_code, 400)
+        self.assertEqual(self.client.post('/api/profiles/batch/', {'ids': [1, 1, 1]}, format='json').status_code, 200)
+        self.assertEqual(self.client.post('/api/profiles/batch/', {}, format='json').status_code, 400)
+
+
+class TokenIntrospectionTests(TestCase):
+    def setUp(self):
+        token_cache.clear()
+        cache.clear()
+        self.gateway = CustomUser.objects.create_user(email='gateway@example.com', password='Secret-pass1', is_staff=True)
+        self.owner = CustomUser.objects.create_user(email='owner@example.com', password='Secret-pass1', is_property_owner=True)
+        self.admin = CustomUser.objects.create_user(email='admin@example.com', password='Secret-pass1', is_admin=True)
+        self.client = APIClient()
+        self.client.credentials(HTTP_AUTHORIZATION=f'Token {Token.objects.create(user=self.gateway).key}')
+
+    def test_single_token(self):
+        token = Token.objects.create(user=self.owner)
+        response = self.client.post('/api/token/introspect/', {'token': token.key}, format='json')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data, {
+            'active': True, 'user_id': self.owner.pk, 'is_admin': False, 'is_property_owner': True, 'age': 0,
+        })
+        self.assertEqual(self.client.post('/api/token/introspect/', {'token': 'nope'}, format='json').data, {'active': False})
+
+    def test_batch_is_one_query_then_cached(self):
+        keys = [Token.objects.create(user=self.owner).key, 'missing', Token.objects.create(user=self.admin).key]
+        self.client.post('/api/token/introspect/', {'tokens': keys[:1]}, format='json')  # Caches the caller's token
+        token_cache.invalidate(keys[0])
+        with self.assertNumQueries(1):
+            response = self.client.post('/api/token/introspect/', {'tokens': keys}, format='json')
+        self.assertEqual([r['active'] for r in response.data['results']], [True, False, True])
+        self.assertTrue(response.data['results'][2]['is_admin'])
+        with self.assertNumQueries(1):  # Only the unknown key
+            self.client.post('/api/token/introspect/', {'tokens': keys}, format='json')
+
+    @override_settings(AUTH_SIGNED_TOKENS={'ENABLED': True})
+    def test_signed_token(self):
+        access = issue_token(self.admin)
+        self.client.post('/api/token/introspect/', {'token': access}, format='json')
+        with self.assertNumQueries(0):  # The caller's token and the roles are both cached
+            result = self.client.post('/api/token/introspect/', {'token': access}, format='json').data
+        self.assertEqual((result['active'], result['user_id'], result['is_admin']), (True, self.admin.pk, True))
+        result = self.client.post('/api/token/introspect/', {'token': issue_token(self.admin, REFRESH)}, format='json').data
+        self.assertFalse(result['active'])
+
+    @override_settings(AUTH_SIGNED_TOKENS={'ENABLED': True})
+    def test_signed_token_reflects_current_roles(self):
+        access = issue_token(self.admin)
+        self.admin.is_admin = False
+        self.admin.save()
+        result = self.client.post('/api/token/introspect/', {'token': access}, format='json').data
+        self.assertEqual((result['active'], result['is_admin']), (True, False))
+        self.admin.is_active = False
+        self.admin.save()
+        self.assertEqual(self.client.post('/api/token/introspect/', {'token': access}, format='json').data, {'active': False})
+
+    @override_settings(AUTH_SIGNED_TOKENS={'ENABLED': True})
+    def test_signed_token_caller_needs_current_staff_flag(self):
+        self.client.credentials(HTTP_AUTHORIZATION=f'Bearer {issue_token(self.gateway)}')
+        data = {'token': issue_token(self.owner)}
+        self.assertEqual(self.client.post('/api/token/introspect/', data, format='json').status_code, 200)
+        with self.assertNumQueries(0):  # The caller's staff flag comes from the permission cache
+            self.client.post('/api/token/introspect/', data, format='json')
+        self.gateway.is_staff = False
+        self.gateway.save()
+        self.assertEqual(self.client.post('/api/token/introspect/', data, format='json').status_code, 403)
+
+    def test_requires_staff(self):
+        self.client.credentials(HTTP_AUTHORIZATION=f'Token {Token.objects.create(user=self.owner).key}')
+        self.assertEqual(self.client.post('/api/token/introspect/', {'token': 'x'}, format='json').status_code, 403)
+
+
+class PermissionCacheTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = CustomUser.objects.create_user(email='john@example.com', password='Secret-pass1')
+        self.group = Group.objects.create(name='editors')
+        self.change = Permission.objects.get(codename='change_userprofile')
+        self.delete = Permission.objects.get(codename='delete_userprofile')
+
+    def fresh_user(self):
+        return CustomUser.objects.get(pk=self.user.pk)
+
+    def test_checks_are_free_once_cached(self):
+        self.user.user_permissions.add(self.delete)
+        self.group.permissions.add(self.change)
+        self.user.groups.add(self.group)
+        self.assertTrue(self.fresh_user().has_perm('authentication.change_userprofile'))
+        user = self.fresh_user()
+        with self.assertNumQueries(0):
+            self.assertTrue(user.has_perm('authentication.delete_userprofile'))
+            self.assertFalse(user.has_perm('authentication.add_userprofile'))
+            self.assertEqual(user.get_group_permissions(), {'authentication.change_userprofile'})
+            self.assertEqual(user.get_all_permissions(),
+                             {'authentication.change_userprofile', 'authentication.delete_userprofile'})
+
+    def test_m2m_changes_rebuild(self):
+        self.user.groups.add(self.group)
+        self.assertFalse(self.fresh_user().has_perm('authentication.change_userprofile'))
+        self.group.permissions.add(self.change)
+        self.assertTrue(self.fresh_user().has_perm('authentication.change_userprofile'))
+        self.change.group_set.clear()
+        self.assertFalse(self.fresh_user().has_perm('authentication.change_userprofile'))
+        self.group.permissions.add(self.change)
+        self.group.user_set.remove(self.user)
+        self.assertFalse(self.fresh_user().has_perm('authentication.change_userprofile'))
+
+    def test_roles_use_current_flags(self):
+        admin = CustomUser.objects.create_user(email='admin@example.com', password='Secret-pass1', is_admin=True)
+        user = user_from_payload(verify_token(issue_token(admin)))
+        self.assertEqual(permission_cache.roles(user), {'is_active', 'is_admin'})
+        with self.assertNumQueries(0):
+            permission_cache.roles(user)
+        admin.is_admin = False
+        admin.save()
+        # The signed token still claims is_admin, the cached flags do not
+        self.assertEqual(permission_cache.roles(user), {'is_active'})
+
+    def test_role_permissions_use_current_flags(self):
+        admin = CustomUser.objects.create_user(email='admin@example.com', password='Secret-pass1', is_admin=True)
+        request = mock.Mock(user=user_from_payload(verify_token(issue_token(admin))))
+        self.assertTrue(IsAdminRole().has_permission(request, None))
+        self.assertFalse(IsPropertyOwnerRole().has_permission(request, None))
+        with self.assertNumQueries(0):
+            IsAdminRole().has_permission(request, None)
+        admin.is_active = False
+        admin.save()
+        self.assertFalse(IsAdminRole().has_permission(request, None))
+
+    def test_expired_version_does_not_revive_entries(self):
+        self.assertFalse(self.fresh_user().has_perm('authentication.delete_userprofile'))
+        permission_cache.invalidate([self.user.pk])
+        self.fresh_user().has_perm('authentication.delete_userprofile')  # Stored under the current version
+        cache.delete(f'user-perms:{self.user.pk}:version')  # The version key expires first
+        self.user.user_permissions.add(self.delete)
+        self.assertTrue(self.fresh_user().has_perm('authentication.delete_userprofile'))
+
+    def test_entry_built_before_a_change_is_not_served(self):
+        build = permission_cache.build
+
+        def racing_build(user):
+            entry = build(user)
+            # Another request grants the permission after this one has read the tables
+            self.user.user_permissions.add(self.delete)
+            return entry
+
+        with mock.patch.object(permission_cache, 'build', side_effect=racing_build):
+            self.assertFalse(self.fresh_user().has_perm('authentication.delete_userprofile'))
+        self.assertTrue(self.fresh_user().has_perm('authentication.delete_userprofile'))
+
+
+class TokenExpiryTests(TestCase):
+    def setUp(self):
+        token_cache.clear()
+        token_activity.clear()
+        self.user = CustomUser.objects.create_user(email='john@example.com', password='Secret-pass1')
+        self.token = Token.objects.create(user=self.user)
+        self.client = APIClient()
+        self.client.credentials(HTTP_AUTHORIZATION=f'Token {self.token.key}')
+        self.url = f'/api/profiles/{self.user.profile.pk}/'
+
+    def age(self, token, seconds):
+        Token.objects.filter(pk=token.pk).update(created=timezone.now() - timedelta(seconds=seconds))
+        token_cache.invalidate(token.key)
+
+    @override_settings(AUTH_TOKEN_EXPIRY={'ABSOLUTE_TTL': 3600, 'IDLE_TTL': None})
+    def test_absolute_ttl(self):
+        self.assertEqual(self.client.get(self.url).status_code, 200)
+        self.age(self.token, 3601)
+        response = self.client.get(self.url)
+        self.assertEqual(response.status_code, 401)
+        self.assertEqual(str(response.data['detail']), 'Token has expired.')
+        self.assertFalse(Token.objects.filter(pk=self.token.pk).exists())
+        with self.assertNumQueries(1):  # A replay is only the key lookup
+            self.assertEqual(self.client.get(self.url).status_code, 401)
+
+    @override_settings(AUTH_TOKEN_EXPIRY={'IDLE_TTL': 3600, 'ACTIVITY_RESOLUTION': 60})
+    def test_activity_writes_are_coalesced(self):
+        self.age(self.token, 120)
+        self.client.get(self.url)
+        self.client.get(self.url)
+        self.assertEqual(TokenActivity.objects.count(), 1)
+        last_used = TokenActivity.objects.get().last_used
+        self.client.get(self.url)
+        self.assertEqual(TokenActivity.objects.get().last_used, last_used)
+
+    @override_settings(AUTH_TOKEN_EXPIRY={'IDLE_TTL': 3600})
+    def test_idle_ttl_checks_other_workers_activity(self):
+        self.age(self.token, 7200)
+        token_cache.set(Token.objects.select_related('user').get(pk=self.token.pk))  # Cached without activity
+        # Another worker recorded a recent use: the token is still valid
+        activity = TokenActivity.objects.create(token=self.token, last_used=timezone.now())
+        self.assertEqual(self.client.get(self.url).status_code, 200)
+        token_activity.clear()
+        activity.delete()
+        token_cache.invalidate(self.token.key)
+        self.assertEqual(self.client.get(self.url).status_code, 401)
+
+    @override_settings(AUTH_TOKEN_EXPIRY={'ABSOLUTE_TTL': 3600, 'IDLE_TTL': 600})
+    def test_sweeper_deletes_in_batches(self):
+        users = [CustomUser.objects.create_user(email=f'user{i}@example.com', password='x') for i in range(5)]
+        old = [Token.objects.create(user=user) for user in users[:3]]
+        for token in old:
+            self.age(token, 4000)
+        idle = Token.objects.create(user=users[3])
+        self.age(idle, 1200)
+        TokenActivity.objects.create(token=idle, last_used=timezone.now() - timedelta(seconds=900))
+        fresh = Token.objects.create(user=users[4])
+        out = io.StringIO()
+        call_command('sweep_tokens', dry_run=True, stdout=out)
+        self.assertIn('4 expired tokens', out.getvalue())  # Old tokens are idle too but counted once
+        TokenActivity.objects.create(token=old[0], last_used=timezone.now() - timedelta(seconds=900))
+        out = io.StringIO()
+        call_command('sweep_tokens', dry_run=True, stdout=out)
+        self.assertIn('4 expired tokens', out.getvalue())
+        out = io.StringIO()
+        call_command('sweep_tokens', batch_size=2, pause=0, stdout=out)
+        self.assertIn('Deleted 4 expired tokens in 3 batches', out.getvalue())
+        self.assertEqual(set(Token.objects.values_list('key', flat=True)), {self.token.key, fresh.key})
+
+
+class UserActivityBufferTests(TestCase):
+    def setUp(self):
+        user_activity.clear()
+        self.user = CustomUser.objects.create_user(email='john@example.com', password='Secret-pass1')
+        self.other = CustomUser.objects.create_user(email='jane@example.com', password='Secret-pass1')
+
+    def tearDown(self):
+        user_activity.clear()
+
+    def test_logins_and_requests_are_written_in_one_update(self):
+        for email in ('john@example.com', 'jane@example.com'):
+            response = self.client.post('/api/login/', {'email': email, 'password': 'Secret-pass1'})
+        self.client.get('/api/profiles/', HTTP_AUTHORIZATION=f"Token {response.data['token']}")
+        self.assertIsNone(CustomUser.objects.get(pk=self.user.pk).last_login)
+        with CaptureQueriesContext(connection) as queries:
+            self.assertEqual(user_activity.flush(), 2)
+        self.assertEqual(len(queries), 1)
+        self.assertTrue(queries[0]['sql'].startswith('UPDATE'))
+        john, jane = CustomUser.objects.get(pk=self.user.pk), CustomUser.objects.get(pk=self.other.pk)
+        self.assertIsNotNone(john.last_login)
+        self.assertIsNone(john.last_seen)
+        self.assertIsNotNone(jane.last_login)
+        self.assertGreaterEqual(jane.last_seen, jane.last_login)
+
+    @override_settings(USER_ACTIVITY={'MAX_PENDING': 2})
+    def test_full_buffer_wakes_the_flusher(self):
+        with mock.patch.object(user_activity, '_flusher_pid', os.getpid()), \
+                mock.patch.object(user_activity, 'flush') as flush:
+            for user in (self.user, self.other):
+                self.client.post('/api/login/', {'email': user.email, 'password': 'Secret-pass1'})
+        flush.assert_not_called()  # Not on the request thread
+        self.assertTrue(user_activity._wake.is_set())
+        user_activity._wake.clear()
+
+    @override_settings(USER_ACTIVITY={'MAX_PENDING': 2})
+    def test_full_buffer_is_written_without_a_flusher(self):
+        for user in (self.user, self.other):
+            self.client.post('/api/login/', {'email': user.email, 'password': 'Secret-pass1'})
+        self.assertEqual(user_activity.pending(), 0)
+        self.assertIsNotNone(CustomUser.objects.get(pk=self.user.pk).last_login)
+
+    @override_settings(USER_ACTIVITY={'MODE': 'sync'})
+    def test_sync_mode(self):
+        self.client.post('/api/login/', {'email': 'john@example.com', 'password': 'Secret-pass1'})
+        self.assertIsNotNone(CustomUser.objects.get(pk=self.user.pk).last_login)
+        self.assertEqual(user_activity.pending(), 0)
+
+
+class WarmUpTests(TestCase):
+    def test_warm_up_does_not_touch_the_database(self):
+        with self.assertNumQueries(0):
+            timings = warm_up(freeze=False)
+        self.assertEqual(list(timings), ['phonenumbers', 'hashers', 'urls', 'serializers', 'pillow'])
@@ -0,0 +1,139 @@
+import threading
+import time
+from collections.abc import Mapping
+
+from django.core.cache import caches
+from rest_framework.throttling import BaseThrottle
+
+from .cache import LRUCache
+from .conf import get_settings
+
+LOGIN_THROTTLE_DEFAULTS = {
+    'ENABLED': True,
+    'IP_RATE': '30/min',
+    'EMAIL_RATE': '10/min',
+    'STORE': 'cache',  # 'cache' — общий кэш Django для всех воркеров, 'local' — в памяти процесса (один воркер)
+    'CACHE_ALIAS': 'default',
+    'MAX_KEYS': 100000,
+}
+
+PERIODS = {'s': 1, 'm': 60, 'h': 3600, 'd': 86400}
+
+
+def parse_rate(rate):
+    """``'10/min'`` -> ``(capacity, tokens per second)``."""
+    num, period = rate.split('/')
+    capacity = int(num)
+    return capacity, capacity / PERIODS[period[0]]
+
+
+class LocalBuckets:
+    """Token buckets in an LRU of ``(tokens, updated)`` pairs: constant memory per key, bounded key count."""
+
+    clock = staticmethod(time.monotonic)
+
+    def __init__(self, maxsize):
+        self._buckets = LRUCache(maxsize)
+        self._lock = threading.Lock()
+
+    def take(self, key, capacity, rate):
+        with self._lock:
+            now = self.clock()
+            tokens, updated = self._buckets.get(key, (capacity, now))
+            tokens, wait = _take(tokens, now - updated, capacity, rate)
+            # Полностью восстановленное ведро равно отсутствующему: ключ можно вытеснить по таймауту
+            self._buckets.set(key, (tokens, now), timeout=(capacity - tokens) / rate)
+        return wait
+
+    def clear(self):
+        self._buckets.clear()
+
+
+class CacheBuckets:
+    """The same buckets in a shared Django cache; read-modify-write is not atomic across workers."""
+
+    clock = staticmethod(time.time)
+
+    def __init__(self, alias, maxsize):
+        self.cache = caches[alias]
+        self._written = LRUCache(maxsize)  # Ключи, записанные этим процессом: их удаляет clear()
+
+    def take(self, key, capacity, rate):
+        now = self.clock()
+        key = f'login-throttle:{key}'
+        tokens, updated = self.cache.get(key, (capacity, now))
+        tokens, wait = _take(tokens, max(now - updated, 0), capacity, rate)
+        self.cache.set(key, (tokens, now), timeout=max(1, int((capacity - tokens) / rate) + 1))
+        self._written.set(key, True)
+        return wait
+
+    def clear(self):
+        # Общий кэш не чистится целиком: удаляются ключи этого процесса, остальные истекают сами
+        self.cache.delete_many(self._written.keys())
+        self._written.clear()
+
+
+def _take(tokens, elapsed, capacity, rate):
+    tokens = min(capacity, tokens + elapsed * rate)
+    if tokens >= 1:
+        return tokens - 1, 0.0
+    return tokens, (1 - tokens) / rate
+
+
+class LoginThrottle:
+    """Per-IP and per-email token buckets checked before any password is hashed."""
+
+    def __init__(self):
+        self._buckets = {}
+        self._lock = threading.Lock()
+
+    @property
+    def conf(self):
+        return get_settings('LOGIN_THROTTLE', LOGIN_THROTTLE_DEFAULTS)
+
+    def buckets(self):
+        conf = self.conf
+        key = (conf['STORE'], conf['CACHE_ALIAS'], conf['MAX_KEYS'])
+        if key not in self._buckets:
+            with self._lock:
+                if key not in self._buckets:
+                    if conf['STORE'] == 'cache':
+                        self._buckets[key] = CacheBuckets(conf['CACHE_ALIAS'], conf['MAX_KEYS'])
+                    else:
+                        self._buckets[key] = LocalBuckets(conf['MAX_KEYS'])
+        return self._buckets[key]
+
+    def check(self, ip, email=None):
+        """Take a token for ``ip`` and ``email``; return seconds to wait, or 0 if allowed."""
+        conf = self.conf
+        if not conf['ENABLED']:
+            return 0.0
+        buckets = self.buckets()
+        wait = buckets.take(f'ip:{ip}', *parse_rate(conf['IP_RATE']))
+        if not wait and email:
+            wait = buckets.take(f'email:{email.strip().lower()}', *parse_rate(conf['EMAIL_RATE']))
+        return wait
+
+    def reset(self):
+        for buckets in self._buckets.values():
+            buckets.clear()
+
+
+login_throttle = LoginThrottle()
+
+
+class LoginRateThrottle(BaseThrottle):
+    """
+    Rejects login attempts over the per-IP or per-email rate. DRF runs throttles in
+    ``initial()``, before the view validates credentials, so rejected attempts never
+    reach the password hasher.
+    """
+
+    def allow_request(self, request, view):
+        data = request.data
+        email = data.get(getattr(view, 'login_field', 'email')) if isinstance(data, Mapping) else None
+        self.wait_time = login_throttle.check(self.get_ident(request), email if isinstance(email, str) else None)
+        return not self.wait_time
+
+    def wait(self):
+        return self.wait_time
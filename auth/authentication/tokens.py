@@ -0,0 +1,167 @@
+import uuid
+
+from django.core import signing
+from django.core.cache import caches
+from django.utils.translation import gettext_lazy as _
+from rest_framework import exceptions
+from rest_framework.authentication import BaseAuthentication, get_authorization_header
+
+from .activity import record_seen
+from .conf import get_settings
+from .models import CustomUser
+
+SIGNED_TOKEN_DEFAULTS = {
+    'ENABLED': False,
+    'KEYWORD': 'Bearer',
+    'SALT': 'authentication.tokens',
+    'ACCESS_TTL': 15 * 60,
+    'REFRESH_TTL': 7 * 24 * 60 * 60,
+    'CACHE_ALIAS': 'default',
+}
+
+ACCESS = 'access'
+REFRESH = 'refresh'
+
+
+def get_signed_token_settings():
+    return get_settings('AUTH_SIGNED_TOKENS', SIGNED_TOKEN_DEFAULTS)
+
+
+def _ttl(conf, token_type):
+    return conf['ACCESS_TTL'] if token_type == ACCESS else conf['REFRESH_TTL']
+
+
+class RevocationList:
+    """
+    Revoked token ids and token families kept in the shared cache. Each entry expires
+    together with the tokens it revokes, so the set only ever holds tokens that could
+    still be presented.
+
+    A family is every access and refresh token descended from one login: refreshing
+    keeps it, so logging out revokes the refresh token along with the access token.
+    """
+
+    def _key(self, jti):
+        return f'revoked-token:{jti}'
+
+    def _family_key(self, family):
+        return f'revoked-token-family:{family}'
+
+    def _cache(self, conf):
+        return caches[conf['CACHE_ALIAS']]
+
+    def revoke(self, payload):
+        conf = get_signed_token_settings()
+        self._cache(conf).set(self._key(payload['jti']), True, timeout=_ttl(conf, payload['typ']))
+
+    def claim(self, payload):
+        """
+        Revoke a single-use token and return whether this call did it. ``cache.add`` is
+        atomic, so of two concurrent claims of the same token only one succeeds.
+        """
+        conf = get_signed_token_settings()
+        return self._cache(conf).add(self._key(payload['jti']), True, timeout=_ttl(conf, payload['typ']))
+
+    def revoke_family(self, payload):
+        conf = get_signed_token_settings()
+        if 'fam' in payload:
+            # Токены семейства выдаются не дольше чем на REFRESH_TTL вперёд
+            self._cache(conf).set(self._family_key(payload['fam']), True, timeout=conf['REFRESH_TTL'])
+        else:
+            self.revoke(payload)
+
+    def is_revoked(self, payload):
+        conf = get_signed_token_settings()
+        keys = [self._key(payload['jti'])]
+        if 'fam' in payload:
+            keys.append(self._family_key(payload['fam']))
+        return bool(self._cache(conf).get_many(keys))
+
+
+revocation_list = RevocationList()
+
+
+def issue_token(user, token_type=ACCESS, family=None):
+    payload = {
+        'typ': token_type,
+        'jti': uuid.uuid4().hex,
+        'fam': family or uuid.uuid4().hex,
+        'uid': user.pk,
+        'adm': user.is_admin,
+        'own': user.is_property_owner,
+    }
+    return signing.dumps(payload, salt=get_signed_token_settings()['SALT'])
+
+
+def issue_token_pair(user, family=None):
+    """Access and refresh tokens of one family: a new one at login, the refreshed token's on refresh."""
+    family = family or uuid.uuid4().hex
+    return {'access': issue_token(user, ACCESS, family), 'refresh': issue_token(user, REFRESH, family)}
+
+
+def verify_token(token, token_type=ACCESS):
+    """
+    Check the signature, age, type and revocation status of a signed token and return
+    its payload. Never touches the database.
+    """
+    conf = get_signed_token_settings()
+    try:
+        payload = signing.loads(token, salt=conf['SALT'], max_age=_ttl(conf, token_type))
+    except signing.SignatureExpired:
+        raise exceptions.AuthenticationFailed(_('Token has expired.'))
+    except signing.BadSignature:
+        raise exceptions.AuthenticationFailed(_('Invalid token.'))
+
+    if payload.get('typ') != token_type:
+        raise exceptions.AuthenticationFailed(_('Invalid token.'))
+    if revocation_list.is_revoked(payload):
+        raise exceptions.AuthenticationFailed(_('Token has been revoked.'))
+    return payload
+
+
+def signed_token_issued_at(token):
+    """Issue time (Unix seconds) of a token that already passed ``verify_token``."""
+    # signing.dumps: <payload>:<timestamp base62>:<signature>
+    return signing.b62_decode(token.rsplit(':', 2)[-2])
+
+
+def is_signed_token(token):
+    return ':' in token  # Ключи authtoken — 40 hex-символов без разделителей
+
+
+def user_from_payload(payload):
+    # Пользователь собирается из подписанных данных, без запроса к БД
+    return CustomUser(pk=payload['uid'], is_admin=payload['adm'], is_property_owner=payload['own'])
+
+
+class SignedTokenAuthentication(BaseAuthentication):
+    """
+    Stateless authentication with HMAC-signed, expiring access tokens:
+
+        Authorization: Bearer <access token>
+
+    ``request.auth`` is the verified token payload.
+    """
+
+    def authenticate(self, request):
+        conf = get_signed_token_settings()
+        if not conf['ENABLED']:
+            return None
+
+        auth = get_authorization_header(request).split()
+        if not auth or auth[0].lower() != conf['KEYWORD'].lower().encode():
+            return None
+        if len(auth) != 2:
+            raise exceptions.AuthenticationFailed(_('Invalid token header.'))
+
+        try:
+            token = auth[1].decode()
+        except UnicodeError:
+            raise exceptions.AuthenticationFailed(_('Invalid token header.'))
+
+        payload = verify_token(token, ACCESS)
+        record_seen(payload['uid'])
+        return (user_from_payload(payload), payload)
+
+    def authenticate_header(self, request):
+        return get_signed_token_settings()['KEYWORD']
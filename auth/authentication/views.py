@@ -1,28 +1,258 @@
 
 from rest_framework import viewsets, filters
-from rest_framework.authentication import TokenAuthentication
-from rest_framework.permissions import IsAuthenticated, AllowAny
+from rest_framework.decorators import action
+from rest_framework.permissions import IsAuthenticated, AllowAny, SAFE_METHODS
 from django_filters.rest_framework import DjangoFilterBackend
 from rest_framework import status
 from rest_framework.response import Response
 from rest_framework.authtoken.models import Token
+from rest_framework.authtoken.views import ObtainAuthToken
 from rest_framework.views import APIView
-from drf_yasg.utils import swagger_auto_schema
-from drf_yasg import openapi
-from django.contrib.auth import authenticate, logout, login
-from .models import UserProfile
-from .serializers import UserProfileSerializer, UserRegistrationSerializer, UserLoginSerializer, UserSerializer
+from rest_framework.exceptions import AuthenticationFailed, NotFound
+from django.contrib.auth import logout, login
+from django.conf import settings
+from django.core.exceptions import ValidationError as DjangoValidationError
+from django.db import IntegrityError, transaction
+from django.db.models import Q
+from django.utils import timezone
+from django.utils.cache import get_conditional_response
+from django.utils.http import parse_http_date_safe
+from django.utils.translation import gettext_lazy as _
+from .authentication import CachedTokenAuthentication, get_tokens
+from .conditional import Validators, profiles_changed_at
+from .db import replica_may_lag, reset_read_alias, use_replica_for
+from .expiry import token_activity
+from .models import CustomUser, UserProfile
+from .pagination import KeysetPagination
+from .permissions import IsAdminRole, IsStaffRole, permission_cache
+from .response_cache import response_cache
+from .search import ProfileSearchFilter
+from .serializers import UserProfileSerializer, UserRegistrationSerializer, UserLoginSerializer, UserSerializer, \
+    TokenRefreshSerializer, TokenIntrospectionSerializer, ProfileBatchSerializer, ProfileRowSerializer, get_profile_fields
+from .swagger import schema_response, swagger_auto_schema
+from .throttling import LoginRateThrottle
+from .tokens import ACCESS, SignedTokenAuthentication, get_signed_token_settings, is_signed_token, issue_token_pair, \
+    revocation_list, signed_token_issued_at, user_from_payload, verify_token
+
+
+def rotate_token(user):
+    with transaction.atomic():
+        Token.objects.filter(user=user).delete()  # Удаляем старый токен
+        return Token.objects.create(user=user)  # Создаем новый токен
+
+
+def auth_response_data(user, token):
+    data = {'token': token.key}
+    if get_signed_token_settings()['ENABLED']:
+        data.update(issue_token_pair(user))  # Подписанные access/refresh токены
+    data['user'] = UserProfileSerializer(user.profile).data
+    return data
+
+
+def introspect_signed_token(token, now):
+    if not get_signed_token_settings()['ENABLED']:
+        return {'active': False}
+    try:
+        payload = verify_token(token, ACCESS)
+    except AuthenticationFailed:
+        return {'active': False}
+    # Роли в токене могли устареть за ACCESS_TTL: текущие флаги берутся из кэша прав
+    roles = permission_cache.roles(user_from_payload(payload))
+    if 'is_active' not in roles:
+        return {'active': False}
+    return {
+        'active': True,
+        'user_id': payload['uid'],
+        'is_admin': 'is_admin' in roles,
+        'is_property_owner': 'is_property_owner' in roles,
+        'age': int(now.timestamp()) - signed_token_issued_at(token),
+    }
+
+
+def introspect_tokens(keys):
+    """Introspection results for ``keys``, in order; DRF tokens come from ``token_cache``."""
+    now = timezone.now()
+    tokens = get_tokens([key for key in keys if not is_signed_token(key)])
+    results = []
+    for key in keys:
+        if is_signed_token(key):
+            results.append(introspect_signed_token(key, now))
+            continue
+        token = tokens.get(key)
+        if token is None or not token.user.is_active or token_activity.is_expired(token, now):
+            results.append({'active': False})
+            continue
+        results.append({
+            'active': True,
+            'user_id': token.user_id,
+            'is_admin': token.user.is_admin,
+            'is_property_owner': token.user.is_property_owner,
+            'age': int((now - token.created).total_seconds()),
+        })
+    return results
 
 
 class UserProfileViewSet(viewsets.ModelViewSet):
     queryset = UserProfile.objects.select_related('user').all()
     serializer_class = UserProfileSerializer
-    authentication_classes = [TokenAuthentication]
+    authentication_classes = [CachedTokenAuthentication, SignedTokenAuthentication]
     permission_classes = [IsAuthenticated]
-    filter_backends = [DjangoFilterBackend, filters.SearchFilter, filters.OrderingFilter]
+    pagination_class = KeysetPagination
+    filter_backends = [DjangoFilterBackend, ProfileSearchFilter, filters.OrderingFilter]
     filterset_fields = ['user__email', 'phone_number']  # Поля модели UserProfile, по которым можно фильтровать
     search_fields = ['user__email', 'phone_number']  # Поля модели UserProfile, по которым можно осуществлять поиск
     ordering_fields = ['created_at', 'modified_at']  # Поля модели UserProfile, по которым можно осуществлять сортировку
+    ordering = ['-created_at']
+
+    @property
+    def fast_read(self):
+        return getattr(settings, 'PROFILES_FAST_READ', True)
+
+    def get_profile_fields(self):
+        if not hasattr(self, '_profile_fields'):
+            if getattr(self, 'swagger_fake_view', False):
+                self._profile_fields = UserProfileSerializer.Meta.fields  # Генерация схемы без запроса
+            elif self.request.method == 'GET' or self.action == 'batch':
+                self._profile_fields = get_profile_fields(self.request.query_params)
+            else:
+                self._profile_fields = UserProfileSerializer.Meta.fields
+        return self._profile_fields
+
+    def get_queryset(self):
+        queryset = super().get_queryset()
+        fields = self.get_profile_fields()
+        if self.action not in ('list', 'retrieve') or fields == UserProfileSerializer.Meta.fields:
+            return queryset
+        # Загружаются только колонки запрошенных полей
+        only = ['id', 'created_at', 'modified_at'] + [name for name in fields if name != 'user']
+        if 'user' in fields:
+            only += ['user__' + name for name in UserSerializer.Meta.fields]
+        else:
+            queryset = queryset.select_related(None)
+        return queryset.only(*only)
+
+    def get_serializer(self, *args, **kwargs):
+        if self.request is not None and self.request.method == 'GET':
+            kwargs.setdefault('fields', self.get_profile_fields())
+        return super().get_serializer(*args, **kwargs)
+
+    def get_row_serializer(self):
+        return ProfileRowSerializer(fields=self.get_profile_fields(), context=self.get_serializer_context())
+
+    def get_list_validators(self):
+        # Метка обновляется теми же сигналами, что сбрасывают кэш ответов: ни одного запроса к таблице
+        return Validators(self.request, profiles_changed_at())
+
+    def cached_response(self, key):
+        """The stored response for ``key`` (or a 304 for it), or ``None`` after remembering the key."""
+        response = response_cache.get(key)
+        if response is None:
+            self._response_cache_key = key
+            return None
+        not_modified = get_conditional_response(
+            self.request,
+            etag=response.headers.get('ETag'),
+            last_modified=parse_http_date_safe(response.headers.get('Last-Modified', '')),
+        )
+        if not_modified is not None:
+            for header in ('ETag', 'Last-Modified'):
+                if header in response.headers:
+                    not_modified.headers[header] = response.headers[header]
+            return not_modified
+        return response
+
+    def cache_lookup_pk(self):
+        # Нормализация ('01' -> 1): версия в ключе должна совпадать с той, что сбрасывают сигналы
+        try:
+            return UserProfile._meta.pk.to_python(self.kwargs[self.lookup_url_kwarg or self.lookup_field])
+        except DjangoValidationError:
+            return None
+
+    def initial(self, request, *args, **kwargs):
+        super().initial(request, *args, **kwargs)
+        # Чтения после аутентификации идут на реплику, если пользователь недавно ничего не записывал
+        if request.method in SAFE_METHODS:
+            self._replica_token = use_replica_for(request.user)
+
+    def finalize_response(self, request, response, *args, **kwargs):
+        response = super().finalize_response(request, response, *args, **kwargs)
+        replica_token = getattr(self, '_replica_token', None)
+        key = getattr(self, '_response_cache_key', None)
+        # Отстающая реплика могла вернуть старые данные: такой ответ не кэшируется под новой версией
+        if key and response.status_code == status.HTTP_200_OK and not (replica_token and replica_may_lag()):
+            response.render()
+            response_cache.set(key, response)
+        if replica_token is not None:
+            reset_read_alias(replica_token)
+        return response
+
+    def list(self, request, *args, **kwargs):
+        if response_cache.enabled:
+            response = self.cached_response(response_cache.list_key(request))
+            if response is not None:
+                return response
+        # Условный GET: ETag/Last-Modified известны до запроса страницы
+        validators = self.get_list_validators()
+        response = validators.not_modified(request)
+        if response is None:
+            response = self.list_response(self.filter_queryset(self.get_queryset()))
+            validators.set_headers(response)
+        return response
+
+    def list_response(self, queryset):
+        if self.fast_read:
+            rows = self.get_row_serializer()
+            queryset, serialize = queryset.values(*rows.lookups), rows.many
+        else:
+            serialize = lambda objects: self.get_serializer(objects, many=True).data
+        page = self.paginate_queryset(queryset)
+        if page is not None:
+            return self.get_paginated_response(serialize(page))
+        return Response(serialize(queryset))
+
+    def retrieve(self, request, *args, **kwargs):
+        pk = self.cache_lookup_pk()
+        if response_cache.enabled and pk is not None:
+            response = self.cached_response(response_cache.detail_key(request, pk))
+            if response is not None:
+                return response
+        instance = self.get_object()
+        validators = Validators(request, instance.modified_at)
+        response = validators.not_modified(request)
+        if response is None:
+            if self.fast_read:
+                response = Response(self.get_row_serializer().to_representation(instance))
+            else:
+                response = Response(self.get_serializer(instance).data)
+            validators.set_headers(response)
+        return response
+
+    @swagger_auto_schema(
+        request_body=ProfileBatchSerializer,
+        responses={200: schema_response("Profiles keyed by requested id and email, null if not found")},
+    )
+    @action(detail=False, methods=['post'])
+    def batch(self, request):
+        """Profiles for up to ``PROFILES_BATCH['MAX_SIZE']`` ids and emails in one query."""
+        serializer = ProfileBatchSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        ids, emails = serializer.validated_data['ids'], serializer.validated_data['emails']
+        # Email сравнивается в том виде, в каком его сохраняет create_user (домен в нижнем регистре)
+        normalized = {email: CustomUser.objects.normalize_email(email) for email in emails}
+        rows = self.get_row_serializer()
+        queryset = self.get_queryset().filter(Q(pk__in=ids) | Q(user__email__in=set(normalized.values())))
+        by_id, by_email = {}, {}
+        for row in queryset.values(*dict.fromkeys(rows.lookups + ('user__email',))):
+            by_id[row['id']] = by_email[row['user__email']] = rows.to_representation(row)
+        return Response({
+            'ids': {str(pk): by_id.get(pk) for pk in ids},
+            'emails': {email: by_email.get(normalized[email]) for email in emails},
+        })
+
+    @action(detail=False, methods=['get'], url_path='cache-stats', permission_classes=[IsStaffRole | IsAdminRole])
+    def cache_stats(self, request):
+        """Hit/miss counters of the profile response cache in this process."""
+        return Response(response_cache.stats())
 
 
 class UserRegistrationView(APIView):
@@ -31,53 +261,112 @@ class UserRegistrationView(APIView):
     @swagger_auto_schema(
         request_body=UserRegistrationSerializer,
         responses={
-            200: openapi.Response(description="Registration Successful"),
-            400: openapi.Response(description="Invalid Credentials"),
+            200: schema_response("Registration Successful"),
+            400: schema_response("Invalid Credentials"),
         }
     )
 
     def post(self, request):
         serializer = UserRegistrationSerializer(data=request.data)
         if serializer.is_valid():
-            user = serializer.save()
-            token, created = Token.objects.get_or_create(user=user)
-            return Response({
-                'token': token.key,
-                'user': UserProfileSerializer(user.profile).data
-            }, status=status.HTTP_201_CREATED)
+            try:
+                with transaction.atomic():
+                    user = serializer.save()
+                    token = Token.objects.create(user=user)
+            except IntegrityError:
+                # Параллельная регистрация с тем же email или телефоном прошла проверку раньше
+                return Response(
+                    {'non_field_errors': ['Email or phone number is already in use.']},
+                    status=status.HTTP_400_BAD_REQUEST,
+                )
+            return Response(auth_response_data(user, token), status=status.HTTP_201_CREATED)
         return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
 
 
 class UserLoginView(APIView):
     permission_classes = (AllowAny,)
+    throttle_classes = (LoginRateThrottle,)
 
     @swagger_auto_schema(
         request_body=UserLoginSerializer,
         responses={
-            200: openapi.Response(description="Login Successful"),
-            400: openapi.Response(description="Invalid Credentials"),
+            200: schema_response("Login Successful"),
+            400: schema_response("Invalid Credentials"),
         }
     )
     def post(self, request):
-        serializer = UserLoginSerializer(data=request.data)
+        serializer = UserLoginSerializer(data=request.data, context={'request': request})
         if serializer.is_valid():
-            user = authenticate(**serializer.validated_data)
-            if user:
-                login(request, user)
-                Token.objects.filter(user=user).delete()  # Удаляем старый токен
-                token = Token.objects.create(user=user)  # Создаем новый токен
-                return Response({
-                    'token': token.key,
-                    'user': UserProfileSerializer(user.profile).data
-                }, status=status.HTTP_200_OK)
-            return Response({'message': 'Invalid credentials'}, status=status.HTTP_401_UNAUTHORIZED)
+            user = serializer.validated_data['user']
+            login(request, user)
+            token = rotate_token(user)
+            return Response(auth_response_data(user, token), status=status.HTTP_200_OK)
         return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
 
 
+class ThrottledObtainAuthToken(ObtainAuthToken):
+    throttle_classes = (LoginRateThrottle,)
+    login_field = 'username'  # Поле email в AuthTokenSerializer
+
+
 class UserLogoutView(APIView):
     def post(self, request, *args, **kwargs):
         if request.user.is_authenticated:
             Token.objects.filter(user=request.user).delete()  # Удаляем токен
+            if isinstance(request.auth, dict):
+                # Отзываем подписанный access-токен вместе с refresh-токенами его семейства
+                revocation_list.revoke_family(request.auth)
             logout(request)
             return Response({'message': 'Logged out successfully'}, status=status.HTTP_200_OK)
-        return Response({'message': 'You are not logged in'}, status=status.HTTP_403_FORBIDDEN)
\ No newline at end of file
+        return Response({'message': 'You are not logged in'}, status=status.HTTP_403_FORBIDDEN)
+
+
+class TokenIntrospectionView(APIView):
+    """
+    Lets a gateway check tokens before routing: ``{"token": ...}`` returns one result,
+    ``{"tokens": [...]}`` a list in the same order. Unknown, deleted or expired tokens
+    are only ``{"active": false}``.
+    """
+    authentication_classes = [CachedTokenAuthentication, SignedTokenAuthentication]
+    # is_staff из кэша прав: подписанный токен его не содержит
+    permission_classes = (IsStaffRole,)
+
+    @swagger_auto_schema(
+        request_body=TokenIntrospectionSerializer,
+        responses={200: schema_response("active, user_id, is_admin, is_property_owner, age (seconds)")},
+    )
+    def post(self, request):
+        serializer = TokenIntrospectionSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        token = serializer.validated_data.get('token')
+        if token is not None:
+            return Response(introspect_tokens([token])[0])
+        return Response({'results': introspect_tokens(serializer.validated_data['tokens'])})
+
+
+class TokenRefreshView(APIView):
+    authentication_classes = ()
+    permission_classes = (AllowAny,)
+
+    @swagger_auto_schema(
+        request_body=TokenRefreshSerializer,
+        responses={
+            200: schema_response("New access and refresh tokens"),
+            401: schema_response("Invalid, expired or revoked refresh token"),
+        }
+    )
+    def post(self, request):
+        if not get_signed_token_settings()['ENABLED']:
+            raise NotFound()
+        serializer = TokenRefreshSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        # Refresh-токен одноразовый: из параллельных обновлений одним токеном проходит только первое
+        payload = serializer.validated_data['payload']
+        if not revocation_list.claim(payload):
+            raise AuthenticationFailed(_('Token has been revoked.'))
+        tokens = issue_token_pair(serializer.validated_data['user'], payload.get('fam'))
+        return Response(tokens, status=status.HTTP_200_OK)
+
+    def get_authenticate_header(self, request):
+        # Без классов аутентификации DRF отвечал бы 403 на недействительный refresh-токен
+        return get_signed_token_settings()['KEYWORD']
@@ -0,0 +1,94 @@
+"""
+gunicorn settings for the auth service (``gunicorn -c gunicorn.conf.py``).
+
+The application is imported once in the master (``preload_app``), the modules the
+first requests would load lazily are warmed up (``authentication.startup.warm_up``),
+and only then are the workers forked: they start with everything loaded and share
+those pages copy-on-write. The log reports the import and warm-up times and each
+worker's first-request latency.
+
+One worker is started unless ``WEB_CONCURRENCY`` (or ``-w``) asks for more. Several
+workers need a shared cache (``REDIS_URL``): with the default process-local cache each
+worker keeps its own token, permission and throttle state, so the master logs the
+``authentication.E001`` errors at startup.
+"""
+import os
+import time
+
+_config_loaded = time.perf_counter()
+
+wsgi_app = 'auth.wsgi:application'
+bind = os.environ.get('GUNICORN_BIND', '0.0.0.0:8000')
+workers = int(os.environ.get('WEB_CONCURRENCY', 1))
+preload_app = os.environ.get('GUNICORN_PRELOAD', '1') == '1'
+
+
+def on_starting(server):
+    metrics_dir = os.environ.get('METRICS_MULTIPROCESS_DIR')
+    if metrics_dir:
+        # Файлы метрик прошлого запуска: счётчики начинаются заново вместе с сервером
+        os.makedirs(metrics_dir, exist_ok=True)
+        for filename in os.listdir(metrics_dir):
+            os.remove(os.path.join(metrics_dir, filename))
+    if preload_app:
+        # С preload_app приложение импортируется до этого хука
+        server.log.info('Application imported in %.0f ms', (time.perf_counter() - _config_loaded) * 1000)
+
+
+def when_ready(server):
+    if server.cfg.workers > 1:
+        check_shared_caches(server)
+    if not preload_app:
+        return
+    from authentication.startup import warm_up
+
+    started = time.perf_counter()
+    timings = warm_up()
+    server.log.info(
+        'Warm-up before fork: %.0f ms (%s)', (time.perf_counter() - started) * 1000,
+        ', '.join(f'{name} {seconds * 1000:.0f} ms' for name, seconds in timings.items()),
+    )
+
+
+def check_shared_caches(server):
+    import django
+
+    os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'auth.settings')
+    django.setup()
+    from authentication.checks import shared_cache_errors
+
+    # Число воркеров из конфигурации gunicorn: -w мог переопределить WEB_CONCURRENCY
+    for error in shared_cache_errors(server.cfg.workers):
+        server.log.warning('%s: %s %s', error.id, error.msg, error.hint)
+
+
+def post_fork(server, worker):
+    worker.first_request_started = None
+    worker.first_request_done = False
+
+
+def post_worker_init(worker):
+    # Поток записи last_login/last_seen — в каждом воркере после загрузки приложения, не в мастере
+    from authentication.activity import user_activity
+
+    user_activity.start_flusher()
+
+
+def worker_exit(server, worker):
+    from authentication.activity import user_activity
+
+    user_activity.flush()
+
+
+def pre_request(worker, req):
+    if not worker.first_request_done and worker.first_request_started is None:
+        worker.first_request_started = time.perf_counter()
+
+
+def post_request(worker, req, environ, resp):
+    if not worker.first_request_done:
+        worker.first_request_done = True
+        worker.log.info(
+            'Worker %s first request %s %s: %.1f ms', worker.pid, req.method, req.path,
+            (time.perf_counter() - worker.first_request_started) * 1000,
+        )